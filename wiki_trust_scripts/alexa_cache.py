@@ -0,0 +1,194 @@
+import io, hashlib, threading, time
+from content_cache import ContentCache
+
+# least recently used objects are evicted once the cache passes this size
+MAX_CACHE_BYTES = 5 * 2 ** 30
+
+class AlexaCache(ContentCache):
+	"""
+	Local disk cache of S3 objects. Each object is stored under the hash of its bucket and key,
+	and a sqlite index records its size, content hash and last access time for eviction and integrity checks.
+	Triggers keep the total size of the cache in cache_stats, so checking it does not scan the index
+	"""
+
+	INDEX_SCHEMA = [
+		"""
+		CREATE TABLE IF NOT EXISTS objects (
+			object_id TEXT PRIMARY KEY,
+			content_hash TEXT NOT NULL,
+			size INTEGER NOT NULL,
+			accessed_at REAL NOT NULL
+		)
+		""",
+		"CREATE INDEX IF NOT EXISTS objects_accessed_at ON objects (accessed_at)",
+		"""
+		CREATE TABLE IF NOT EXISTS cache_stats (
+			id INTEGER PRIMARY KEY CHECK (id = 0),
+			total_bytes INTEGER NOT NULL
+		)
+		""",
+
+		# caches created before the running total existed start from the size of what they hold
+		"INSERT OR IGNORE INTO cache_stats SELECT 0, COALESCE(SUM(size), 0) FROM objects",
+		"""
+		CREATE TRIGGER IF NOT EXISTS objects_insert AFTER INSERT ON objects
+		BEGIN UPDATE cache_stats SET total_bytes = total_bytes + NEW.size WHERE id = 0; END
+		""",
+		"""
+		CREATE TRIGGER IF NOT EXISTS objects_delete AFTER DELETE ON objects
+		BEGIN UPDATE cache_stats SET total_bytes = total_bytes - OLD.size WHERE id = 0; END
+		"""
+	]
+
+	def __init__(self, cache_dir, max_bytes = MAX_CACHE_BYTES):
+		super().__init__(cache_dir)
+		self.max_bytes = max_bytes
+		self.evict_lock = threading.Lock()
+
+	def generate_object_id(self, bucket_name, key):
+		"""
+		Creates id of an S3 object in the cache
+
+		Parameters
+		----------
+		bucket_name: str, name of S3 bucket
+		key: str, key of the object in the bucket
+
+		Returns
+		-------
+		object_id: str, sha256 hex digest of the bucket and key
+		"""
+		object_id = hashlib.sha256(f"{bucket_name}/{key}".encode("utf-8")).hexdigest()
+		return object_id
+
+	def remove(self, object_id):
+		"""
+		Deletes an object from the cache
+
+		Parameters
+		----------
+		object_id: str, id of the object in the cache
+		"""
+		connection = self.get_index_connection()
+		connection.execute("DELETE FROM objects WHERE object_id = ?", (object_id,))
+		connection.commit()
+
+		self.delete_object(object_id)
+
+	def load(self, bucket_name, key):
+		"""
+		Reads a cached object, dropping it if its content no longer matches its hash
+
+		Parameters
+		----------
+		bucket_name: str, name of S3 bucket
+		key: str, key of the object in the bucket
+
+		Returns
+		-------
+		body: bytes, content of the object, None if the object is not cached
+		"""
+		object_id = self.generate_object_id(bucket_name, key)
+		connection = self.get_index_connection()
+		row = connection.execute("SELECT content_hash FROM objects WHERE object_id = ?", (object_id,)).fetchone()
+
+		if row is None:
+			return None
+
+		body = self.read_object(object_id)
+		if body is None or hashlib.sha256(body).hexdigest() != row[0]:
+			self.remove(object_id)
+			return None
+
+		connection.execute("UPDATE objects SET accessed_at = ? WHERE object_id = ?", (time.time(), object_id))
+		connection.commit()
+		return body
+
+	def store(self, bucket_name, key, body):
+		"""
+		Writes an object to the cache, evicting least recently used objects if the cache is full
+
+		Parameters
+		----------
+		bucket_name: str, name of S3 bucket
+		key: str, key of the object in the bucket
+		body: bytes, content of the object
+		"""
+		object_id = self.generate_object_id(bucket_name, key)
+		self.write_object(object_id, body)
+
+		# delete and insert rather than replace, so the triggers see the old size go and the new one arrive
+		connection = self.get_index_connection()
+		connection.execute("DELETE FROM objects WHERE object_id = ?", (object_id,))
+		connection.execute("INSERT INTO objects VALUES (?, ?, ?, ?)",
+			(object_id, hashlib.sha256(body).hexdigest(), len(body), time.time()))
+		connection.commit()
+
+		self.evict()
+
+	def get_total_bytes(self):
+		"""
+		Gets the total size of the cached objects
+
+		Returns
+		-------
+		total_bytes: int, sum of the sizes of every cached object
+		"""
+		total_bytes = self.get_index_connection().execute("SELECT total_bytes FROM cache_stats WHERE id = 0").fetchone()[0]
+		return total_bytes
+
+	def evict(self):
+		"""
+		Deletes least recently used objects until the cache is within its size bound
+		"""
+		if self.get_total_bytes() <= self.max_bytes:
+			return
+
+		with self.evict_lock:
+			connection = self.get_index_connection()
+			total_bytes = self.get_total_bytes()
+
+			evicted_ids = []
+			for object_id, size in connection.execute("SELECT object_id, size FROM objects ORDER BY accessed_at"):
+				if total_bytes <= self.max_bytes:
+					break
+				evicted_ids.append(object_id)
+				total_bytes -= size
+
+			for object_id in evicted_ids:
+				self.remove(object_id)
+
+class CachedS3Client(object):
+	"""
+	Read-through, write-through cache in front of a boto S3 client. get_object is served from disk when possible
+	and put_object writes to both S3 and disk, every other call goes straight to the client
+	"""
+
+	def __init__(self, s3_object, cache):
+		self.s3_object = s3_object
+		self.cache = cache
+
+	def __getattr__(self, name):
+		return getattr(self.s3_object, name)
+
+	def get_object(self, Bucket, Key, **kwargs):
+
+		# partial reads are not cached, the cache only holds whole objects
+		if "Range" in kwargs:
+			return self.s3_object.get_object(Bucket=Bucket, Key=Key, **kwargs)
+
+		body = self.cache.load(Bucket, Key)
+		if body is not None:
+			return {"Body":io.BytesIO(body), "ContentLength":len(body)}
+
+		response = self.s3_object.get_object(Bucket=Bucket, Key=Key, **kwargs)
+		body = response["Body"].read()
+		self.cache.store(Bucket, Key, body)
+
+		response["Body"] = io.BytesIO(body)
+		return response
+
+	def put_object(self, Body, Bucket, Key, **kwargs):
+		response = self.s3_object.put_object(Body=Body, Bucket=Bucket, Key=Key, **kwargs)
+		self.cache.store(Bucket, Key, Body if isinstance(Body, bytes) else Body.encode())
+		return response
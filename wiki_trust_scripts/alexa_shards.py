@@ -0,0 +1,347 @@
+import os, gzip, mmap, threading, datetime, uuid, argparse
+from concurrent.futures import ThreadPoolExecutor
+
+# shards are closed and a new one started once they pass this size
+MAX_SHARD_BYTES = 2 ** 28
+
+# key prefix of shards in the S3 bucket
+SHARD_PREFIX = "alexa_shards"
+
+def generate_shard_name():
+	"""
+	Creates a unique shard name that sorts in the order shards were written
+
+	Returns
+	-------
+	shard_name: str, name of the shard
+	"""
+	shard_name = f"shard-{datetime.datetime.utcnow().strftime('%Y%m%d%H%M%S%f')}-{uuid.uuid4().hex[:8]}"
+	return shard_name
+
+def generate_shard_paths(shard_dir, shard_name):
+	"""
+	Creates local paths of a shard and its offset index
+
+	Parameters
+	----------
+	shard_dir: str, local directory of the shards
+	shard_name: str, name of the shard
+
+	Returns
+	-------
+	shard_path: str, path of the shard file
+	index_path: str, path of the shard's offset index
+	"""
+	shard_path = os.path.join(shard_dir, f"{shard_name}.gz")
+	index_path = os.path.join(shard_dir, f"{shard_name}.idx")
+	return shard_path, index_path
+
+def generate_shard_keys(shard_name):
+	"""
+	Creates S3 keys of a shard and its offset index
+
+	Parameters
+	----------
+	shard_name: str, name of the shard
+
+	Returns
+	-------
+	shard_key: str, key of the shard file
+	index_key: str, key of the shard's offset index
+	"""
+	shard_key = f"{SHARD_PREFIX}/{shard_name}.gz"
+	index_key = f"{SHARD_PREFIX}/{shard_name}.idx"
+	return shard_key, index_key
+
+class ShardWriter(object):
+	"""
+	Packs alexa documents into compressed shards. Each document is its own gzip member, so a single document
+	can be decompressed from its offset and length alone. Shards are built locally and uploaded to S3,
+	shard first and index second, so an index never points at data that is not there
+	"""
+
+	def __init__(self, shard_dir, s3_object = None, bucket_name = 'wiki-trust-bucket', max_shard_bytes = MAX_SHARD_BYTES):
+		os.makedirs(shard_dir, exist_ok = True)
+		self.shard_dir = shard_dir
+		self.s3_object = s3_object
+		self.bucket_name = bucket_name
+		self.max_shard_bytes = max_shard_bytes
+		self.lock = threading.Lock()
+		self.shard_name = None
+		self.num_closed = 0
+
+	def open_next_shard(self):
+		self.shard_name = generate_shard_name()
+		shard_path, index_path = generate_shard_paths(self.shard_dir, self.shard_name)
+		self.shard_file = open(shard_path, "wb")
+		self.index_file = open(index_path, "w", encoding = "utf-8")
+
+	def close_shard(self):
+		self.shard_file.close()
+		self.index_file.close()
+
+		if self.s3_object is not None:
+			shard_key, index_key = generate_shard_keys(self.shard_name)
+			shard_path, index_path = generate_shard_paths(self.shard_dir, self.shard_name)
+			self.s3_object.upload_file(shard_path, self.bucket_name, shard_key)
+			self.s3_object.upload_file(index_path, self.bucket_name, index_key)
+
+		self.shard_name = None
+		self.num_closed += 1
+
+	def append(self, domain, document):
+		"""
+		Adds a document to the current shard
+
+		Parameters
+		----------
+		domain: str, full domain string (eg. www.wikipedia.org)
+		document: bytes, alexa xml of the domain
+		"""
+		record = gzip.compress(document)
+
+		with self.lock:
+			if self.shard_name is None:
+				self.open_next_shard()
+
+			offset = self.shard_file.tell()
+			self.shard_file.write(record)
+			self.index_file.write(f"{domain}\t{offset}\t{len(record)}\n")
+
+			if self.shard_file.tell() > self.max_shard_bytes:
+				self.close_shard()
+
+	def count_shards_to_close(self):
+		"""
+		Counts the shards that will have been closed once every document appended so far is stored
+
+		Returns
+		-------
+		num_shards: int, value num_closed reaches when the documents appended so far can be read
+		"""
+		with self.lock:
+			num_shards = self.num_closed + (1 if self.shard_name is not None else 0)
+
+		return num_shards
+
+	def flush(self):
+		"""
+		Closes and uploads the current shard, so every document appended so far can be read
+		"""
+		with self.lock:
+			if self.shard_name is not None:
+				self.close_shard()
+
+	def close(self):
+		self.flush()
+
+class ShardReader(object):
+	"""
+	Reads alexa documents out of shards, from the local shard directory when a shard is there and from S3 otherwise.
+	Single documents are read with a memory map or a ranged get, full scans read each shard once front to back
+	"""
+
+	def __init__(self, shard_dir = None, s3_object = None, bucket_name = 'wiki-trust-bucket'):
+		self.shard_dir = shard_dir
+		self.s3_object = s3_object
+		self.bucket_name = bucket_name
+		self.index = None
+		self.maps = {}
+		self.lock = threading.Lock()
+
+	def list_shards(self):
+		"""
+		Lists shards in the order they were written
+
+		Returns
+		-------
+		shard_names: str array, names of the shards
+		"""
+		shard_names = set()
+
+		if self.shard_dir is not None and os.path.isdir(self.shard_dir):
+			shard_names.update(filename[:-4] for filename in os.listdir(self.shard_dir) if filename.endswith(".idx"))
+
+		if self.s3_object is not None:
+			paginator = self.s3_object.get_paginator("list_objects_v2")
+			for page in paginator.paginate(Bucket = self.bucket_name, Prefix = f"{SHARD_PREFIX}/"):
+				shard_names.update(item["Key"][len(SHARD_PREFIX) + 1:-4] for item in page.get("Contents", [])
+					if item["Key"].endswith(".idx"))
+
+		return sorted(shard_names)
+
+	def read_shard_index(self, shard_name):
+		"""
+		Reads the offset index of a shard
+
+		Parameters
+		----------
+		shard_name: str, name of the shard
+
+		Returns
+		-------
+		entries: array, (domain, offset, length) tuples of the documents in the shard
+		"""
+		shard_path, index_path = generate_shard_paths(self.shard_dir or "", shard_name)
+		if self.shard_dir is not None and os.path.exists(index_path):
+			with open(index_path, encoding = "utf-8") as index_file:
+				index_text = index_file.read()
+		else:
+			_, index_key = generate_shard_keys(shard_name)
+			index_text = self.s3_object.get_object(Bucket = self.bucket_name, Key = index_key)["Body"].read().decode("utf-8")
+
+		entries = []
+		for line in index_text.splitlines():
+			domain, offset, length = line.split("\t")
+			entries.append((domain, int(offset), int(length)))
+
+		return entries
+
+	def load_index(self):
+		"""
+		Finds the latest stored document of every domain
+
+		Returns
+		-------
+		index: dict, domain to (shard_name, offset, length) tuple
+		"""
+		if self.index is None:
+			index = {}
+			for shard_name in self.list_shards():
+				for domain, offset, length in self.read_shard_index(shard_name):
+					index[domain] = (shard_name, offset, length)
+			self.index = index
+
+		return self.index
+
+	def get_local_map(self, shard_name):
+		"""
+		Gets a memory map of a local shard
+
+		Parameters
+		----------
+		shard_name: str, name of the shard
+
+		Returns
+		-------
+		shard_map: mmap, read only map of the shard, None if the shard is not on local disk
+		"""
+		if self.shard_dir is None:
+			return None
+
+		with self.lock:
+			if shard_name not in self.maps:
+				shard_path, _ = generate_shard_paths(self.shard_dir, shard_name)
+				if not os.path.exists(shard_path):
+					return None
+				with open(shard_path, "rb") as shard_file:
+					self.maps[shard_name] = mmap.mmap(shard_file.fileno(), 0, access = mmap.ACCESS_READ)
+
+		return self.maps[shard_name]
+
+	def read(self, domain):
+		"""
+		Reads the document of a single domain
+
+		Parameters
+		----------
+		domain: str, full domain string (eg. www.wikipedia.org)
+
+		Returns
+		-------
+		document: bytes, alexa xml of the domain, None if the domain is not stored
+		"""
+		entry = self.load_index().get(domain)
+		if entry is None:
+			return None
+
+		shard_name, offset, length = entry
+		shard_map = self.get_local_map(shard_name)
+		if shard_map is not None:
+			record = shard_map[offset:offset + length]
+		else:
+			shard_key, _ = generate_shard_keys(shard_name)
+			record = self.s3_object.get_object(Bucket = self.bucket_name, Key = shard_key,
+				Range = f"bytes={offset}-{offset + length - 1}")["Body"].read()
+
+		document = gzip.decompress(record)
+		return document
+
+	def iterate_documents(self, domains = None):
+		"""
+		Reads stored documents shard by shard, each shard in one sequential read
+
+		Parameters
+		----------
+		domains: set, domains to read, None for every stored domain
+
+		Returns
+		-------
+		documents: generator, yields tuples of domain and alexa xml
+		"""
+		shard_entries = {}
+		for domain, (shard_name, offset, length) in self.load_index().items():
+			if domains is None or domain in domains:
+				shard_entries.setdefault(shard_name, []).append((domain, offset, length))
+
+		for shard_name in sorted(shard_entries):
+			entries = sorted(shard_entries[shard_name], key = lambda entry: entry[1])
+
+			shard_data = self.get_local_map(shard_name)
+			if shard_data is None:
+				shard_key, _ = generate_shard_keys(shard_name)
+				shard_data = self.s3_object.get_object(Bucket = self.bucket_name, Key = shard_key)["Body"].read()
+
+			for domain, offset, length in entries:
+				yield domain, gzip.decompress(shard_data[offset:offset + length])
+
+	def close(self):
+		for shard_map in self.maps.values():
+			shard_map.close()
+		self.maps = {}
+
+def pack_alexa_objects(shard_dir, bucket_name = 'wiki-trust-bucket', num_workers = 16, upload = True):
+	"""
+	Packs the per-domain alexa objects in the S3 bucket into shards
+
+	Parameters
+	----------
+	shard_dir: str, local directory the shards are built in
+	bucket_name: str, name of S3 bucket
+	num_workers: int, number of threads downloading objects
+	upload: bool, upload the shards to the bucket, otherwise only keep them locally
+	"""
+	from get_domain_data import initiate_s3_object
+
+	s3_object = initiate_s3_object(bucket_name, max_pool_connections = num_workers)
+	writer = ShardWriter(shard_dir, s3_object if upload else None, bucket_name)
+
+	def pack_object(key):
+		document = s3_object.get_object(Bucket = bucket_name, Key = key)["Body"].read()
+		writer.append(key[len("alexa_data/"):-len(".html")], document)
+
+	paginator = s3_object.get_paginator("list_objects_v2")
+	count = 0
+	with ThreadPoolExecutor(num_workers) as executor:
+		for page in paginator.paginate(Bucket = bucket_name, Prefix = "alexa_data/"):
+			keys = [item["Key"] for item in page.get("Contents", []) if item["Key"].endswith(".html")]
+			list(executor.map(pack_object, keys))
+
+			count += len(keys)
+			print(f"{count} documents packed...")
+
+	writer.close()
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument('-d', '--shard_dir', nargs = 1, type = str)
+	parser.add_argument('-w', '--num_workers', nargs = '?', type = int, default = 16)
+	parser.add_argument('-l', '--local', action = 'store_true')
+
+	args = parser.parse_args()
+	params = {}
+	params["shard_dir"] = args.shard_dir[0]
+	params["num_workers"] = args.num_workers
+	params["upload"] = not args.local
+
+	pack_alexa_objects(**params)
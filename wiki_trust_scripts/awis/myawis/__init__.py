@@ -1,10 +1,19 @@
+import asyncio
 import datetime
 import hashlib
 import hmac
+import random
+import time
 
 import requests  # pip install requests
 import xmltodict
 from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+
+try:
+    import aiohttp  # optional, only needed for the async calls
+except ImportError:
+    aiohttp = None
 
 try:
     from urllib import quote, urlencode
@@ -16,6 +25,14 @@ URLINFO_RESPONSE_GROUPS = ",".join(
      "UsageStats", "Speed", "Language", "OwnedDomains", "LinksInCount",
      "SiteData", "AdultContent"])
 
+# max number of urls AWIS accepts in one batch request
+URLINFO_BATCH_SIZE = 5
+
+AWIS_ENDPOINT = 'https://awis.amazonaws.com/api'
+
+# throttled or failed requests that are worth repeating
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
 TRAFFICINFO_RESPONSE_GROUPS = "History"
 CATEGORYBROWSE_RESPONSE_GROUPS = ",".join(["Categories", "RelatedCategories", "LanguageCategories", "LetterBars"])
 SITESLINKINGIN_RESPONSE_GROUPS = "SitesLinkingIn"
@@ -27,9 +44,30 @@ def is_string(obj):
         return isinstance(obj, str)  # python 3
 
 class CallAwis(object):
-    def __init__(self, access_id, secret_access_key):
+    def __init__(self, access_id, secret_access_key, endpoint=AWIS_ENDPOINT, timeout=30, max_retries=5,
+                 backoff_factor=0.5, pool_size=10):
+        '''
+        :param endpoint: URL requests are sent to
+        :param timeout: seconds to wait for a response before retrying
+        :param max_retries: number of times a throttled, failed or timed out request is repeated
+        :param backoff_factor: seconds to wait before the first retry, doubled on every retry after
+        :param pool_size: number of keep-alive connections held open, set to the number of calling threads
+        '''
         self.access_id = access_id
         self.secret_access_key = secret_access_key
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+
+        # one session so connections are reused between requests
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        # the signing key only changes with the date, so it is derived once per day
+        self.signing_key = (None, None)
 
     def create_v4_signature(self, request_params):
         '''
@@ -43,7 +81,7 @@ class CallAwis(object):
         service = 'awis'
         host = 'awis.us-west-1.amazonaws.com'
         region = 'us-west-1'
-        endpoint = 'https://awis.amazonaws.com/api'
+        endpoint = self.endpoint
         request_parameters = urlencode([(key, request_params[key]) for key in sorted(request_params.keys())])
 
         # Key derivation functions. See:
@@ -76,8 +114,11 @@ class CallAwis(object):
         credential_scope = datestamp + '/' + region + '/' + service + '/' + 'aws4_request'
         string_to_sign = algorithm + '\n' +  amzdate + '\n' +  credential_scope + '\n' +  hashlib.sha256(canonical_request.encode('utf8')).hexdigest()
 
-        # Calculate signature
-        signing_key = getSignatureKey(self.secret_access_key, datestamp, region, service)
+        # Calculate signature, reusing the key derived for today
+        key_datestamp, signing_key = self.signing_key
+        if key_datestamp != datestamp:
+            signing_key = getSignatureKey(self.secret_access_key, datestamp, region, service)
+            self.signing_key = (datestamp, signing_key)
 
         # Sign the string_to_sign using the signing_key
         signature = hmac.new(signing_key, (string_to_sign).encode('utf-8'), hashlib.sha256).hexdigest()
@@ -104,8 +145,28 @@ class CallAwis(object):
             'ResponseGroup': response_group
         }
 
-        url, headers = self.create_v4_signature(params)
-        return self.return_output(url, headers)
+        return self.request(params)
+
+    def urlinfo_batch(self, domains, response_group = URLINFO_RESPONSE_GROUPS):
+        '''
+        Provide information about up to five domains in a single request
+        :param domains: list of valid URLs, at most URLINFO_BATCH_SIZE
+        :param response_group: Any valid urlinfo response group, shared by all domains
+        :return: list of XML responses in the same order as domains, each shaped like a single urlinfo response
+        '''
+        if len(domains) > URLINFO_BATCH_SIZE:
+            raise ValueError("AWIS accepts at most %d urls per batch request" % URLINFO_BATCH_SIZE)
+
+        params = {
+            'Action': "UrlInfo",
+            'UrlInfo.Shared.ResponseGroup': response_group
+        }
+        for i, domain in enumerate(domains):
+            params['UrlInfo.%d.Url' % (i + 1)] = domain
+
+        soup = self.request(params)
+        return [BeautifulSoup('<aws:urlinforesponse>%s</aws:urlinforesponse>' % response, 'html.parser')
+                for response in soup.find_all('aws:response')]
 
     def traffichistory(self, domain, response_group=TRAFFICINFO_RESPONSE_GROUPS, myrange=31, start=20070801):
         '''
@@ -122,8 +183,7 @@ class CallAwis(object):
             'Start': start,
         }
 
-        url, headers = self.create_v4_signature(params)
-        return self.return_output(url, headers)
+        return self.request(params)
     
     def siteslinkingin(self, domain, response_group=SITESLINKINGIN_RESPONSE_GROUPS):
         
@@ -133,8 +193,7 @@ class CallAwis(object):
             'ResponseGroup': response_group,
         }
 
-        url, headers = self.create_v4_signature(params)
-        return self.return_output(url, headers)
+        return self.request(params)
         
     def cat_browse(self, domain, path, response_group=CATEGORYBROWSE_RESPONSE_GROUPS, descriptions='True'):
         '''
@@ -151,24 +210,176 @@ class CallAwis(object):
             'Descriptions': descriptions
         }
 
-        url, headers = self.create_v4_signature(params)
-        return self.return_output(url, headers)
+        return self.request(params)
+
+    async def urlinfo_async(self, domain, response_group=URLINFO_RESPONSE_GROUPS, session=None):
+        '''
+        Async version of urlinfo
+        :param session: aiohttp ClientSession to send the request with, a new one is opened if None
+        '''
+        params = {
+            'Action': "UrlInfo",
+            'Url': domain,
+            'ResponseGroup': response_group
+        }
+
+        return await self.request_async(params, session)
+
+    async def traffichistory_async(self, domain, response_group=TRAFFICINFO_RESPONSE_GROUPS, myrange=31, start=20070801,
+                             session=None):
+        '''
+        Async version of traffichistory
+        :param session: aiohttp ClientSession to send the request with, a new one is opened if None
+        '''
+        params = {
+            'Action': "TrafficHistory",
+            'Url': domain,
+            'ResponseGroup': response_group,
+            'Range': myrange,
+            'Start': start,
+        }
+
+        return await self.request_async(params, session)
+
+    def backoff_time(self, attempt):
+        '''
+        Seconds to wait before a retry, doubling with every attempt and jittered so threads do not retry in step
+        '''
+        return self.backoff_factor * (2 ** attempt) * random.uniform(0.5, 1.5)
+
+    def should_retry(self, status_code, text):
+        '''
+        Whether a response was throttled or failed on the server side
+        '''
+        return status_code in RETRY_STATUS_CODES or (status_code == 400 and 'Throttl' in text)
+
+    def request(self, params):
+        '''
+        Signs and sends a request, backing off and retrying on throttling, server errors and timeouts.
+        The request is signed again on every attempt so its timestamp stays fresh
+        :param params: dictionary of request parameters
+        :return: response in XML format
+        '''
+        for attempt in range(self.max_retries + 1):
+            url, headers = self.create_v4_signature(params)
+            try:
+                r = self.session.get(url, headers=headers, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.max_retries:
+                    raise
+            else:
+                if not self.should_retry(r.status_code, r.text):
+                    return self.parse_output(r.text)
+                if attempt == self.max_retries:
+                    r.raise_for_status()
+                    raise requests.HTTPError("%d error after %d retries" % (r.status_code, self.max_retries))
+
+            time.sleep(self.backoff_time(attempt))
+
+    async def request_async(self, params, session=None):
+        '''
+        Async version of request
+        :param params: dictionary of request parameters
+        :param session: aiohttp ClientSession to send the request with, a new one is opened if None
+        :return: response in XML format
+        '''
+        if aiohttp is None:
+            raise ImportError("aiohttp is required for async requests")
+
+        if session is None:
+            async with aiohttp.ClientSession() as session:
+                return await self.request_async(params, session)
+
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        for attempt in range(self.max_retries + 1):
+            url, headers = self.create_v4_signature(params)
+            try:
+                async with session.get(url, headers=headers, timeout=timeout) as r:
+                    text = await r.text()
+                    status_code = r.status
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt == self.max_retries:
+                    raise
+            else:
+                if not self.should_retry(status_code, text):
+                    return self.parse_output(text)
+                if attempt == self.max_retries:
+                    raise requests.HTTPError("%d error after %d retries" % (status_code, self.max_retries))
+
+            await asyncio.sleep(self.backoff_time(attempt))
 
     def return_output(self, url, headers):
-        r = requests.get(url, headers=headers)
-        soup = BeautifulSoup(r.text.encode('utf-8'), 'html.parser')
+        r = self.session.get(url, headers=headers, timeout=self.timeout)
+        return self.parse_output(r.text)
+
+    def parse_output(self, text):
+        soup = BeautifulSoup(text.encode('utf-8'), 'html.parser')
         return soup
 
 
-def flatten_urlinfo(urlinfo, shorter_keys=True):
-    """ Takes a urlinfo object and returns a flat dictionary."""
+def find_key(mapping, name):
+    '''
+    Finds a key in a parsed element ignoring case, since stored responses may have been lowercased
+    :param mapping: dict of a parsed element
+    :param name: key to look for
+    :return: the key as it appears in mapping, None if it is not there
+    '''
+    for key in mapping:
+        if key.lower() == name.lower():
+            return key
+    return None
+
+
+def find_element(value, name):
+    '''
+    Finds the first element with a name anywhere below a parsed element, ignoring case
+    '''
+    if isinstance(value, list):
+        for v in value:
+            found = find_element(v, name)
+            if found is not None:
+                return found
+        return None
+
+    if not isinstance(value, dict):
+        return None
+
+    key = find_key(value, name)
+    if key is not None:
+        return value[key]
+
+    for v in value.values():
+        found = find_element(v, name)
+        if found is not None:
+            return found
+    return None
+
+
+def get_time_range(statistic):
+    '''
+    Takes the time range out of a parsed usage statistic
+    :param statistic: dict of a parsed usage statistic, its time range is popped from it
+    :return: the time range as unit and count joined by a dot (eg. Months.3), None if the statistic has none
+    '''
+    time_range_key = find_key(statistic, "TimeRange") if isinstance(statistic, dict) else None
+    if time_range_key is None:
+        return None
+
+    time_range = statistic.pop(time_range_key)
+    if not isinstance(time_range, dict) or not time_range:
+        return None
+
+    # python 3 odict_items don't support indexing
+    unit, count = tuple(time_range.items())[0]
+    return ".".join([unit, str(count)])
+
+
+def flatten_urlinfo(urlinfo, shorter_keys=True, lowercase_keys=False):
+    """ Takes a urlinfo response as bytes, str or a BeautifulSoup object and returns a flat dictionary.
+    Raw bytes are parsed once with no intermediate soup, element names are matched in any case and namespace
+    prefixes are dropped, so responses lowercased by html.parser flatten the same way as fresh ones."""
     def flatten(value, prefix=""):
-        if is_string(value):
-            _result[prefix[1:]] = value
-            return
-        try:
-            len(value)
-        except (AttributeError, TypeError):  # a leaf
+        if value is None or is_string(value):
             _result[prefix[1:]] = value
             return
 
@@ -179,29 +390,47 @@ def flatten_urlinfo(urlinfo, shorter_keys=True):
             if shorter_keys:
                 prefix = "." + last_prefix
 
-            if last_prefix == "Country":
+            if last_prefix.lower() == "country":
                 for v in value:
-                    country = v.pop("@Code")
+                    code_key = find_key(v, "@Code") if isinstance(v, dict) else None
+                    # a country without a code has nothing to be keyed by, so it is left out
+                    if code_key is None or not v[code_key]:
+                        continue
+                    country = v.pop(code_key)
                     flatten(v, ".".join([prefix, country]))
-            elif last_prefix in ["RelatedLink", "CategoryData"]:
+            elif last_prefix.lower() in ["relatedlink", "categorydata"]:
                 for i, v in enumerate(value):
                     flatten(v, ".".join([prefix, str(i)]))
-            elif value[0].get("TimeRange"):
+            elif any(isinstance(v, dict) and find_key(v, "TimeRange") for v in value):
                 for v in value:
-                    time_range = ".".join(tuple(v.pop("TimeRange").items())[0])
-                    # python 3 odict_items don't support indexing
-                    if v.get("DataUrl"):
-                        time_range = ".".join([v.pop("DataUrl"), time_range])
+                    time_range = get_time_range(v)
+                    # a statistic without a time range has nothing to be keyed by, so it is left out
+                    if time_range is None:
+                        continue
+                    data_url_key = find_key(v, "DataUrl")
+                    if data_url_key and v.get(data_url_key):
+                        time_range = ".".join([v.pop(data_url_key), time_range])
                     flatten(v, ".".join([prefix, time_range]))
             else:
                 msg = prefix + " contains a list we don't know how to flatten."
-                raise NotImplementedError(msg)
+                raise ValueError(msg)
         else:  # a dict, go one level deeper
             for k, v in items:
                 flatten(v, ".".join([prefix, k]))
 
+    def strip_prefix(path, key, value):
+        key = key.split(":")[-1]
+        return (key.lower() if lowercase_keys else key), value
+
+    if isinstance(urlinfo, BeautifulSoup):
+        urlinfo = str(urlinfo)
+
     _result = {}
-    info = xmltodict.parse(str(urlinfo))
-    flatten(info["aws:UrlInfoResponse"]["Response"]["UrlInfoResult"]["Alexa"])
+    info = xmltodict.parse(urlinfo, postprocessor=strip_prefix)
+    alexa = find_element(info, "Alexa")
+    if alexa is None:
+        raise ValueError("urlinfo response has no Alexa element")
+
+    flatten(alexa)
     _result["OutputTimestamp"] = datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
     return _result
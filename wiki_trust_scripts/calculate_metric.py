@@ -1,9 +1,11 @@
 import pandas as pd
 import numpy as np
-from sklearn.linear_model import LinearRegression
-from db_helpers import get_db_connection
+from db_helpers import db_session
 import argparse, sys
 
+# rank types and the pandas rank method giving each, ordinal ranks break ties by row position
+RANK_METHODS = {"ordinal":"first", "dense":"dense", "percentile":"average"}
+
 def print_results(df, metric, label):
 	"""
 	Prints dataframe results
@@ -16,8 +18,27 @@ def print_results(df, metric, label):
 	"""
 	print(f"\n{label}\n------")
 
-	for index, row in df.iterrows():
-		print(f"{row['domain']}, {row[metric]}")
+	for domain, value in zip(df["domain"], df[metric]):
+		print(f"{domain}, {value}")
+
+def get_extremes(df, metric, results_num = 10):
+	"""
+	Selects rows with the highest and lowest values of a metric, with partial sorts instead of a full sort
+
+	Parameters
+	----------
+	df: Pandas dataframe, dataframe to select rows from
+	metric: str, name of metric - must be column in dataframe
+	results_num: int, number of top and bottom rows to select
+
+	Returns
+	-------
+	top: Pandas dataframe, rows with the highest values, highest first
+	bottom: Pandas dataframe, rows with the lowest values, lowest last
+	"""
+	top = df.nlargest(results_num, metric)
+	bottom = df.nsmallest(results_num, metric).iloc[::-1]
+	return top, bottom
 
 def results_quick_view(df_main, metric,results_num = 10):
 	"""
@@ -30,33 +51,125 @@ def results_quick_view(df_main, metric,results_num = 10):
 	results_num: int, number of top and bottom results to display
 	"""
 
-	df = df_main[df_main["news_site"] == True].copy()
-	df.sort_values(metric, inplace = True, ascending = False)
-	display_columns = df[["domain", metric]]
+	df = df_main.loc[df_main["news_site"] == True, ["domain", metric]]
+	top, bottom = get_extremes(df, metric, results_num)
 
-	print_results(display_columns.head(results_num), metric, f"Top {results_num}")
-	print_results(display_columns.tail(results_num), metric, f"Bottom {results_num}")
+	print_results(top, metric, f"Top {results_num}")
+	print_results(bottom, metric, f"Bottom {results_num}")
 
-def get_rank(df, metrics, metric_sort_ascending):
+def get_rank(df, metrics, metric_sort_ascending, rank_types = ("ordinal",)):
 	"""
-	Gets ordinal rank for each domain in dataframe based on specific metric
+	Gets ranks for each domain in dataframe based on several metrics at once, keeping the row order.
+	Ordinal and dense ranks start at 0, percentile ranks run up to 1 in the same order, missing values rank last
 
 	Parameters
 	----------
 	df: Pandas dataframe, dataframe to display results from - must have domain column
 	metric: str array, array of metric_names - must be column in dataframe
 	metric_sort_ascending: bool array, sort metric ascending
+	rank_types: str array, types of rank to add - ordinal, dense or percentile
 
 	Returns
 	-------
-	df: Pandas dataframe, dataframe to display results from - must have domain column
+	df: Pandas dataframe, copy of dataframe with a {metric}_{rank_type}_rank column for each metric and rank type
 	"""
-	for metric, metric_sort in zip(metrics, metric_sort_ascending):
-		df = df.sort_values(metric, ascending = metric_sort)
-		df = df.reset_index().drop("index", axis = 1).reset_index()
-		df.rename(columns = {"index":f"{metric}_ordinal_rank"}, inplace = True)
+	df = df.copy()
+
+	# descending metrics are negated so every metric is ranked in the same call
+	signs = np.where(metric_sort_ascending, 1, -1)
+	values = df[metrics].astype(float) * signs
+
+	for rank_type in rank_types:
+		if rank_type == "percentile":
+			ranks = values.rank(pct = True, na_option = "bottom")
+		else:
+			ranks = values.rank(method = RANK_METHODS[rank_type], na_option = "bottom").astype(int) - 1
+
+		for metric in metrics:
+			df[f"{metric}_{rank_type}_rank"] = ranks[metric]
+
 	return df
 
+def transform_columns(values, log_flags):
+	"""
+	Stacks a column for each transform of the same values
+
+	Parameters
+	----------
+	values: numpy array, values to transform
+	log_flags: bool array, take log of the values for each column
+
+	Returns
+	-------
+	columns: numpy array, n x k array with one transformed column per flag, -inf or nan where the log of
+		a value is undefined
+	"""
+	values = np.asarray(values, dtype = float)
+	with np.errstate(divide = "ignore", invalid = "ignore"):
+		log_values = np.log(values) if any(log_flags) else None
+	columns = np.column_stack([log_values if log_flag else values for log_flag in log_flags])
+	return columns
+
+def fit_residuals(X, y, transforms = ((True, True),), groups = None, reversal = True):
+	"""
+	Calculates residuals of single feature least squares fits for several transforms at once, using the
+	closed form slope and intercept. With groups, a separate fit is made within each group.
+	Values that cannot be transformed (eg. the log of a zero count) are left out of their fit and get a nan residual
+
+	Parameters
+	----------
+	X: numpy array, feature array
+	y: numpy array, outcome array
+	transforms: array, (log_X, log_y) tuple for each fit
+	groups: numpy array, group label of each value (eg. language), None for a single fit
+	reversal: bool, reverse signs of residuals
+
+	Returns
+	-------
+	residuals: numpy array, n x k array with the residuals of each fit in its own column
+	"""
+	X_train = transform_columns(X, [log_X for log_X, _ in transforms])
+	y_train = transform_columns(y, [log_y for _, log_y in transforms])
+
+	# one infinite value would otherwise turn every residual in its group to nan
+	valid = np.isfinite(X_train) & np.isfinite(y_train)
+	X_train = np.where(valid, X_train, 0.0)
+	y_train = np.where(valid, y_train, 0.0)
+
+	if groups is None:
+		codes, num_groups = np.zeros(len(X_train), dtype = int), 1
+	else:
+		codes, uniques = pd.factorize(np.asarray(groups))
+		num_groups = len(uniques)
+
+	# per group sums of every column, each fit is one column
+	def group_sums(values):
+		return np.column_stack([np.bincount(codes, weights = values[:, i], minlength = num_groups)
+			for i in range(values.shape[1])])
+
+	def group_means(values):
+		return np.divide(group_sums(values), counts, out = np.zeros_like(counts), where = counts > 0)[codes]
+
+	counts = group_sums(valid.astype(float))
+	X_mean = group_means(X_train)
+	y_mean = group_means(y_train)
+
+	X_centered = np.where(valid, X_train - X_mean, 0.0)
+	y_centered = np.where(valid, y_train - y_mean, 0.0)
+	covariance = group_sums(X_centered * y_centered)
+	variance = group_sums(X_centered * X_centered)
+
+	# a constant feature gives a flat fit at the mean
+	slope = np.divide(covariance, variance, out = np.zeros_like(covariance), where = variance != 0)
+
+	y_pred = y_mean + slope[codes] * X_centered
+	residuals = np.where(valid, y_pred - y_train, np.nan)
+
+	if reversal:
+		residuals *= -1
+
+	return residuals
+
 def get_lin_model_residual(X, y, log_X = True, log_y = True, reversal = True):
 	"""
 	Calculates linear model residual of selected columns
@@ -73,20 +186,7 @@ def get_lin_model_residual(X, y, log_X = True, log_y = True, reversal = True):
 	-------
 	residual: numpy array, residual of each value
 	"""
-	model = LinearRegression()
-	X_train = np.log(X) if log_X else X
-	y_train = np.log(y) if log_y else y
-
-	X_train = X_train.values.reshape(-1, 1)
-	y_train = y_train.values.reshape(-1, 1)
-
-	model.fit(X_train, y_train)
-	y_pred = model.predict(X_train)
-	residual = y_pred - y_train
-
-	if reversal:
-		residual *= -1
-
+	residual = fit_residuals(X, y, [(log_X, log_y)], reversal = reversal)
 	return residual
 
 def get_metric_data():
@@ -99,26 +199,46 @@ def get_metric_data():
 	metrics_news: Pandas DataFrame, aggregated metrics for news domains
 	"""
 
-	connection = get_db_connection()
-
+	# counts are kept up to date as citations are stored, see link_counts
 	db_query = """
-	SELECT domains.*, link_count FROM 
-		(SELECT domain, SUM(num_links) AS link_count FROM 
-			(SELECT processed_link, COUNT(*) AS num_links FROM citations 
-			WHERE processed_link NOT LIKE '%#%' GROUP BY 1) AS top_links 
-		INNER JOIN link_domain_map ON top_links.processed_link = link_domain_map.processed_link 
-		GROUP BY 1) AS top_domains 
-	INNER JOIN domains ON top_domains.domain = domains.domain ORDER BY link_count DESC
+	SELECT domains.*, link_count FROM domain_link_counts 
+	INNER JOIN domains ON domain_link_counts.domain = domains.domain 
+	WHERE link_count > 0 ORDER BY link_count DESC
 	"""
 
-	metrics_full = pd.read_sql(db_query, connection)
+	with db_session() as connection:
+		metrics_full = pd.read_sql(db_query, connection)
 	metrics_full = metrics_full[metrics_full["alexa_linksincount"].notnull()]
 
 	metrics_news = metrics_full[metrics_full["news_site"] == True]
 
 	return metrics_full, metrics_news
 
-def print_metrics(results_num = 10, output_file = None):
+def get_language_metric_data():
+	"""
+	Gets dataframe with link counts aggregated per domain and page language, for domains with alexa data
+
+	Returns
+	-------
+	metrics_language: Pandas DataFrame, aggregated metrics for each domain and language
+	"""
+
+	db_query = """
+	SELECT domains.domain, domains.news_site, domains.alexa_linksincount, pages.language, COUNT(*) AS link_count 
+	FROM citations 
+	INNER JOIN pages ON citations.page_id = pages.id 
+	INNER JOIN link_domain_map ON citations.processed_link = link_domain_map.processed_link 
+	INNER JOIN domains ON link_domain_map.domain = domains.domain 
+	WHERE citations.processed_link NOT LIKE '%#%' AND domains.alexa_linksincount IS NOT NULL 
+	GROUP BY 1, 2, 3, 4
+	"""
+
+	with db_session() as connection:
+		metrics_language = pd.read_sql(db_query, connection)
+
+	return metrics_language
+
+def print_metrics(results_num = 10, output_file = None, by_language = False):
 	"""
 	Calculates and prints various metrics
 
@@ -126,6 +246,7 @@ def print_metrics(results_num = 10, output_file = None):
 	----------
 	results_num: int, number of top and bottom results to display
 	output_to_file: str, filename of output file - must be .txt
+	by_language: bool, also print residuals fit separately within each page language
 	"""
 
 	metrics_full, metrics_news = get_metric_data()
@@ -155,14 +276,26 @@ def print_metrics(results_num = 10, output_file = None):
 		data["rank_differential"] = data["alexa_rank_ordinal_rank"] - data["link_count_ordinal_rank"]
 		results_quick_view(data, "rank_differential", results_num)
 
+		# log and non log fits in one pass
+		residuals = fit_residuals(data["alexa_linksincount"], data["link_count"], [(True, True), (False, False)])
+		data["alexa_residual"] = residuals[:, 0]
+		data["alexa_residual_no_log"] = residuals[:, 1]
+
 		print(f"{metric_border}Residual - Alexa Linksin Log{metric_border}")
-		data["alexa_residual"] = get_lin_model_residual(data["alexa_linksincount"], data["link_count"])
 		results_quick_view(data, "alexa_residual", results_num)
 
 		print(f"{metric_border}Residual - Alexa Linksin{metric_border}")
-		data["alexa_residual_no_log"] = get_lin_model_residual(data["alexa_linksincount"], data["link_count"], False, False)
 		results_quick_view(data, "alexa_residual_no_log", results_num)
 
+	if by_language:
+		data = get_language_metric_data()
+		data["alexa_residual"] = fit_residuals(data["alexa_linksincount"], data["link_count"], groups = data["language"])[:, 0]
+
+		for language, language_data in data.groupby("language"):
+			print(f"\n************\nLanguage - {language}\n************\n")
+			print(f"{metric_border}Residual - Alexa Linksin Log{metric_border}")
+			results_quick_view(language_data, "alexa_residual", results_num)
+
 	if output_file:
 		sys.stdout = original_stdout
 		file.close()
@@ -171,10 +304,12 @@ if __name__ == "__main__":
 	parser = argparse.ArgumentParser()
 	parser.add_argument('-r', '--results_num', nargs = '?', type = int, default = 10)
 	parser.add_argument('-o', '--output_file', nargs = '?', type = str, default = None)
+	parser.add_argument('-l', '--by_language', action = 'store_true')
 
 	args = parser.parse_args()
 	params = {}
 	params["results_num"] = args.results_num
 	params["output_file"] = args.output_file
+	params["by_language"] = args.by_language
 
 	print_metrics(**params)
\ No newline at end of file
@@ -0,0 +1,292 @@
+import argparse, os
+from html.parser import HTMLParser
+from bs4 import BeautifulSoup
+
+try:
+	import lxml.html
+except ImportError:
+	lxml = None
+
+# tags that never have a closing tag and so never contain citation items
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source", "track", "wbr"}
+
+# tags whose contents are code rather than text (eg. inline template styles inside citation items)
+NON_TEXT_TAGS = {"script", "style", "template"}
+
+# containers that hold the citation items, in order of preference
+CITATION_SECTIONS = [("ol", "references"), ("div", "references-column-count"), ("div", "references-column-width")]
+
+def process_citation_item(citation):
+	"""
+	Extracts links and text from individual wikipedia citation item
+
+	Parameters
+	----------
+	citation: BeautifulSoup object, one of the li items in wikipedia citation section
+
+	Returns
+	-------
+	citation_text: str, text of citation
+	links: str array, array of links in citation
+	"""
+
+	links = [link["href"] for link in citation.find_all("a") if link.has_attr("href")]
+
+	# newer bs4 versions already leave these out of .text, older ones do not
+	citation_text = "".join(text for text in citation.strings
+		if not any(parent.name in NON_TEXT_TAGS for parent in text.parents))
+
+	return citation_text, links
+
+def extract_citations_bs4(page_text):
+	"""
+	Extracts citations from the raw html of a wikipedia page by building a full BeautifulSoup tree
+
+	Parameters
+	----------
+	page_text: str, raw html of wiki page from which to scrape citations
+
+	Returns
+	-------
+	citation_data: [(str, [str,...]),..], each item in the list has the text of a citation and all the links in that citation
+	"""
+
+	# extract citation items from html of page
+	soup = BeautifulSoup(page_text, "html.parser")
+	citation_section = None
+	for tag, class_name in CITATION_SECTIONS:
+		citation_section = soup.find(tag, class_=class_name) if citation_section is None else citation_section
+
+	if citation_section is None:
+		citations = soup.find_all("cite")
+	else:
+		citations = citation_section.find_all("li")
+
+	# loop through each citation item, extract relevant info, add to data list
+	citation_data = []
+	for citation in citations:
+
+		citation_text, links = process_citation_item(citation)
+		citation_data.append((citation_text, links))
+
+	return citation_data
+
+class ScanComplete(Exception):
+	"""
+	Raised by the citation scanner once the rest of the page can no longer change its result
+	"""
+
+class CitationScanner(HTMLParser):
+	"""
+	Streaming tag scanner that only keeps the text and links of candidate citation items,
+	never materialising a tree of the rest of the page
+	"""
+
+	def __init__(self):
+		super().__init__(convert_charrefs = True)
+
+		# stack of open tags, each entry is the tag name and the collectors opened by it
+		self.open_tags = []
+
+		# number of open tags whose contents are not text, data is skipped while any is open
+		self.non_text_depth = 0
+
+		# one collector per section type, plus one for cite tags anywhere on the page
+		self.collectors = {section:{"state":"waiting", "items":[], "open_items":[]} for section in CITATION_SECTIONS}
+		self.collectors["cite"] = {"state":"open", "items":[], "open_items":[]}
+
+	def handle_starttag(self, tag, attrs):
+		opened = []
+		attrs = dict(attrs)
+
+		# start collecting a section the first time its container opens
+		classes = (attrs.get("class") or "").split()
+		for section in CITATION_SECTIONS:
+			collector = self.collectors[section]
+			if collector["state"] == "waiting" and tag == section[0] and section[1] in classes:
+				collector["state"] = "open"
+				opened.append((collector, None))
+
+		# start a new item in each open collector that is looking for this tag
+		for key, collector in self.collectors.items():
+			item_tag = "cite" if key == "cite" else "li"
+			if collector["state"] == "open" and tag == item_tag:
+				item = ([], [])
+				collector["items"].append(item)
+				collector["open_items"].append(item)
+				opened.append((collector, item))
+
+		# add link to every item it is nested inside
+		if tag == "a" and "href" in attrs:
+			for collector in self.collectors.values():
+				for _, links in collector["open_items"]:
+					links.append(attrs["href"])
+
+		if tag not in VOID_TAGS:
+			self.open_tags.append((tag, opened))
+			if tag in NON_TEXT_TAGS:
+				self.non_text_depth += 1
+
+	def handle_startendtag(self, tag, attrs):
+		self.handle_starttag(tag, attrs)
+		if tag not in VOID_TAGS:
+			self.handle_endtag(tag)
+
+	def handle_endtag(self, tag):
+
+		# ignore end tags that were never opened, otherwise close everything nested inside
+		if tag not in (open_tag for open_tag, _ in self.open_tags):
+			return
+
+		while True:
+			open_tag, opened = self.open_tags.pop()
+			if open_tag in NON_TEXT_TAGS:
+				self.non_text_depth -= 1
+			for collector, item in opened:
+				if item is None:
+					collector["state"] = "closed"
+				else:
+					collector["open_items"].remove(item)
+			if open_tag == tag:
+				break
+
+		# the first references list takes precedence over everything else, so stop once it is read
+		if self.collectors[CITATION_SECTIONS[0]]["state"] == "closed":
+			raise ScanComplete
+
+	def handle_data(self, data):
+		if self.non_text_depth:
+			return
+
+		for collector in self.collectors.values():
+			for text_parts, _ in collector["open_items"]:
+				text_parts.append(data)
+
+	def citation_data(self):
+		"""
+		Returns citation items of the highest precedence section found
+
+		Returns
+		-------
+		citation_data: [(str, [str,...]),..], each item in the list has the text of a citation and all the links in that citation
+		"""
+		for section in CITATION_SECTIONS:
+			if self.collectors[section]["state"] != "waiting":
+				items = self.collectors[section]["items"]
+				break
+		else:
+			items = self.collectors["cite"]["items"]
+
+		citation_data = [("".join(text_parts), links) for text_parts, links in items]
+		return citation_data
+
+def extract_citations_stream(page_text):
+	"""
+	Extracts citations from the raw html of a wikipedia page with a streaming tag scanner
+
+	Parameters
+	----------
+	page_text: str, raw html of wiki page from which to scrape citations
+
+	Returns
+	-------
+	citation_data: [(str, [str,...]),..], each item in the list has the text of a citation and all the links in that citation
+	"""
+	scanner = CitationScanner()
+	try:
+		scanner.feed(page_text)
+		scanner.close()
+	except ScanComplete:
+		pass
+
+	citation_data = scanner.citation_data()
+	return citation_data
+
+def extract_citations_lxml(page_text):
+	"""
+	Extracts citations from the raw html of a wikipedia page with lxml's C parser
+
+	Parameters
+	----------
+	page_text: str, raw html of wiki page from which to scrape citations
+
+	Returns
+	-------
+	citation_data: [(str, [str,...]),..], each item in the list has the text of a citation and all the links in that citation
+	"""
+	root = lxml.html.fromstring(page_text)
+
+	citations = None
+	for tag, class_name in CITATION_SECTIONS:
+		sections = root.xpath(f"//{tag}[contains(concat(' ', normalize-space(@class), ' '), ' {class_name} ')]")
+		if sections:
+			citations = sections[0].iter("li")
+			break
+
+	if citations is None:
+		citations = root.iter("cite")
+
+	text_path = ".//text()[not(ancestor::script or ancestor::style or ancestor::template)]"
+	citation_data = [("".join(citation.xpath(text_path)), citation.xpath(".//a/@href")) for citation in citations]
+	return citation_data
+
+CITATION_EXTRACTORS = {"bs4":extract_citations_bs4, "stream":extract_citations_stream}
+if lxml is not None:
+	CITATION_EXTRACTORS["lxml"] = extract_citations_lxml
+
+def get_citation_extractor(extractor = "stream"):
+	"""
+	Looks up citation extractor backend by name
+
+	Parameters
+	----------
+	extractor: str, name of backend, one of 'bs4', 'stream' or 'lxml'
+
+	Returns
+	-------
+	extract_citations: function, takes raw page html and returns citation data
+	"""
+	if extractor not in CITATION_EXTRACTORS:
+		raise ValueError(f"Unknown or unavailable citation extractor '{extractor}', choose from {sorted(CITATION_EXTRACTORS)}")
+
+	return CITATION_EXTRACTORS[extractor]
+
+def compare_extractors(input_folder_path, extractor = "stream", reference = "bs4"):
+	"""
+	Checks that an extractor returns the same citations as the reference extractor on a folder of saved pages
+
+	Parameters
+	----------
+	input_folder_path: str, folder of saved wikipedia page html files
+	extractor: str, name of backend to check
+	reference: str, name of backend to check against
+
+	Returns
+	-------
+	mismatches: str array, filenames of pages where the extractors disagree
+	"""
+	extract_citations = get_citation_extractor(extractor)
+	extract_reference = get_citation_extractor(reference)
+
+	mismatches = []
+	filenames = sorted(os.listdir(input_folder_path))
+	for filename in filenames:
+		with open(os.path.join(input_folder_path, filename), encoding = "utf-8") as page_file:
+			page_text = page_file.read()
+
+		if extract_citations(page_text) != extract_reference(page_text):
+			print(f"Mismatch in {filename}")
+			mismatches.append(filename)
+
+	print(f"{len(filenames) - len(mismatches)} out of {len(filenames)} pages match...")
+	return mismatches
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument('-i', '--input_folder_path', nargs = 1, type = str)
+	parser.add_argument('-e', '--extractor', nargs = '?', type = str, default = 'stream')
+	parser.add_argument('-r', '--reference', nargs = '?', type = str, default = 'bs4')
+	args = parser.parse_args()
+	params = {"input_folder_path":args.input_folder_path[0], "extractor":args.extractor, "reference":args.reference}
+
+	compare_extractors(**params)
@@ -0,0 +1,100 @@
+import os, sqlite3, threading
+
+class ContentCache(object):
+	"""
+	Base of the local disk caches. Objects are files under objects/, sharded by the first two characters
+	of their name, and a sqlite index in the cache directory describes them. Subclasses define the index tables
+	in INDEX_SCHEMA and the file extension of their objects in OBJECT_SUFFIX
+	"""
+
+	INDEX_SCHEMA = []
+	OBJECT_SUFFIX = ""
+
+	def __init__(self, cache_dir):
+		self.cache_dir = cache_dir
+		self.index_path = os.path.join(cache_dir, "index.sqlite")
+		self.local = threading.local()
+		os.makedirs(os.path.join(cache_dir, "objects"), exist_ok = True)
+
+	def get_index_connection(self):
+		"""
+		Gets a connection to the index for the current process and thread, creating the index tables on first use
+
+		Returns
+		-------
+		connection: sqlite3 connection, connection to the index database
+		"""
+		pid = os.getpid()
+		if getattr(self.local, "pid", None) != pid:
+			connection = sqlite3.connect(self.index_path, timeout = 60)
+			connection.execute("PRAGMA journal_mode=WAL")
+			for statement in self.INDEX_SCHEMA:
+				connection.execute(statement)
+			connection.commit()
+			self.local.pid = pid
+			self.local.connection = connection
+
+		return self.local.connection
+
+	def generate_object_path(self, object_name):
+		"""
+		Creates path of a cached object
+
+		Parameters
+		----------
+		object_name: str, hex digest naming the object
+
+		Returns
+		-------
+		object_path: str, path of the cached object file
+		"""
+		object_path = os.path.join(self.cache_dir, "objects", object_name[:2], f"{object_name}{self.OBJECT_SUFFIX}")
+		return object_path
+
+	def write_object(self, object_name, data):
+		"""
+		Writes an object file, through a temporary file so readers never see a partial object
+
+		Parameters
+		----------
+		object_name: str, hex digest naming the object
+		data: bytes, content of the file
+		"""
+		object_path = self.generate_object_path(object_name)
+		os.makedirs(os.path.dirname(object_path), exist_ok = True)
+
+		temp_path = f"{object_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+		with open(temp_path, "wb") as object_file:
+			object_file.write(data)
+		os.replace(temp_path, object_path)
+
+	def read_object(self, object_name):
+		"""
+		Reads an object file
+
+		Parameters
+		----------
+		object_name: str, hex digest naming the object
+
+		Returns
+		-------
+		data: bytes, content of the file, None if there is no such file
+		"""
+		try:
+			with open(self.generate_object_path(object_name), "rb") as object_file:
+				return object_file.read()
+		except FileNotFoundError:
+			return None
+
+	def delete_object(self, object_name):
+		"""
+		Deletes an object file if it exists
+
+		Parameters
+		----------
+		object_name: str, hex digest naming the object
+		"""
+		try:
+			os.remove(self.generate_object_path(object_name))
+		except FileNotFoundError:
+			pass
@@ -1,34 +1,129 @@
-import mysql.connector, os, argparse
+import mysql.connector, mysql.connector.pooling, os, argparse, tempfile, threading, time
 import pandas as pd
+from contextlib import contextmanager
+from itertools import groupby, islice
 
-def get_db_connection(db_created = True):
+# pool of connections shared by all helpers in a process, rebuilt in forked worker processes
+CONNECTION_POOL = {"pid":None, "pool":None}
+CONNECTION_POOL_LOCK = threading.Lock()
+
+def get_connection_params(db_created = True, allow_local_infile = False):
 	"""
-	Creates python connector to database
+	Creates parameters to connect to database
 
 	Parameters
 	----------
 	db_created: bool, indicates whether database has already been created
+	allow_local_infile: bool, allow LOAD DATA LOCAL INFILE on the connection
 
 	Returns
 	-------
-	connection: mysql.connector object
+	connection_params: dict, keyword arguments for mysql.connector
 	"""
 
 	connection_params = {
 		'user': os.environ["DBUSER"],
 		'password': os.environ["DBPASSWORD"],
 		'host': os.environ["DBHOST"],
-		'auth_plugin': 'caching_sha2_password'
+		'auth_plugin': 'caching_sha2_password',
+		'allow_local_infile': allow_local_infile
 	}
 
 	if db_created:
 		connection_params["database"] = os.environ["DBNAME"]
 
+	return connection_params
+
+def get_db_connection(db_created = True, allow_local_infile = False):
+	"""
+	Creates python connector to database that is not shared through the connection pool
+
+	Parameters
+	----------
+	db_created: bool, indicates whether database has already been created
+	allow_local_infile: bool, allow LOAD DATA LOCAL INFILE on the connection
+
+	Returns
+	-------
+	connection: mysql.connector object
+	"""
+
+	connection_params = get_connection_params(db_created, allow_local_infile)
 	connection = mysql.connector.connect(**connection_params)
 
 	return connection
 
-def execute_db_queries(queries, db_created = True):
+def get_connection_pool():
+	"""
+	Gets the process-wide connection pool, creating it on first use in each process.
+	Sockets cannot be shared with forked processes, so a worker that inherits its parent's pool builds its own
+
+	Returns
+	-------
+	pool: MySQLConnectionPool, pool of open connections to the database
+	"""
+	with CONNECTION_POOL_LOCK:
+		pid = os.getpid()
+		if CONNECTION_POOL["pid"] != pid:
+			pool_size = int(os.environ.get("DBPOOLSIZE", 5))
+			CONNECTION_POOL["pool"] = mysql.connector.pooling.MySQLConnectionPool(pool_name = f"wiki_trust_{pid}", 
+				pool_size = pool_size, **get_connection_params(allow_local_infile = True))
+			CONNECTION_POOL["pid"] = pid
+
+	return CONNECTION_POOL["pool"]
+
+def get_pooled_connection(timeout = 60):
+	"""
+	Borrows a connection from the pool, waiting for one to be returned if all are in use
+
+	Parameters
+	----------
+	timeout: int, seconds to wait for a free connection
+
+	Returns
+	-------
+	connection: PooledMySQLConnection, connection that goes back to the pool when closed
+	"""
+	pool = get_connection_pool()
+	deadline = time.time() + timeout
+
+	while True:
+		try:
+			return pool.get_connection()
+		except mysql.connector.errors.PoolError:
+			if time.time() > deadline:
+				raise
+			time.sleep(0.05)
+
+@contextmanager
+def db_session(connection = None):
+	"""
+	Context manager for a transaction on a pooled connection, committed on exit and rolled back on error.
+	If a connection is passed in it is used as is, so helpers can join a transaction owned by the caller
+
+	Parameters
+	----------
+	connection: mysql.connector object, connection of an existing session
+
+	Returns
+	-------
+	connection: mysql.connector object, connection to run the session's queries on
+	"""
+	if connection is not None:
+		yield connection
+		return
+
+	connection = get_pooled_connection()
+	try:
+		yield connection
+		connection.commit()
+	except Exception:
+		connection.rollback()
+		raise
+	finally:
+		connection.close()
+
+def execute_db_queries(queries, db_created = True, connection = None):
 	"""
 	Execute a list of queries on database
 
@@ -36,68 +131,250 @@ def execute_db_queries(queries, db_created = True):
 	----------
 	queries: str array, array of string queries to execute on database
 	db_created: bool, indicates whether database has already been created
+	connection: mysql.connector object, connection of an existing session
 	"""
 
-	connection = get_db_connection(db_created)
-	cursor = connection.cursor()
+	# the pool connects to the database, so it cannot be used to create it
+	if not db_created:
+		connection = get_db_connection(db_created)
+		cursor = connection.cursor()
+		for query in queries:
+			cursor.execute(query)
+		cursor.close()
+		connection.commit()
+		connection.close()
+		return
 
-	# loop through each query and execute
-	for query in queries:
-		cursor.execute(query)
+	with db_session(connection) as connection:
+		cursor = connection.cursor()
 
-	cursor.close()
-	connection.commit()
-	connection.close()
+		# loop through each query and execute
+		for query in queries:
+			cursor.execute(query)
 
-def push_records_to_db(table_name, data_dicts):
+		cursor.close()
+
+def generate_insert_query(table_name, columns, ignore = False):
 	"""
-	Inserts records into selected db table
+	Creates parameterized insert query for a table
+
+	Parameters
+	----------
+	table_name: str, name of the table in the db to insert records into
+	columns: str array, names of the columns to insert
+	ignore: bool, skip records that duplicate an existing key instead of failing
+
+	Returns
+	-------
+	query: str, insert query with one placeholder per column
+	"""
+	placeholder = ", ".join(["%s"] * len(columns))
+	query = "insert {ignore}into `{table}` ({columns}) values ({values});".format(ignore="ignore " if ignore else "", 
+		table=table_name, columns=",".join(columns), values=placeholder)
+	return query
+
+def batch_records(data_dicts, batch_size):
+	"""
+	Splits records into batches that share the same columns
+
+	Parameters
+	----------
+	data_dicts: dict array, array of dicts with keys as column names and values as the record's value
+	batch_size: int, max number of records in a batch
+
+	Returns
+	-------
+	batches: generator, yields tuples of the batch's column names and its records
+	"""
+	for columns, records in groupby(data_dicts, key = lambda data_dict: tuple(data_dict.keys())):
+		while True:
+			batch = list(islice(records, batch_size))
+			if not batch:
+				break
+			yield columns, batch
+
+def push_record(cursor, table_name, data_dict, ignore = False):
+	"""
+	Inserts a single record, blanking its citation text if the text cannot be stored
+
+	Parameters
+	----------
+	cursor: mysql.connector cursor, cursor to execute the insert with
+	table_name: str, name of table in the db to insert new record into
+	data_dict: dict, keys as column names and values as the record's value
+	ignore: bool, skip the record if it duplicates an existing key instead of failing
+	"""
+	query = generate_insert_query(table_name, list(data_dict.keys()), ignore)
+	try:
+		cursor.execute(query, list(data_dict.values()))
+	except mysql.connector.errors.DatabaseError as err:
+		if err.errno == 1366:
+			data_dict["citation_text"] = ""
+			query = generate_insert_query(table_name, list(data_dict.keys()), ignore)
+			cursor.execute(query, list(data_dict.values()))
+
+def push_records_to_db(table_name, data_dicts, batch_size = 500, connection = None, ignore = False, load_threshold = None):
+	"""
+	Inserts records into selected db table using multi-row inserts, or LOAD DATA LOCAL INFILE for large groups of records
 
 	Parameters
 	----------
 	table_name: str, name of table in the db to insert new record into
 	data_dicts: dict array, array of dicts with keys as column names and values as the record's value
+	batch_size: int, number of records sent to the db per insert statement
+	connection: mysql.connector object, connection of an existing session
+	ignore: bool, skip records that duplicate an existing key instead of failing
+	load_threshold: int, groups of at least this many records with the same columns are bulk loaded, None to never bulk load
+	"""
+	with db_session(connection) as connection:
+		cursor = connection.cursor()
+
+		for columns, records in groupby(data_dicts, key = lambda data_dict: tuple(data_dict.keys())):
+			records = list(records)
+			if load_threshold is not None and len(records) >= load_threshold:
+				if load_records_to_db(table_name, columns, records, connection, ignore):
+					continue
+
+			# insert each batch in one statement, falling back to row by row inserts if any row fails
+			for batch_columns, batch in batch_records(records, batch_size):
+				query = generate_insert_query(table_name, batch_columns, ignore)
+				try:
+					cursor.executemany(query, [list(data_dict.values()) for data_dict in batch])
+				except mysql.connector.errors.DatabaseError:
+					for data_dict in batch:
+						push_record(cursor, table_name, data_dict, ignore)
+
+		cursor.close()
+
+def escape_infile_value(value):
+	"""
+	Escapes value for a tab separated LOAD DATA file
+
+	Parameters
+	----------
+	value: object, value of a record's column
+
+	Returns
+	-------
+	escaped_value: str, value with special characters escaped, NULL for None
 	"""
-	connection = get_db_connection()
-	cursor = connection.cursor()
+	if value is None:
+		return "\\N"
 
-	# loop through each data_dictionary, create a query and execute it
-	for data_dict in data_dicts:
+	escaped_value = str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+	return escaped_value
 
-		placeholder = ", ".join(["%s"] * len(data_dict))
-		query = "insert into `{table}` ({columns}) values ({values});".format(table=table_name, columns=",".join(data_dict.keys()), values=placeholder)
+def load_records_to_db(table_name, columns, data_dicts, connection, ignore = False):
+	"""
+	Bulk loads records into selected db table through a temporary file and LOAD DATA LOCAL INFILE.
+	The server downgrades bad values and duplicate keys to warnings on this path, so a load that raises any warning
+	other than a skipped duplicate when ignore is set, or that the server refuses, is rolled back for the caller to insert
+	the records row by row instead
+
+	Parameters
+	----------
+	table_name: str, name of table in the db to insert new records into
+	columns: str array, names of the columns to load, the keys of every record
+	data_dicts: dict array, array of dicts with keys as column names and values as the record's value
+	connection: mysql.connector object, connection of an existing session with local infile allowed
+	ignore: bool, accept records skipped for duplicating an existing key
+
+	Returns
+	-------
+	loaded: bool, True if the records were loaded, False if the load was undone
+	"""
+	with tempfile.NamedTemporaryFile("w", encoding = "utf-8", suffix = ".tsv") as infile:
+		for data_dict in data_dicts:
+			infile.write("\t".join(escape_infile_value(data_dict[column]) for column in columns) + "\n")
+		infile.flush()
+
+		query = f"""
+		LOAD DATA LOCAL INFILE '{infile.name}' INTO TABLE `{table_name}` CHARACTER SET utf8mb4
+		FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' ({",".join(f"`{column}`" for column in columns)})
+		"""
+
+		# a savepoint keeps the rest of the caller's transaction when the load is undone
+		cursor = connection.cursor()
+		cursor.execute("SAVEPOINT load_records")
 		try:
-			cursor.execute(query, list(data_dict.values()))
-		except mysql.connector.errors.DatabaseError as err:
-			if err.errno == 1366:
-				data_dict["citation_text"] = ""
-				query = "insert into `{table}` ({columns}) values ({values});".format(table=table_name, columns=",".join(data_dict.keys()), values=placeholder)
-				cursor.execute(query, list(data_dict.values()))
-				
-	cursor.close()
-	connection.commit()
-	connection.close()
-
-def update_domain_record(domain, alexa_rank, alexa_linksincount):
+			cursor.execute(query)
+			cursor.execute("SHOW COUNT(*) WARNINGS")
+			(warning_count,) = cursor.fetchone()
+			cursor.execute("SHOW WARNINGS")
+			warning_codes = [code for _, code, _ in cursor.fetchall()]
+		except mysql.connector.errors.DatabaseError:
+			warning_count, warning_codes = None, []
+
+		# errno 1062 is a duplicate key, errno 1366 among the others is text the column cannot store
+		loaded = warning_count == len(warning_codes) and all(ignore and code == 1062 for code in warning_codes)
+		if loaded:
+			cursor.execute("RELEASE SAVEPOINT load_records")
+		else:
+			cursor.execute("ROLLBACK TO SAVEPOINT load_records")
+		cursor.close()
+
+	return loaded
+
+def update_domain_record(domain, alexa_rank, alexa_linksincount, connection = None):
 	"""
 	Updates domain record in db with alexa data
 
 	Parameters
 	----------
 	domain: str, domain name
-	alexa_rank: int, domain's alexa rank
-	alexa_linksincount: int, number of sites linking into domain
+	alexa_rank: int, domain's alexa rank, None if unknown
+	alexa_linksincount: int, number of sites linking into domain, None if unknown
+	connection: mysql.connector object, connection of an existing session
 	"""
 
-	query = f"""
-	UPDATE domains 
-	SET alexa_rank={alexa_rank}, alexa_linksincount={alexa_linksincount} 
-	WHERE domain='{domain}'
+	query = "UPDATE domains SET alexa_rank = %s, alexa_linksincount = %s WHERE domain = %s"
+
+	with db_session(connection) as connection:
+		cursor = connection.cursor()
+		cursor.execute(query, (alexa_rank, alexa_linksincount, domain))
+		cursor.close()
+
+def bulk_update_domain_records(domain_records, batch_size = 10000, connection = None):
 	"""
+	Updates many domain records with alexa data. Each batch is staged in a temporary table with one
+	multi-row insert and applied with a single joined update
 
-	execute_db_queries([query])
+	Parameters
+	----------
+	domain_records: array, (domain, alexa_rank, alexa_linksincount) tuples, None for unknown values
+	batch_size: int, number of records staged and applied at a time
+	connection: mysql.connector object, connection of an existing session
+	"""
 
-def get_unique_set(table_name, column_name):
+	# later records for the same domain win, as they would with one update per record
+	domain_records = list({record[0]:record for record in domain_records}.values())
+	if not domain_records:
+		return
+
+	with db_session(connection) as connection:
+		cursor = connection.cursor()
+		cursor.execute("""
+		CREATE TEMPORARY TABLE IF NOT EXISTS domain_updates (
+			domain VARCHAR(400) NOT NULL,
+			alexa_rank INT,
+			alexa_linksincount INT,
+			PRIMARY KEY (domain)
+		)
+		""")
+
+		for i in range(0, len(domain_records), batch_size):
+			cursor.execute("DELETE FROM domain_updates")
+			cursor.executemany("INSERT INTO domain_updates (domain, alexa_rank, alexa_linksincount) VALUES (%s, %s, %s)",
+				domain_records[i:i + batch_size])
+			cursor.execute("""
+			UPDATE domains INNER JOIN domain_updates ON domains.domain = domain_updates.domain
+			SET domains.alexa_rank = domain_updates.alexa_rank, domains.alexa_linksincount = domain_updates.alexa_linksincount
+			""")
+
+		cursor.execute("DROP TEMPORARY TABLE domain_updates")
+		cursor.close()
+
+def get_unique_set(table_name, column_name, connection = None):
 	"""
 	Function that gets all unique values in a specific table column
 
@@ -105,6 +382,7 @@ def get_unique_set(table_name, column_name):
 	----------
 	table_name: str, name of table in db
 	column_name: str, name of column in table
+	connection: mysql.connector object, connection of an existing session
 
 	Returns
 	-------
@@ -115,25 +393,77 @@ def get_unique_set(table_name, column_name):
 	SELECT {column_name} FROM {table_name}
 	"""
 
-	connection = get_db_connection()
-	cursor = connection.cursor()
-	cursor.execute(query)
+	with db_session(connection) as connection:
+		cursor = connection.cursor()
+		cursor.execute(query)
 
-	values_raw = []
-	for item in cursor:
-		values_raw.append(item[0])
+		values_raw = []
+		for item in cursor:
+			values_raw.append(item[0])
 
-	cursor.close()
-	connection.close()
+		cursor.close()
 
 	values = set(values_raw)
 
 	return values
 
-def get_latest_page_id():
+def iterate_column_values(table_name, column_name, chunk_size = 100000, connection = None):
+	"""
+	Streams all values in a specific table column from a server-side cursor, without holding the column in memory
+
+	Parameters
+	----------
+	table_name: str, name of table in db
+	column_name: str, name of column in table
+	chunk_size: int, number of values fetched from the server at a time
+	connection: mysql.connector object, connection of an existing session
+
+	Returns
+	-------
+	chunks: generator, yields arrays of values in chosen column
+	"""
+
+	query = f"""
+	SELECT {column_name} FROM {table_name}
+	"""
+
+	for rows in iterate_query_rows(query, chunk_size, connection):
+		yield [row[0] for row in rows]
+
+def iterate_query_rows(query, chunk_size = 100000, connection = None):
+	"""
+	Streams the result rows of a query from a server-side cursor, without holding the result in memory
+
+	Parameters
+	----------
+	query: str, query to execute on database
+	chunk_size: int, number of rows fetched from the server at a time
+	connection: mysql.connector object, connection of an existing session
+
+	Returns
+	-------
+	chunks: generator, yields arrays of row tuples
+	"""
+	with db_session(connection) as connection:
+		cursor = connection.cursor(buffered = False)
+		cursor.execute(query)
+
+		while True:
+			rows = cursor.fetchmany(chunk_size)
+			if not rows:
+				break
+			yield rows
+
+		cursor.close()
+
+def get_latest_page_id(connection = None):
 	"""
 	Retreives the id of the most recent page retrieved
 
+	Parameters
+	----------
+	connection: mysql.connector object, connection of an existing session
+
 	Returns
 	-------
 	value: str, id of page
@@ -146,23 +476,22 @@ def get_latest_page_id():
 	LIMIT 1
 	"""
 
-	connection = get_db_connection()
-	cursor = connection.cursor()
-	cursor.execute(query)
+	with db_session(connection) as connection:
+		cursor = connection.cursor()
+		cursor.execute(query)
 
-	values = []
-	for item in cursor:
-		values.append(item[0])
+		values = []
+		for item in cursor:
+			values.append(item[0])
 
-	cursor.close()
-	connection.close()
+		cursor.close()
 
 	value = values[0]
 
 	return value
 
 
-def get_list_from_custom_query(query, column_num):
+def get_list_from_custom_query(query, column_num, connection = None):
 	"""
 	Function that returns list of values based on custom SQL query
 
@@ -170,22 +499,22 @@ def get_list_from_custom_query(query, column_num):
 	----------
 	query: str, SQL query to execute on DB
 	column_num: num of column to get value from
+	connection: mysql.connector object, connection of an existing session
 
 	Returns
 	-------
 	values: array, array of values from SQL column
 	"""
 
-	connection = get_db_connection()
-	cursor = connection.cursor()
-	cursor.execute(query)
+	with db_session(connection) as connection:
+		cursor = connection.cursor()
+		cursor.execute(query)
 
-	values = []
-	for item in cursor:
-		values.append(item[column_num])
+		values = []
+		for item in cursor:
+			values.append(item[column_num])
 
-	cursor.close()
-	connection.close()
+		cursor.close()
 
 	return values
 
@@ -197,12 +526,12 @@ def download_tables(folder_path):
 	----------
 	folder_path: str, folder to save all tables
 	"""
-	connection = get_db_connection()
 	tables = ["pages", "citations", "domains", "link_domain_map", "metrics"]
-	for table in tables:
-		print(f"Downloading {table}...")
-		df = pd.read_sql(f"SELECT * FROM {table}", connection)
-		df.to_csv(f"{folder_path}{table}.csv", index = False)
+	with db_session() as connection:
+		for table in tables:
+			print(f"Downloading {table}...")
+			df = pd.read_sql(f"SELECT * FROM {table}", connection)
+			df.to_csv(f"{folder_path}{table}.csv", index = False)
 
 if __name__ == "__main__":
 	parser = argparse.ArgumentParser()
@@ -1,4 +1,5 @@
-from db_helpers import execute_db_queries
+from db_helpers import execute_db_queries, db_session
+from link_counts import rebuild_link_counts
 
 def create_db():
 	"""
@@ -93,11 +94,158 @@ def create_link_domain_map_table():
 
 	execute_db_queries([query])
 
+def create_scrape_status_table():
+	"""
+	Creates table that tracks which pages have been scraped
+	"""
+
+	print("Creating scrape status table...")
+	query = """
+	CREATE TABLE IF NOT EXISTS scrape_status (
+		page_id VARCHAR(400) NOT NULL,
+		status ENUM('pending', 'in_progress', 'fetched', 'done', 'failed') NOT NULL DEFAULT 'pending',
+		attempts SMALLINT NOT NULL DEFAULT 0,
+		owner VARCHAR(64) NULL,
+		owner_connection BIGINT UNSIGNED NULL,
+		created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+		updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+		PRIMARY KEY (page_id),
+		INDEX status_page_id (status, page_id),
+		FOREIGN KEY (page_id)
+			REFERENCES pages(id)
+			ON DELETE CASCADE
+	)
+	"""
+
+	execute_db_queries([query])
+	migrate_scrape_status_table()
+
+def migrate_scrape_status_table():
+	"""
+	Adds statuses and columns introduced after the scrape status table was first created to existing tables
+	"""
+	status_query = """
+	SELECT COLUMN_TYPE FROM information_schema.COLUMNS
+	WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'scrape_status' AND COLUMN_NAME = 'status'
+	"""
+
+	owner_query = """
+	SELECT COUNT(*) FROM information_schema.COLUMNS
+	WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'scrape_status' AND COLUMN_NAME = 'owner'
+	"""
+
+	# 'fetched' was added for the fetch and parse stages of the scrape
+	alter_query = """
+	ALTER TABLE scrape_status
+	MODIFY status ENUM('pending', 'in_progress', 'fetched', 'done', 'failed') NOT NULL DEFAULT 'pending'
+	"""
+
+	# the owner columns name the scraper lock and connection that claimed an in progress page
+	owner_alter_query = """
+	ALTER TABLE scrape_status
+	ADD COLUMN owner VARCHAR(64) NULL AFTER attempts,
+	ADD COLUMN owner_connection BIGINT UNSIGNED NULL AFTER owner
+	"""
+
+	with db_session() as connection:
+		cursor = connection.cursor()
+		cursor.execute(status_query)
+		column_type = cursor.fetchone()[0]
+
+		if "'fetched'" not in column_type:
+			print("Adding fetched status to scrape status table...")
+			cursor.execute(alter_query)
+
+		cursor.execute(owner_query)
+		if cursor.fetchone()[0] == 0:
+			print("Adding owner columns to scrape status table...")
+			cursor.execute(owner_alter_query)
+		cursor.close()
+
+def create_crawl_state_table():
+	"""
+	Creates table that stores where each crawler should resume from
+	"""
+
+	print("Creating crawl state table...")
+	query = """
+	CREATE TABLE IF NOT EXISTS crawl_state (
+		crawler VARCHAR(100) NOT NULL,
+		continuation TEXT,
+		updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+		PRIMARY KEY (crawler)
+	)
+	"""
+
+	execute_db_queries([query])
+
+def create_link_counts_table():
+	"""
+	Creates table of the number of citations of each link, kept up to date as citations are stored
+	"""
+
+	print("Creating link counts table...")
+	query = """
+	CREATE TABLE IF NOT EXISTS link_counts (
+		processed_link VARCHAR(400) NOT NULL,
+		num_links INT NOT NULL DEFAULT 0,
+		PRIMARY KEY (processed_link)
+	)
+	"""
+
+	execute_db_queries([query])
+
+def create_domain_link_counts_table():
+	"""
+	Creates table of the number of citations linking to each domain, kept up to date as citations are stored
+	and links are mapped to domains
+	"""
+
+	print("Creating domain link counts table...")
+	query = """
+	CREATE TABLE IF NOT EXISTS domain_link_counts (
+		domain VARCHAR(400) NOT NULL,
+		link_count BIGINT NOT NULL DEFAULT 0,
+		PRIMARY KEY (domain),
+		INDEX link_count (link_count),
+		FOREIGN KEY (domain)
+			REFERENCES domains(domain)
+			ON DELETE CASCADE
+	)
+	"""
+
+	execute_db_queries([query])
+
+def fill_link_counts_tables():
+	"""
+	Fills the link count tables from the citations table when they are empty, as they are when they are added to
+	a database that already has citations. The incremental updates only apply differences, so they need a full count to start from
+	"""
+	empty_query = """
+	SELECT EXISTS (SELECT 1 FROM citations), 
+		NOT EXISTS (SELECT 1 FROM link_counts) 
+		OR (NOT EXISTS (SELECT 1 FROM domain_link_counts) AND EXISTS (SELECT 1 FROM link_domain_map))
+	"""
+
+	with db_session() as connection:
+		cursor = connection.cursor()
+		cursor.execute(empty_query)
+		has_citations, counts_empty = cursor.fetchone()
+		cursor.close()
+
+	if has_citations and counts_empty:
+		rebuild_link_counts()
+
 if __name__ == "__main__":
 	create_db()
 	create_pages_table()
 	create_citations_table()
 	create_domains_table()
 	create_link_domain_map_table()
+	create_scrape_status_table()
+	create_crawl_state_table()
+	create_link_counts_table()
+	create_domain_link_counts_table()
+	fill_link_counts_tables()
 
 
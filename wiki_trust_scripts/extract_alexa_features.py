@@ -0,0 +1,194 @@
+import argparse, threading
+import pandas as pd
+from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor
+from xml.parsers.expat import ExpatError
+from awis.myawis import flatten_urlinfo
+from get_domain_data import initiate_s3_object
+from process_domain_data import iterate_prefetched
+from alexa_shards import ShardReader
+
+# flattened fields kept as features, rank and usage live under traffic data
+FEATURE_PREFIXES = ("trafficdata.", "contentdata.linksincount", "contentdata.speed.")
+
+# fields that describe the response rather than the domain
+EXCLUDED_SUFFIXES = ("dataurl", "@type", "#text")
+
+# errors that mean a single document cannot be parsed, the document is skipped rather than stopping the whole run
+DOCUMENT_ERRORS = (ExpatError, ValueError)
+
+# documents parsed per task sent to a worker process
+TASK_CHUNK_SIZE = 64
+
+# shorter column names for the nested groups
+COLUMN_RENAMES = [
+	("trafficdata.rankbycountry.country.", "rank_by_country."),
+	("trafficdata.usagestatistics.usagestatistic.", "usage."),
+	("trafficdata.contributingsubdomains.contributingsubdomain.", "subdomain."),
+	("trafficdata.", ""),
+	("contentdata.", "")
+]
+
+def generate_column_name(key):
+	"""
+	Creates feature column name from a flattened urlinfo key
+
+	Parameters
+	----------
+	key: str, lowercase flattened key (eg. trafficdata.rankbycountry.country.us.rank)
+
+	Returns
+	-------
+	column_name: str, name of the feature column (eg. rank_by_country.us.rank)
+	"""
+	for prefix, replacement in COLUMN_RENAMES:
+		if key.startswith(prefix):
+			return replacement + key[len(prefix):]
+	return key
+
+def parse_feature_value(value):
+	"""
+	Converts a field value to a number where it is one
+
+	Parameters
+	----------
+	value: str, text of the field
+
+	Returns
+	-------
+	value: float or str, number in the field, the text itself if it is not a number
+	"""
+	if value is None:
+		return None
+
+	try:
+		return float(value.replace(",", "").rstrip("%"))
+	except ValueError:
+		return value
+
+def extract_domain_features(domain_document):
+	"""
+	Extracts rank, linksincount, rank by country, speed and usage statistics from an alexa document
+
+	Parameters
+	----------
+	domain_document: tuple, domain and its alexa xml as bytes
+
+	Returns
+	-------
+	features: dict, feature column name to value, only the domain if the document cannot be parsed
+	"""
+	domain, document = domain_document
+	features = {"domain":domain}
+
+	try:
+		fields = flatten_urlinfo(document, shorter_keys = False, lowercase_keys = True)
+	except DOCUMENT_ERRORS as e:
+		print(f"Could not parse document of {domain}: {e!r}")
+		return features
+
+	for key, value in fields.items():
+		if key.startswith(FEATURE_PREFIXES) and not key.endswith(EXCLUDED_SUFFIXES):
+			features[generate_column_name(key)] = parse_feature_value(value)
+
+	return features
+
+def iterate_object_documents(s3_object, bucket_name, num_workers):
+	"""
+	Reads every per-domain alexa object in the bucket, downloading from several threads
+
+	Parameters
+	----------
+	s3_object: boto client, object that interfaces with Amazon S3
+	bucket_name: str, name of S3 bucket
+	num_workers: int, number of threads downloading objects
+
+	Returns
+	-------
+	documents: generator, yields tuples of domain and alexa xml
+	"""
+	def read_object(key):
+		return s3_object.get_object(Bucket = bucket_name, Key = key)["Body"].read()
+
+	paginator = s3_object.get_paginator("list_objects_v2")
+	with ThreadPoolExecutor(num_workers) as executor:
+		for page in paginator.paginate(Bucket = bucket_name, Prefix = "alexa_data/"):
+			keys = [item["Key"] for item in page.get("Contents", []) if item["Key"].endswith(".html")]
+			for key, document in iterate_prefetched(executor, read_object, keys, num_workers * 4):
+				yield key[len("alexa_data/"):-len(".html")], document
+
+def iterate_bounded(items, semaphore):
+	"""
+	Passes items through, waiting on a semaphore before each one so the consumer can hold back a faster producer
+
+	Parameters
+	----------
+	items: iterator, items to pass through
+	semaphore: threading Semaphore, released by the consumer once it is done with an item
+
+	Returns
+	-------
+	items: generator, yields the items
+	"""
+	for item in items:
+		semaphore.acquire()
+		yield item
+
+def extract_alexa_features(output_path, processes = 4, bucket_name = 'wiki-trust-bucket', shard_dir = None, cache_dir = None,
+	num_workers = 16, max_pending = 10000):
+	"""
+	Builds a wide feature table from every stored alexa document in one pass, parsing documents in a process pool
+
+	Parameters
+	----------
+	output_path: str, path of the output csv, one row per domain and one column per feature
+	processes: int, number of processes parsing documents
+	bucket_name: str, name of S3 bucket
+	shard_dir: str, local directory of alexa shards, None to read one object per domain
+	cache_dir: str, directory of the local cache of alexa data
+	num_workers: int, number of threads downloading objects
+	max_pending: int, max number of documents read but not yet parsed
+	"""
+	s3_object = initiate_s3_object(bucket_name, max_pool_connections = num_workers, cache_dir = cache_dir)
+
+	if shard_dir is not None:
+		documents = ShardReader(shard_dir, s3_object, bucket_name).iterate_documents()
+	else:
+		documents = iterate_object_documents(s3_object, bucket_name, num_workers)
+
+	# the pool reads its input as fast as it can, so documents are let through only as parsed ones come back
+	pending = threading.Semaphore(max(max_pending, TASK_CHUNK_SIZE))
+
+	rows = []
+	with Pool(processes) as pool:
+		for features in pool.imap(extract_domain_features, iterate_bounded(documents, pending), chunksize = TASK_CHUNK_SIZE):
+			pending.release()
+			rows.append(features)
+
+			if len(rows) % 10000 == 0:
+				print(f"{len(rows)} documents processed...")
+
+	features_df = pd.DataFrame.from_records(rows)
+	columns = ["domain"] + sorted(column for column in features_df.columns if column != "domain")
+	features_df[columns].to_csv(output_path, index = False)
+	print(f"{len(features_df)} domains, {len(columns) - 1} features written to {output_path}...")
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument('-o', '--output_path', nargs = '?', type = str, default = 'domain_features.csv')
+	parser.add_argument('-p', '--processes', nargs = '?', type = int, default = 4)
+	parser.add_argument('-a', '--shard_dir', nargs = '?', type = str, default = None)
+	parser.add_argument('-d', '--cache_dir', nargs = '?', type = str, default = None)
+	parser.add_argument('-w', '--num_workers', nargs = '?', type = int, default = 16)
+	parser.add_argument('-m', '--max_pending', nargs = '?', type = int, default = 10000)
+
+	args = parser.parse_args()
+	params = {}
+	params["output_path"] = args.output_path
+	params["processes"] = args.processes
+	params["shard_dir"] = args.shard_dir
+	params["cache_dir"] = args.cache_dir
+	params["num_workers"] = args.num_workers
+	params["max_pending"] = args.max_pending
+
+	extract_alexa_features(**params)
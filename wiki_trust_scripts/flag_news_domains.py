@@ -1,42 +1,66 @@
 import argparse
-from db_helpers import execute_db_queries
+from db_helpers import push_records_to_db, db_session
 
-def flag_news_domains(input_data_file):
+def read_news_domains(input_data_file):
 	"""
-	Flags those domains that are news sites in database
+	Reads the list of news domains
 
 	Parameters
 	----------
 	input_data_file: str, filepath to .txt file with domain on each line
+
+	Returns
+	-------
+	news_domains: set, news domain names
+	"""
+	with open(input_data_file) as news_file:
+		news_domains = {domain.strip() for domain in news_file if domain.strip()}
+
+	return news_domains
+
+def flag_news_domains(input_data_file, diff = False):
+	"""
+	Flags those domains that are news sites in database. The list is loaded into a staging table
+	and applied with a single joined update
+
+	Parameters
+	----------
+	input_data_file: str, filepath to .txt file with domain on each line
+	diff: bool, only update domains whose flag changes instead of rewriting every row
 	"""
-	news_domains = open(input_data_file)
+	news_domains = read_news_domains(input_data_file)
 
-	# reset all flags to false
-	reset_query = """
-	UPDATE domains
-	SET news_site = FALSE
+	# unflagged domains are set to false, flagged domains to true
+	flag_query = """
+	UPDATE domains LEFT JOIN news_domains_staging ON domains.domain = news_domains_staging.domain
+	SET domains.news_site = (news_domains_staging.domain IS NOT NULL)
 	"""
-	domain_queries = [reset_query]
+	if diff:
+		flag_query += "WHERE NOT (domains.news_site <=> (news_domains_staging.domain IS NOT NULL))"
 
-	# loop through each line and create a db query
-	for domain in news_domains:
-		domain_name = domain.strip()
+	with db_session() as connection:
+		cursor = connection.cursor()
+		cursor.execute("""
+		CREATE TEMPORARY TABLE IF NOT EXISTS news_domains_staging (
+			domain VARCHAR(400) NOT NULL,
+			PRIMARY KEY (domain)
+		)
+		""")
+		cursor.execute("DELETE FROM news_domains_staging")
 
-		flag_query = f"""
-		UPDATE domains
-		SET news_site = TRUE
-		WHERE domain = '{domain_name}'
-		"""
+		push_records_to_db("news_domains_staging", [{"domain":domain} for domain in news_domains], connection = connection)
 
-		domain_queries.append(flag_query)
+		cursor.execute(flag_query)
+		print(f"{cursor.rowcount} domains updated...")
 
-	execute_db_queries(domain_queries)
+		cursor.execute("DROP TEMPORARY TABLE news_domains_staging")
+		cursor.close()
 
 if __name__ == "__main__":
 	parser = argparse.ArgumentParser()
 	parser.add_argument('-i', '--input_data_file', nargs = 1, type = str)
+	parser.add_argument('-d', '--diff', action = 'store_true')
 	args = parser.parse_args()
-	params = {"input_data_file":args.input_data_file[0]}
+	params = {"input_data_file":args.input_data_file[0], "diff":args.diff}
 
 	flag_news_domains(**params)
-
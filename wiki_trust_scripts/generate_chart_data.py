@@ -1,7 +1,9 @@
 from calculate_metric import get_metric_data, get_lin_model_residual, get_rank
-from db_helpers import get_db_connection
+from db_helpers import iterate_query_rows
 import json, argparse
+import numpy as np
 import pandas as pd
+from scipy import sparse
 
 def get_chart_data():
 	"""
@@ -15,29 +17,67 @@ def get_chart_data():
 
 	df, _ = get_metric_data()
 	df["trust_factor"] = get_lin_model_residual(df["alexa_linksincount"], df["link_count"])
-	df = df[df["news_site"] == True]
+
+	# domains whose counts cannot be logged (eg. no alexa links in) have no trust factor to chart
+	df = df[(df["news_site"] == True) & df["trust_factor"].notnull()]
 	df = get_rank(df, ['trust_factor'], [False])
 
+	# charts read domains in rank order, with the rank as the first column
+	df = df.sort_values("trust_factor_ordinal_rank").reset_index(drop = True)
+	df = df[["trust_factor_ordinal_rank"] + [column for column in df.columns if column != "trust_factor_ordinal_rank"]]
+
 	return df
 
-def get_connections_data():
+def iterate_connections_data(chunk_size = 100000):
 	"""
-	Retreives data from db that can be used to calculate connections between domains
+	Streams data from db that can be used to calculate connections between domains, ordered by page
+	so every page's citations arrive together
+
+	Parameters
+	----------
+	chunk_size: int, number of rows fetched from the server at a time
 
 	Returns
 	-------
-	df: Pandas DataFrame, contains page id and domains cited on that page
+	chunks: generator, yields arrays of (page id, domain) tuples, each page cited domain appearing once
 	"""
 
-	connection = get_db_connection()
 	query = """
-	SELECT citations.page_id, news_domains.domain FROM citations LEFT JOIN 
-		(SELECT link_domain_map.processed_link, link_domain_map.domain FROM link_domain_map 
-		JOIN domains ON link_domain_map.domain = domains.domain WHERE domains.news_site = TRUE) news_domains 
-	ON citations.processed_link = news_domains.processed_link WHERE NOT news_domains.processed_link IS NULL
+	SELECT DISTINCT citations.page_id, link_domain_map.domain FROM citations 
+	INNER JOIN link_domain_map ON citations.processed_link = link_domain_map.processed_link 
+	INNER JOIN domains ON link_domain_map.domain = domains.domain 
+	WHERE domains.news_site = TRUE ORDER BY citations.page_id
 	"""
-	df = pd.read_sql(query, connection)
-	return df
+	return iterate_query_rows(query, chunk_size)
+
+def iterate_whole_pages(row_chunks):
+	"""
+	Regroups row chunks so no page is split between two chunks, holding back the last page of each chunk
+	until the next one shows whether it continues
+
+	Parameters
+	----------
+	row_chunks: iterable, arrays of (page id, domain) tuples ordered by page
+
+	Returns
+	-------
+	chunks: generator, yields arrays of (page id, domain) tuples that end on a page boundary
+	"""
+	carry = []
+	for rows in row_chunks:
+		rows = carry + list(rows)
+		last_page = rows[-1][0]
+
+		split = len(rows)
+		while split > 0 and rows[split - 1][0] == last_page:
+			split -= 1
+
+		carry = rows[split:]
+		if split:
+			yield rows[:split]
+
+	if carry:
+		yield carry
 
 def generate_nodes(df):
 	"""
@@ -61,40 +101,124 @@ def generate_nodes(df):
 
 	return nodes
 
-def generate_link_counts(pair_join = '[uniquejoin]'):
+def count_domain_pairs(page_ids, domains):
 	"""
-	Counts the number of times two domains appear together on the same page
+	Counts the pages each pair of domains appears on together, as the product of a sparse page by domain
+	incidence matrix with its own transpose
 
 	Parameters
 	----------
-	pair_join: str, random str to allow for splitting in generate_links function
+	page_ids: array-like, page id of each citation
+	domains: array-like, domain of each citation
 
 	Returns
 	-------
-	link_counts: dict, dictionary with domain pairs and the number of times they occur
+	domain_names: array, sorted unique domains, indexed by the pair positions
+	pair_counts: scipy coo_matrix, upper triangle of the co-occurrence matrix, entry (i, j) is the number of pages
+		citing both domain_names[i] and domain_names[j]
 	"""
-	df = get_connections_data()
-	pages = df.page_id.unique()
-	link_counts = {}
+	page_codes, page_names = pd.factorize(page_ids)
+	domain_codes, domain_names = pd.factorize(domains, sort = True)
+
+	# a page citing a domain several times still counts once
+	incidence = sparse.csr_matrix((np.ones(len(page_codes), dtype = np.int64), (page_codes, domain_codes)),
+		shape = (len(page_names), len(domain_names)))
+	incidence.data[:] = 1
 
-	for count, page in enumerate(pages):
+	pair_counts = sparse.triu(incidence.T.dot(incidence), k = 1).tocoo()
+	return domain_names, pair_counts
 
-		domains = sorted(df[df['page_id'] == page]['domain'].unique())
-		
-		for i in range(0, len(domains) - 1):
+def sum_pair_pieces(pair_pieces, num_domains):
+	"""
+	Sums pieces of sparse pair counts into one piece holding each pair once
+
+	Parameters
+	----------
+	pair_pieces: array, (row codes, column codes, counts) tuples of pair counts
+	num_domains: int, number of domains encoded so far, the codes are below it
 
-			for j in range(i + 1, len(domains) - 1):
+	Returns
+	-------
+	pair_piece: tuple, row codes, column codes and counts of the summed pairs
+	"""
+	rows, cols, data = (np.concatenate(arrays) for arrays in zip(*pair_pieces))
+	pair_counts = sparse.coo_matrix((data, (rows, cols)), shape = (num_domains, num_domains))
+	pair_counts.sum_duplicates()
 
-				connection = f"{domains[i]}{pair_join}{domains[j]}"
+	pair_piece = (pair_counts.row, pair_counts.col, pair_counts.data)
+	return pair_piece
 
-				if connection in link_counts:
-					link_counts[connection] += 1
-				else:
-					link_counts[connection] = 1
+def accumulate_domain_pairs(row_chunks):
+	"""
+	Counts the pages each pair of domains appears on together, one chunk of pages at a time. Domains are encoded
+	to integers as they are first seen and the sparse pair counts of the chunks are summed, so memory depends on
+	the number of co-occurring pairs and the chunk size rather than the number of citations or of domains squared
+
+	Parameters
+	----------
+	row_chunks: iterable, arrays of (page id, domain) tuples ordered by page
+
+	Returns
+	-------
+	domain_names: array, sorted unique domains, indexed by the pair positions
+	pair_counts: scipy coo_matrix, upper triangle of the co-occurrence matrix, entry (i, j) is the number of pages
+		citing both domain_names[i] and domain_names[j]
+	"""
+	domain_index = {}
+	summed_piece = (np.zeros(0, dtype = np.int64), np.zeros(0, dtype = np.int64), np.zeros(0, dtype = np.int64))
+	pair_pieces, num_buffered = [], 0
+
+	for count, rows in enumerate(iterate_whole_pages(row_chunks)):
+		page_ids, domains = zip(*rows)
+		chunk_domain_names, chunk_pair_counts = count_domain_pairs(np.array(page_ids, dtype = object), np.array(domains, dtype = object))
+
+		for domain in chunk_domain_names:
+			domain_index.setdefault(domain, len(domain_index))
+
+		# chunk pairs are ordered by name, they are kept with the lower code first and ordered by name again at the end
+		chunk_codes = np.array([domain_index[domain] for domain in chunk_domain_names], dtype = np.int64)
+		rows_index, cols_index = chunk_codes[chunk_pair_counts.row], chunk_codes[chunk_pair_counts.col]
+		pair_pieces.append((np.minimum(rows_index, cols_index), np.maximum(rows_index, cols_index), chunk_pair_counts.data))
+		num_buffered += len(chunk_pair_counts.data)
+
+		# fold chunks in once they outnumber the pairs summed so far, so each pair is re-summed only a few times
+		if num_buffered > len(summed_piece[2]):
+			summed_piece = sum_pair_pieces([summed_piece] + pair_pieces, len(domain_index))
+			pair_pieces, num_buffered = [], 0
+
+		print(f'{count + 1} chunks of pages complete...')
+
+	rows_index, cols_index, data = sum_pair_pieces([summed_piece] + pair_pieces, len(domain_index))
+
+	# move the pairs from first seen codes to sorted name positions
+	domain_names = np.array(sorted(domain_index), dtype = object)
+	positions = np.zeros(len(domain_index), dtype = np.int64)
+	positions[[domain_index[domain] for domain in domain_names]] = np.arange(len(domain_names))
+	rows_index, cols_index = positions[rows_index], positions[cols_index]
+
+	pair_counts = sparse.coo_matrix((data, (np.minimum(rows_index, cols_index), np.maximum(rows_index, cols_index))), 
+		shape = (len(domain_names), len(domain_names)))
+	return domain_names, pair_counts
+
+def generate_link_counts(pair_join = '[uniquejoin]', chunk_size = 100000):
+	"""
+	Counts the number of times two domains appear together on the same page
+
+	Parameters
+	----------
+	pair_join: str, random str to allow for splitting in generate_links function
+	chunk_size: int, number of citation rows read from the db at a time
+
+	Returns
+	-------
+	link_counts: dict, dictionary with domain pairs and the number of times they occur
+	"""
+	domain_names, pair_counts = accumulate_domain_pairs(iterate_connections_data(chunk_size))
 
-		if count % 1000 == 0:
-			print(f'{count} out of {len(pages)} pages complete...')
+	link_counts = {f"{domain_names[i]}{pair_join}{domain_names[j]}":int(count)
+		for i, j, count in zip(pair_counts.row, pair_counts.col, pair_counts.data)}
 
+	print(f'{len(link_counts)} domain pairs...')
 	return link_counts
 
 def generate_links(link_counts, pair_join = '[uniquejoin]'):
@@ -117,7 +241,7 @@ def generate_links(link_counts, pair_join = '[uniquejoin]'):
 
 	return links
 
-def generate_force_directed_graph_json(output_folder_path):
+def generate_force_directed_graph_json(output_folder_path, chunk_size = 100000):
 	"""
 	Creates csv for domain metrics and json for force directed graph showing connections between news sites.
 	Both data sets used in site
@@ -125,6 +249,7 @@ def generate_force_directed_graph_json(output_folder_path):
 	Parameters
 	----------
 	output_folder_path: str, folder path to save data files
+	chunk_size: int, number of citation rows read from the db at a time
 	"""
 	df = get_chart_data()
 
@@ -133,7 +258,7 @@ def generate_force_directed_graph_json(output_folder_path):
 
 	# create connections chart json data
 	nodes = generate_nodes(df)
-	link_counts = generate_link_counts()
+	link_counts = generate_link_counts(chunk_size = chunk_size)
 	links = generate_links(link_counts)
 
 	chart_data = {"nodes":nodes, "links":links}
@@ -144,8 +269,9 @@ def generate_force_directed_graph_json(output_folder_path):
 if __name__ == "__main__":
 	parser = argparse.ArgumentParser()
 	parser.add_argument('-o', '--output_folder_path', nargs = '?', type = str, default = 'docs/data/')
+	parser.add_argument('-c', '--chunk_size', nargs = '?', type = int, default = 100000)
 
 	args = parser.parse_args()
-	params = {"output_folder_path":args.output_folder_path}
+	params = {"output_folder_path":args.output_folder_path, "chunk_size":args.chunk_size}
 
 	generate_force_directed_graph_json(**params)
\ No newline at end of file
@@ -1,6 +1,35 @@
-import boto3, os, argparse
+import boto3, botocore.config, os, argparse, threading, time
+from collections import deque
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from awis import myawis
-from db_helpers import get_unique_set, get_list_from_custom_query, push_records_to_db
+from alexa_cache import AlexaCache, CachedS3Client
+from alexa_shards import ShardWriter
+from public_suffix import resolve_links
+from db_helpers import get_unique_set, get_list_from_custom_query, push_records_to_db, db_session
+from link_counts import add_mapped_link_counts
+
+class RateLimiter(object):
+	"""
+	Spaces out calls shared between threads so no more than a fixed number start each second
+	"""
+
+	def __init__(self, requests_per_second = None):
+		self.interval = 1 / requests_per_second if requests_per_second else 0
+		self.lock = threading.Lock()
+		self.next_time = time.monotonic()
+
+	def wait(self):
+		"""
+		Blocks until the calling thread is allowed to make its request
+		"""
+		with self.lock:
+			now = time.monotonic()
+			wait_time = self.next_time - now
+			self.next_time = max(self.next_time, now) + self.interval
+
+		if wait_time > 0:
+			time.sleep(wait_time)
 
 def generate_filename(domain):
 	"""
@@ -52,6 +81,38 @@ def get_alexa_data(awis_object, processed_link):
 
 	return alexa_data, domain
 
+def get_alexa_data_batch(awis_object, processed_links, rate_limiter = None):
+	"""
+	Gets alexa data and extracts specific domain names for several links in one AWIS request
+
+	Parameters
+	----------
+	awis_object: AWIS client, client that queries Alexa Web Information Services
+	processed_links: str array, links from wikipedia citations, at most myawis.URLINFO_BATCH_SIZE
+	rate_limiter: RateLimiter, limiter shared by all threads making AWIS requests
+
+	Returns
+	-------
+	alexa_batch: array, tuples of alexa data and domain in the same order as processed_links,
+		empty if the request failed so the links are retried on the next run
+	"""
+	if rate_limiter is not None:
+		rate_limiter.wait()
+
+	try:
+		if len(processed_links) == 1:
+			alexa_batch = [get_alexa_data(awis_object, processed_links[0])]
+		else:
+			alexa_datas = awis_object.urlinfo_batch(processed_links)
+			if len(alexa_datas) != len(processed_links):
+				raise ValueError(f"expected {len(processed_links)} responses, got {len(alexa_datas)}")
+			alexa_batch = [(alexa_data, alexa_data.find('aws:contactinfo').find('aws:dataurl').text) for alexa_data in alexa_datas]
+	except Exception as e:
+		print(f"Failed to get alexa data for {processed_links}: {e}")
+		alexa_batch = []
+
+	return alexa_batch
+
 def store_alexa_data(s3_object, bucket_name, alexa_data, domain):
 	"""
 	Stores alexa data in an S3 bucket
@@ -68,14 +129,85 @@ def store_alexa_data(s3_object, bucket_name, alexa_data, domain):
 	_ = s3_object.put_object(Body=encoded_data, Bucket=bucket_name, Key=filename)
 	return
 
-def initiate_s3_object(bucket_name, create_bucket_function = False):
+def store_domain_records(domains_db_data, link_domain_map_db_data, s3_futures):
+	"""
+	Adds new domains and link domain mappings to the db in one transaction, once their alexa data is in S3
+
+	Parameters
+	----------
+	domains_db_data: dict array, records for the domains table
+	link_domain_map_db_data: dict array, records for the link_domain_map table
+	s3_futures: array, futures of the S3 uploads of the new domains
+	"""
+
+	# the domains only go in the db once their alexa data can be read back from s3
+	for s3_future in s3_futures:
+		s3_future.result()
+
+	# domains before the mappings that reference them
+	with db_session() as connection:
+		push_records_to_db("domains", domains_db_data, connection = connection)
+		push_records_to_db("link_domain_map", link_domain_map_db_data, connection = connection)
+		add_mapped_link_counts([record["processed_link"] for record in link_domain_map_db_data], connection)
+
+def store_sharded_domain_records(pending_records, domains_db_data, link_domain_map_db_data, s3_futures, shard_writer, final = False):
 	"""
-	Creates S3 client object and bucket if necessary
+	Holds new domains and link domain mappings back until the shard packing their alexa data is closed and uploaded,
+	then adds them to the db in the order they were found. Shards are only closed by size, or on the final call
+
+	Parameters
+	----------
+	pending_records: deque, records held back so far as (shards to close, domain records, link domain map records) tuples
+	domains_db_data: dict array, records for the domains table
+	link_domain_map_db_data: dict array, records for the link_domain_map table
+	s3_futures: array, futures of the appends of the new domains to the shard writer
+	shard_writer: ShardWriter, writer the alexa data is packed with
+	final: bool, close the current shard and add every held back record
+	"""
+	for s3_future in s3_futures:
+		s3_future.result()
+
+	pending_records.append((shard_writer.count_shards_to_close(), domains_db_data, link_domain_map_db_data))
+	if final:
+		shard_writer.flush()
+
+	while pending_records and pending_records[0][0] <= shard_writer.num_closed:
+		_, domains_db_data, link_domain_map_db_data = pending_records.popleft()
+		store_domain_records(domains_db_data, link_domain_map_db_data, [])
+
+def store_resolved_links(resolved_links, domains, write_batch_size = 500):
+	"""
+	Adds links resolved without awis and their new domains to the db. The new domains have no alexa data yet,
+	process_domain_data queries it once per domain rather than once per link
+
+	Parameters
+	----------
+	resolved_links: array, tuples of link and domain
+	domains: set, domains already in db, updated with the new domains
+	write_batch_size: int, number of link domain mappings written to the db at a time
+	"""
+	for i in range(0, len(resolved_links), write_batch_size):
+		domains_db_data, link_domain_map_db_data = [], []
+
+		for link, domain in resolved_links[i:i + write_batch_size]:
+			if domain not in domains:
+				domains_db_data.append({"domain":domain})
+				domains.add(domain)
+			link_domain_map_db_data.append({"processed_link":link, "domain":domain})
+
+		store_domain_records(domains_db_data, link_domain_map_db_data, [])
+		print(f"{i + len(link_domain_map_db_data)} out of {len(resolved_links)} links resolved locally...")
+
+def initiate_s3_object(bucket_name, create_bucket_function = False, max_pool_connections = 10, cache_dir = None):
+	"""
+	Creates S3 client object and bucket if necessary, reading and writing through a local cache if a cache directory is given
 
 	Parameters
 	----------
 	bucket_name: str, name of S3 bucket
 	create_bucket_function: bool, create s3 bucket if necessary
+	max_pool_connections: int, number of connections the client keeps open, one per thread using it
+	cache_dir: str, directory of the local cache of S3 objects, None to always go to S3
 
 	Returns
 	-------
@@ -84,34 +216,53 @@ def initiate_s3_object(bucket_name, create_bucket_function = False):
 	"""
 	s3_object = boto3.client('s3',region_name='us-east-1',
 		aws_access_key_id=os.environ["AWSACCESSKEY"],
-		aws_secret_access_key=os.environ["AWSSECRETKEY"])
+		aws_secret_access_key=os.environ["AWSSECRETKEY"],
+		endpoint_url=os.environ.get("S3ENDPOINT"),
+		config=botocore.config.Config(max_pool_connections=max_pool_connections))
+
+	if cache_dir is not None:
+		s3_object = CachedS3Client(s3_object, AlexaCache(cache_dir))
 
 	if create_bucket_function:
 		create_bucket_if_not_exist(s3_object, bucket_name)
 
 	return s3_object
 
-def initiate_awis_object():
+def initiate_awis_object(pool_size = 10):
 	"""
 	Creates awis client object
 
+	Parameters
+	----------
+	pool_size: int, number of keep-alive connections the client holds, one per thread making requests
+
 	Returns
 	-------
 	awis_object: AWIS client, client that queries Alexa Web Information Services
 	"""
 
-	awis_object = myawis.CallAwis(os.environ['AWSACCESSKEY'], os.environ['AWSSECRETKEY'])
+	awis_object = myawis.CallAwis(os.environ['AWSACCESSKEY'], os.environ['AWSSECRETKEY'],
+		os.environ.get('AWISENDPOINT', myawis.AWIS_ENDPOINT), pool_size = pool_size)
 	return awis_object
 
 
-def get_domain_data(num_links, bucket_name = 'wiki-trust-bucket'):
+def get_domain_data(num_links, bucket_name = 'wiki-trust-bucket', num_workers = 4, requests_per_second = 5,
+	batch_size = myawis.URLINFO_BATCH_SIZE, write_batch_size = 500, cache_dir = None, shard_dir = None, awis_only = False):
 	"""
-	Gets domain data for chosen number of links
+	Gets domain data for chosen number of links, querying AWIS from several threads at once.
+	Results are handled in link order, so each new domain keeps the alexa data of its first link as before
 
 	Parameters
 	----------
 	num_links: int, number of links to get domain data from, sorted by total presence in database
 	bucket_name: str, name of S3 bucket
+	num_workers: int, number of threads making AWIS requests
+	requests_per_second: float, cap on AWIS requests started per second across all threads, None for no cap
+	batch_size: int, number of links sent in each AWIS request, at most myawis.URLINFO_BATCH_SIZE
+	write_batch_size: int, number of link domain mappings written to the db at a time
+	cache_dir: str, directory of the local cache of alexa data, None to only store it in S3
+	shard_dir: str, local directory alexa data is packed into shards in before upload, None to store one object per domain
+	awis_only: bool, resolve every link with awis instead of resolving unambiguous hosts with the public suffix list
 	"""
 
 	# query links to get domain data for
@@ -127,45 +278,84 @@ def get_domain_data(num_links, bucket_name = 'wiki-trust-bucket'):
 	# get domains for which data already exist
 	domains = get_unique_set("domains", "domain")	
 
+	# resolve links to registrable domains locally, only ambiguous hosts go to awis
+	if not awis_only:
+		resolved_links, links_no_domains = resolve_links(links_no_domains)
+		store_resolved_links(resolved_links, domains, write_batch_size)
+
 	# initiate awis object
-	awis_object = initiate_awis_object()
-	s3_object = initiate_s3_object(bucket_name, True)
+	awis_object = initiate_awis_object(num_workers)
+	s3_object = initiate_s3_object(bucket_name, True, num_workers, cache_dir)
+	shard_writer = ShardWriter(shard_dir, s3_object, bucket_name) if shard_dir else None
+
+	batch_size = min(batch_size, myawis.URLINFO_BATCH_SIZE)
+	link_batches = [links_no_domains[i:i + batch_size] for i in range(0, len(links_no_domains), batch_size)]
+	get_batch = partial(get_alexa_data_batch, awis_object, rate_limiter = RateLimiter(requests_per_second))
+
+	domains_db_data, link_domain_map_db_data, s3_futures = [], [], []
+	pending_records = deque()
+	counter = 0
+
+	with ThreadPoolExecutor(num_workers) as awis_executor, ThreadPoolExecutor(num_workers) as s3_executor:
 
-	# loop through each link and process it
-	for counter, link in enumerate(links_no_domains):
+		# map hands back batches in link order while later batches are still being fetched
+		for link_batch, alexa_batch in zip(link_batches, awis_executor.map(get_batch, link_batches)):
+			for link, (alexa_data, domain) in zip(link_batch, alexa_batch):
+				print(link, domain)
 
-		# get alexa data for specific link
-		alexa_data, domain = get_alexa_data(awis_object, link)
-		print(link, domain)
+				# check if domain not already in dataset
+				if domain not in domains:
 
-		# check if domain not already in dataset
-		if domain not in domains:
+					# store alexa data in s3 bucket
+					if shard_writer is not None:
+						s3_futures.append(s3_executor.submit(shard_writer.append, domain, str(alexa_data).encode()))
+					else:
+						s3_futures.append(s3_executor.submit(store_alexa_data, s3_object, bucket_name, alexa_data, domain))
+					domains_db_data.append({"domain":domain})
 
-			# add domain to database
-			domain_data = {"domain":domain}
-			push_records_to_db("domains", [domain_data])
+					# add domain to set of domains for which data already exists
+					domains.add(domain)
 
-			# store alexa data in s3 bucket
-			store_alexa_data(s3_object, bucket_name, alexa_data, domain)
+				link_domain_map_db_data.append({"processed_link":link, "domain":domain})
 
-			# add domain to set of domains for which data already exists
-			domains.add(domain)
+			# add domains and link domain mappings to db in batches
+			if len(link_domain_map_db_data) >= write_batch_size:
+				if shard_writer is not None:
+					store_sharded_domain_records(pending_records, domains_db_data, link_domain_map_db_data, s3_futures, shard_writer)
+				else:
+					store_domain_records(domains_db_data, link_domain_map_db_data, s3_futures)
+				domains_db_data, link_domain_map_db_data, s3_futures = [], [], []
 
-		# add link domain mapping to db
-		link_domain_map_data = {"processed_link":link, "domain":domain}
-		push_records_to_db("link_domain_map", [link_domain_map_data])
+			# print status counter
+			counter += len(link_batch)
+			print(f"{counter} out of {len(links_no_domains)} complete...")
 
-		# print status counter
-		if counter % 50 == 0:
-			print(f"{counter + 1} out of {len(links_no_domains)} complete...")
+		if shard_writer is not None:
+			store_sharded_domain_records(pending_records, domains_db_data, link_domain_map_db_data, s3_futures, shard_writer, True)
+		else:
+			store_domain_records(domains_db_data, link_domain_map_db_data, s3_futures)
 
 
 if __name__ == "__main__":
 	parser = argparse.ArgumentParser()
 	parser.add_argument('-n', '--num_links', nargs = '?', type = int, default = 1000)
+	parser.add_argument('-w', '--num_workers', nargs = '?', type = int, default = 4)
+	parser.add_argument('-r', '--requests_per_second', nargs = '?', type = float, default = 5)
+	parser.add_argument('-b', '--batch_size', nargs = '?', type = int, default = myawis.URLINFO_BATCH_SIZE)
+	parser.add_argument('-s', '--write_batch_size', nargs = '?', type = int, default = 500)
+	parser.add_argument('-d', '--cache_dir', nargs = '?', type = str, default = None)
+	parser.add_argument('-a', '--shard_dir', nargs = '?', type = str, default = None)
+	parser.add_argument('-o', '--awis_only', action = 'store_true')
 
 	args = parser.parse_args()
 	params = {}
 	params["num_links"] = args.num_links
+	params["num_workers"] = args.num_workers
+	params["requests_per_second"] = args.requests_per_second
+	params["batch_size"] = args.batch_size
+	params["write_batch_size"] = args.write_batch_size
+	params["cache_dir"] = args.cache_dir
+	params["shard_dir"] = args.shard_dir
+	params["awis_only"] = args.awis_only
 
 	get_domain_data(**params)
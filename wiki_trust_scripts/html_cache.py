@@ -0,0 +1,150 @@
+import os, re, gzip, hashlib, time
+from content_cache import ContentCache
+
+REVISION_ID_PATTERN = re.compile(r'"wgRevisionId":\s*(\d+)')
+
+class HtmlCache(ContentCache):
+	"""
+	Local cache of fetched wikipedia page html. Page html is stored gzipped under the hash of its content,
+	and a sqlite index maps each page id to its content hash, revision id and http validators
+	"""
+
+	INDEX_SCHEMA = ["""
+	CREATE TABLE IF NOT EXISTS pages (
+		page_id TEXT PRIMARY KEY,
+		content_hash TEXT NOT NULL,
+		revision_id INTEGER,
+		etag TEXT,
+		last_modified TEXT,
+		fetched_at REAL NOT NULL
+	)
+	"""]
+	OBJECT_SUFFIX = ".html.gz"
+
+	def get_entry(self, page_id):
+		"""
+		Gets the index entry of a page
+
+		Parameters
+		----------
+		page_id: str, name of wikipedia page
+
+		Returns
+		-------
+		entry: dict, index columns of the page, None if the page is not cached
+		"""
+		cursor = self.get_index_connection().execute(
+			"SELECT content_hash, revision_id, etag, last_modified FROM pages WHERE page_id = ?", (page_id,))
+		row = cursor.fetchone()
+
+		if row is None:
+			return None
+
+		entry = {"content_hash":row[0], "revision_id":row[1], "etag":row[2], "last_modified":row[3]}
+		return entry
+
+	def conditional_headers(self, page_id):
+		"""
+		Creates request headers that let the server answer 304 Not Modified if the cached page is current
+
+		Parameters
+		----------
+		page_id: str, name of wikipedia page
+
+		Returns
+		-------
+		headers: dict, If-None-Match and If-Modified-Since headers, empty if the page is not cached
+		"""
+		entry = self.get_entry(page_id)
+		headers = {}
+
+		if entry is not None:
+			if entry["etag"]:
+				headers["If-None-Match"] = entry["etag"]
+			if entry["last_modified"]:
+				headers["If-Modified-Since"] = entry["last_modified"]
+
+		return headers
+
+	def load(self, page_id):
+		"""
+		Reads cached html of a page
+
+		Parameters
+		----------
+		page_id: str, name of wikipedia page
+
+		Returns
+		-------
+		page_text: str, raw html of wikipedia page, None if the page is not cached
+		"""
+		entry = self.get_entry(page_id)
+		if entry is None:
+			return None
+
+		page_bytes = self.read_object(entry["content_hash"])
+		if page_bytes is None:
+			return None
+
+		page_text = gzip.decompress(page_bytes).decode("utf-8")
+		return page_text
+
+	def store(self, page_id, page_text, headers):
+		"""
+		Writes html of a page to the cache along with its validators. Identical html is only stored once
+
+		Parameters
+		----------
+		page_id: str, name of wikipedia page
+		page_text: str, raw html of wikipedia page
+		headers: dict, response headers of the page request, header names in any case
+		"""
+		page_bytes = page_text.encode("utf-8")
+		content_hash = hashlib.sha256(page_bytes).hexdigest()
+		if not os.path.exists(self.generate_object_path(content_hash)):
+			self.write_object(content_hash, gzip.compress(page_bytes))
+
+		revision_match = REVISION_ID_PATTERN.search(page_text)
+		revision_id = int(revision_match.group(1)) if revision_match else None
+
+		# header names are case insensitive and servers send them in either case
+		headers = {name.lower():value for name, value in headers.items()}
+
+		connection = self.get_index_connection()
+		connection.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)", (page_id, content_hash, revision_id,
+			headers.get("etag"), headers.get("last-modified"), time.time()))
+		connection.commit()
+
+	def iterate_page_ids(self):
+		"""
+		Lists every cached page
+
+		Returns
+		-------
+		page_ids: str array, ids of cached pages
+		"""
+		page_ids = [row[0] for row in self.get_index_connection().execute("SELECT page_id FROM pages ORDER BY page_id")]
+		return page_ids
+
+# one cache object per directory, so index connections are reused between pages
+HTML_CACHES = {}
+
+def get_html_cache(cache_dir):
+	"""
+	Gets the cache for a directory, None if no directory is given
+
+	Parameters
+	----------
+	cache_dir: str, directory of the cache
+
+	Returns
+	-------
+	cache: HtmlCache, cache of page html
+	"""
+	if cache_dir is None:
+		return None
+
+	if cache_dir not in HTML_CACHES:
+		HTML_CACHES[cache_dir] = HtmlCache(cache_dir)
+
+	return HTML_CACHES[cache_dir]
@@ -0,0 +1,171 @@
+import argparse, bz2, gzip, json, tarfile
+from functools import partial
+from itertools import islice
+from multiprocessing import Pool
+from db_helpers import push_records_to_db, db_session
+from link_processing import generate_page_id
+from scrape_status import enqueue_pages
+from scrape_page_references import generate_citation_records, store_pages_citations
+
+# a dump batch's citations number in the tens of thousands, so they are bulk loaded rather than inserted
+CITATION_LOAD_THRESHOLD = 5000
+
+def open_dump(dump_path):
+	"""
+	Opens dump file for streaming, decompressing it incrementally based on its extension
+
+	Parameters
+	----------
+	dump_path: str, path of the dump file
+
+	Returns
+	-------
+	dump_file: file object, binary stream of the decompressed dump
+	"""
+	if dump_path.endswith(".bz2"):
+		return bz2.open(dump_path, "rb")
+	if dump_path.endswith(".gz"):
+		return gzip.open(dump_path, "rb")
+	return open(dump_path, "rb")
+
+def iterate_ndjson_lines(lines):
+	"""
+	Reads articles out of the lines of a wikimedia enterprise html dump
+
+	Parameters
+	----------
+	lines: iterable, ndjson lines, one article per line
+
+	Returns
+	-------
+	pages: generator, yields tuples of page title and page html
+	"""
+	for line in lines:
+		article = json.loads(line)
+		if article.get("namespace", {}).get("identifier", 0) == 0:
+			yield article["name"], article["article_body"]["html"]
+
+def iterate_html_dump(dump_path):
+	"""
+	Streams articles out of a wikimedia enterprise html dump, either a tar.gz of ndjson files or a single ndjson file
+
+	Parameters
+	----------
+	dump_path: str, path of the html dump
+
+	Returns
+	-------
+	pages: generator, yields tuples of page title and page html
+	"""
+	if dump_path.endswith((".tar.gz", ".tgz")):
+		with tarfile.open(dump_path, "r|gz") as dump_tar:
+			for member in dump_tar:
+				if member.isfile():
+					yield from iterate_ndjson_lines(dump_tar.extractfile(member))
+	else:
+		with open_dump(dump_path) as dump_file:
+			yield from iterate_ndjson_lines(dump_file)
+
+def iterate_dump(dump_path):
+	"""
+	Streams articles out of a wikimedia enterprise html dump. Xml export dumps are refused, they hold raw wikitext
+	that needs mediawiki to expand its templates before its refs read like the citations of scraped html
+
+	Parameters
+	----------
+	dump_path: str, path of the dump file
+
+	Returns
+	-------
+	pages: generator, yields tuples of page title and page html
+	"""
+	if ".xml" in dump_path:
+		raise ValueError(f"{dump_path} is an xml dump, only wikimedia enterprise html dumps can be ingested")
+	return iterate_html_dump(dump_path)
+
+def parse_dump_page(page, extractor = "stream"):
+	"""
+	Creates the page record and citation records of a dump article, parsing its html like a scraped page
+
+	Parameters
+	----------
+	page: tuple, page title and page html
+	extractor: str, name of citation extractor backend
+
+	Returns
+	-------
+	page_data: dict, record for the pages table
+	citation_db_data: dict array, records for the citations table
+	"""
+	title, page_text = page
+	page_id = generate_page_id(title)
+	citation_db_data = generate_citation_records(page_id, page_text, extractor)
+
+	page_data = {"id":page_id, "name":title, "language":"english"}
+	return page_data, citation_db_data
+
+def store_dump_pages(parsed_pages):
+	"""
+	Adds a batch of dump articles and their citations to the db in one transaction
+
+	Parameters
+	----------
+	parsed_pages: array, tuples of page record and citation records
+	"""
+	pages_db_data = [page_data for page_data, _ in parsed_pages]
+	page_ids = [page_data["id"] for page_data in pages_db_data]
+
+	with db_session() as connection:
+		push_records_to_db("pages", pages_db_data, connection = connection, ignore = True)
+		enqueue_pages(page_ids, connection = connection)
+		store_pages_citations([(page_data["id"], citation_db_data) for page_data, citation_db_data in parsed_pages], connection,
+			load_threshold = CITATION_LOAD_THRESHOLD)
+
+def ingest_wiki_dump(dump_path, processes = 1, batch_size = 1000, extractor = "stream"):
+	"""
+	Loads pages and citations from a wikipedia dump instead of scraping them.
+	Pages are read in fixed size batches so memory stays flat regardless of dump size
+
+	Parameters
+	----------
+	dump_path: str, path of the wikimedia enterprise html dump, a tar.gz of ndjson files or a single optionally compressed ndjson file
+	processes: int, number of processes used to parse pages
+	batch_size: int, number of pages parsed and stored at a time
+	extractor: str, name of citation extractor backend
+	"""
+	pages = iterate_dump(dump_path)
+	pool = Pool(processes)
+	parse_page = partial(parse_dump_page, extractor = extractor)
+
+	count = 0
+	while True:
+		batch = list(islice(pages, batch_size))
+		if not batch:
+			break
+
+		parsed_pages = pool.map(parse_page, batch, chunksize = max(1, len(batch) // (processes * 4)))
+		store_dump_pages(parsed_pages)
+
+		count += len(batch)
+		print(f"{count} pages ingested...")
+
+	pool.close()
+	pool.join()
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument('-i', '--dump_path', nargs = 1, type = str)
+	parser.add_argument('-p', '--processes', nargs = '?', type = int, default = 1)
+	parser.add_argument('-b', '--batch_size', nargs = '?', type = int, default = 1000)
+	parser.add_argument('-e', '--extractor', nargs = '?', type = str, default = 'stream', choices = ['bs4', 'stream', 'lxml'])
+
+	args = parser.parse_args()
+	params = {}
+	params["dump_path"] = args.dump_path[0]
+	if ".xml" in params["dump_path"]:
+		parser.error("xml dumps hold unexpanded wikitext, ingest a wikimedia enterprise html dump instead")
+	params["processes"] = args.processes
+	params["batch_size"] = args.batch_size
+	params["extractor"] = args.extractor
+
+	ingest_wiki_dump(**params)
@@ -0,0 +1,187 @@
+import argparse
+from collections import Counter
+from db_helpers import db_session
+
+# links with fragments are left out of domain counts, as they are everywhere else links are counted
+DOMAIN_LINK_FILTER = "link_counts.processed_link NOT LIKE '%#%'"
+
+def count_page_citations(page_ids, connection):
+	"""
+	Counts citations currently stored for pages, by processed link
+
+	Parameters
+	----------
+	page_ids: str array, names of wikipedia pages
+	connection: mysql.connector object, connection of an existing session
+
+	Returns
+	-------
+	link_counts: Counter, processed link to number of citations
+	"""
+	link_counts = Counter()
+	if not page_ids:
+		return link_counts
+
+	placeholder = ", ".join(["%s"] * len(page_ids))
+	cursor = connection.cursor()
+	cursor.execute(f"SELECT processed_link, COUNT(*) FROM citations WHERE page_id IN ({placeholder}) GROUP BY 1", page_ids)
+	for processed_link, num_links in cursor:
+		link_counts[processed_link] = num_links
+	cursor.close()
+
+	return link_counts
+
+def apply_link_count_deltas(link_deltas, connection = None):
+	"""
+	Adds changes in citation counts to the per-link and per-domain counts
+
+	Parameters
+	----------
+	link_deltas: dict, processed link to change in number of citations, negative for removed citations
+	connection: mysql.connector object, connection of an existing session
+	"""
+
+	# rows are always locked in the same order so concurrent writers do not deadlock
+	link_deltas = sorted((processed_link, delta) for processed_link, delta in link_deltas.items() if delta != 0)
+	if not link_deltas:
+		return
+
+	with db_session(connection) as connection:
+		cursor = connection.cursor()
+		cursor.executemany("""
+		INSERT INTO link_counts (processed_link, num_links) VALUES (%s, %s)
+		ON DUPLICATE KEY UPDATE num_links = num_links + VALUES(num_links)
+		""", link_deltas)
+
+		cursor.execute("""
+		CREATE TEMPORARY TABLE IF NOT EXISTS link_count_deltas (
+			processed_link VARCHAR(400) NOT NULL,
+			delta INT NOT NULL,
+			PRIMARY KEY (processed_link)
+		)
+		""")
+		cursor.execute("DELETE FROM link_count_deltas")
+		cursor.executemany("INSERT INTO link_count_deltas (processed_link, delta) VALUES (%s, %s)", link_deltas)
+
+		# only links already mapped to a domain count towards it, the rest are added when they are mapped
+		cursor.execute(f"""
+		INSERT INTO domain_link_counts (domain, link_count)
+		SELECT link_domain_map.domain, SUM(link_counts.delta) FROM link_count_deltas AS link_counts
+		INNER JOIN link_domain_map ON link_counts.processed_link = link_domain_map.processed_link
+		WHERE {DOMAIN_LINK_FILTER} GROUP BY 1 ORDER BY 1
+		ON DUPLICATE KEY UPDATE link_count = link_count + VALUES(link_count)
+		""")
+
+		cursor.execute("DROP TEMPORARY TABLE link_count_deltas")
+		cursor.close()
+
+def apply_citation_changes(old_citation_counts, citation_db_data, connection = None):
+	"""
+	Updates counts after the citations of some pages were replaced
+
+	Parameters
+	----------
+	old_citation_counts: Counter, processed link to number of citations removed
+	citation_db_data: dict array, citation records added
+	connection: mysql.connector object, connection of an existing session
+	"""
+	link_deltas = Counter(record["processed_link"] for record in citation_db_data)
+	link_deltas.subtract(old_citation_counts)
+	apply_link_count_deltas(link_deltas, connection)
+
+def add_mapped_link_counts(processed_links, connection = None):
+	"""
+	Adds the citation counts of newly mapped links to their domains
+
+	Parameters
+	----------
+	processed_links: str array, links just added to link_domain_map
+	connection: mysql.connector object, connection of an existing session
+	"""
+	if not processed_links:
+		return
+
+	placeholder = ", ".join(["%s"] * len(processed_links))
+	with db_session(connection) as connection:
+		cursor = connection.cursor()
+		cursor.execute(f"""
+		INSERT INTO domain_link_counts (domain, link_count)
+		SELECT link_domain_map.domain, SUM(link_counts.num_links) FROM link_counts
+		INNER JOIN link_domain_map ON link_counts.processed_link = link_domain_map.processed_link
+		WHERE link_domain_map.processed_link IN ({placeholder}) AND {DOMAIN_LINK_FILTER} GROUP BY 1 ORDER BY 1
+		ON DUPLICATE KEY UPDATE link_count = link_count + VALUES(link_count)
+		""", list(processed_links))
+		cursor.close()
+
+def rebuild_link_counts():
+	"""
+	Recomputes the per-link and per-domain counts from the citations table, to fill the tables on an existing
+	database and after bulk changes that bypass the incremental updates (eg. deleting pages or editing citations by hand)
+	"""
+	queries = [
+		"DELETE FROM domain_link_counts",
+		"DELETE FROM link_counts",
+		"""
+		INSERT INTO link_counts (processed_link, num_links)
+		SELECT processed_link, COUNT(*) FROM citations GROUP BY 1
+		""",
+		f"""
+		INSERT INTO domain_link_counts (domain, link_count)
+		SELECT link_domain_map.domain, SUM(link_counts.num_links) FROM link_counts
+		INNER JOIN link_domain_map ON link_counts.processed_link = link_domain_map.processed_link
+		WHERE {DOMAIN_LINK_FILTER} GROUP BY 1
+		"""
+	]
+
+	print("Rebuilding link counts...")
+	with db_session() as connection:
+		cursor = connection.cursor()
+		for query in queries:
+			cursor.execute(query)
+		cursor.close()
+
+def check_link_counts():
+	"""
+	Compares the materialised domain counts with a full aggregation of the citations table
+
+	Returns
+	-------
+	mismatches: array, tuples of domain, materialised count and aggregated count for domains that differ
+	"""
+	query = f"""
+	SELECT COALESCE(live.domain, stored.domain), stored.link_count, live.link_count FROM
+		(SELECT link_domain_map.domain, SUM(link_counts.num_links) AS link_count FROM
+			(SELECT processed_link, COUNT(*) AS num_links FROM citations GROUP BY 1) AS link_counts
+		INNER JOIN link_domain_map ON link_counts.processed_link = link_domain_map.processed_link
+		WHERE {DOMAIN_LINK_FILTER} GROUP BY 1) AS live
+	LEFT JOIN domain_link_counts AS stored ON live.domain = stored.domain
+	WHERE NOT (live.link_count <=> stored.link_count)
+	UNION ALL
+	SELECT stored.domain, stored.link_count, NULL FROM domain_link_counts AS stored
+	WHERE stored.link_count != 0 AND stored.domain NOT IN
+		(SELECT link_domain_map.domain FROM citations
+		INNER JOIN link_domain_map ON citations.processed_link = link_domain_map.processed_link
+		WHERE citations.processed_link NOT LIKE '%#%')
+	"""
+
+	with db_session() as connection:
+		cursor = connection.cursor()
+		cursor.execute(query)
+		mismatches = cursor.fetchall()
+		cursor.close()
+
+	for domain, stored_count, live_count in mismatches[:20]:
+		print(f"{domain}: stored {stored_count}, citations {live_count}")
+	print(f"{len(mismatches)} domains with mismatched counts...")
+
+	return mismatches
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument('-c', '--check', action = 'store_true')
+	args = parser.parse_args()
+
+	if args.check:
+		check_link_counts()
+	else:
+		rebuild_link_counts()
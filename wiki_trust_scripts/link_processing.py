@@ -0,0 +1,189 @@
+import re, argparse
+from urllib.parse import quote
+import pandas as pd
+from collections import Counter
+from functools import lru_cache
+from db_helpers import db_session
+from link_counts import apply_link_count_deltas
+
+# hosts of web archives whose links embed the url of the archived page
+ARCHIVE_SITES = [
+	"web.archive.org", "wayback.archive.org", "wayback.archive-it.org", "webarchive.loc.gov",
+	"archive.is", "archive.today", "archive.ph", "archive.fo", "archive.li", "archive.md", "archive.vn",
+	"www.webcitation.org", "webcitation.org", "webarchive.nationalarchives.gov.uk", "www.webarchive.org.uk",
+	"arquivo.pt", "timetravel.mementoweb.org", "ghostarchive.org", "archive.ec", "perma.cc"
+]
+
+# the host has to end after the archive site name, so hosts that only start with one (eg. archive.library.org) do not match
+ARCHIVE_SITE_PATTERN = re.compile("//(?:" + "|".join(re.escape(site) for site in ARCHIVE_SITES) + ")(?=[/:?#]|$)")
+EMBEDDED_URL_PATTERN = re.compile(r"^.{5}.*?(http.*)$", re.DOTALL)
+BASE_URL_PATTERN = re.compile(r"^(?:(?:http[s]?|ftp):\/)?\/?\/?(?P<host>[^\/\s]+)")
+
+# links processed by wikipedia's own relative urls
+WIKI_LINKS = {"wiki", "w"}
+WIKI_URL = "www.wikipedia.org"
+
+# characters mediawiki leaves unescaped in page urls
+WIKI_URL_SAFE_CHARACTERS = ";@$!*(),/~:"
+
+# max number of raw links to remember processed values for
+LINK_CACHE_SIZE = 2 ** 18
+
+def generate_page_id(title):
+	"""
+	Creates page id the way it appears in wikipedia urls from the page title
+
+	Parameters
+	----------
+	title: str, title of wikipedia page
+
+	Returns
+	-------
+	page_id: str, name of wikipedia page as used in its url
+	"""
+	page_id = quote(title.replace(" ", "_"), safe = WIKI_URL_SAFE_CHARACTERS)
+	return page_id
+
+def extract_archive_site(link_raw):
+	"""
+	Extracts base url from those sites that have been archived
+
+	Parameters
+	----------
+	link_raw: str, link directly from wikipedia citation
+
+	Returns
+	-------
+	link: str, non-archive-site link
+	"""
+	link_index = link_raw.find("http", 5) if ARCHIVE_SITE_PATTERN.search(link_raw) else -1
+
+	# links without an embedded url (eg. archive.is short links) are kept as is
+	link = link_raw[link_index:] if link_index >= 0 else link_raw
+	return link
+
+def standardize_wiki_url(processed_link):
+	"""
+	Standardizes the url for wikipedia for a post-processed link
+
+	Parameters
+	----------
+	processed_link: str, wiki link that has been processed by the extract_base_url function
+
+	Returns
+	-------
+	standardized_link: str, link that has been standardized
+	"""
+	standardized_link = WIKI_URL if processed_link in WIKI_LINKS else processed_link
+	return standardized_link
+
+def extract_base_url(link_raw):
+	"""
+	Processes links from wikipedia citations to get base urls
+
+	Parameters
+	----------
+	link_raw: str, link directly from wikipedia citation
+
+	Returns
+	-------
+	processed_link: str, base url (basically only the subdomain and domain)
+	"""
+	match = BASE_URL_PATTERN.search(link_raw)
+	processed_link = match.group("host") if match else ""
+	return processed_link
+
+@lru_cache(maxsize = LINK_CACHE_SIZE)
+def process_link(link_raw):
+	"""
+	Processes citation link from wikipedia through various steps, memoized on the raw link
+
+	Parameters
+	----------
+	link_raw: str, link directly from wikipedia citation
+
+	Returns
+	-------
+	standardized_link: str
+	"""
+	non_archive_link = extract_archive_site(link_raw)
+	processed_link = extract_base_url(non_archive_link)
+	standardized_link = standardize_wiki_url(processed_link)
+	return standardized_link
+
+def process_links(links_raw):
+	"""
+	Processes all citation links of a page in one call
+
+	Parameters
+	----------
+	links_raw: str array, links directly from wikipedia citations
+
+	Returns
+	-------
+	standardized_links: str array, processed links in the same order
+	"""
+	standardized_links = [process_link(link_raw) for link_raw in links_raw]
+	return standardized_links
+
+def process_link_series(links_raw):
+	"""
+	Processes a whole column of citation links with vectorised string operations
+
+	Parameters
+	----------
+	links_raw: Pandas Series, links directly from wikipedia citations
+
+	Returns
+	-------
+	standardized_links: Pandas Series, processed links with the same index
+	"""
+	links_raw = links_raw.fillna("")
+
+	# swap archive links for the link they embed
+	archive_mask = links_raw.str.contains(ARCHIVE_SITE_PATTERN)
+	embedded_links = links_raw.str.extract(EMBEDDED_URL_PATTERN, expand = False)
+	non_archive_links = links_raw.where(~archive_mask | embedded_links.isnull(), embedded_links)
+
+	processed_links = non_archive_links.str.extract(BASE_URL_PATTERN, expand = True)["host"].fillna("")
+	standardized_links = processed_links.where(~processed_links.isin(WIKI_LINKS), WIKI_URL)
+
+	return standardized_links
+
+def reprocess_citation_links(chunksize = 100000):
+	"""
+	Re-derives processed_link for every row in the citations table, updating only rows that change
+
+	Parameters
+	----------
+	chunksize: int, number of citations to read and update at a time
+	"""
+	# reads stream on one connection while updates are committed on another
+	with db_session() as read_connection, db_session() as write_connection:
+		cursor = write_connection.cursor()
+
+		query = "SELECT id, link, processed_link FROM citations"
+		for count, chunk in enumerate(pd.read_sql(query, read_connection, chunksize = chunksize)):
+			chunk["new_processed_link"] = process_link_series(chunk["link"])
+			changed = chunk[chunk["new_processed_link"] != chunk["processed_link"]]
+
+			update_query = "UPDATE citations SET processed_link = %s WHERE id = %s"
+			cursor.executemany(update_query, list(zip(changed["new_processed_link"].tolist(), changed["id"].tolist())))
+
+			# move the counts of changed citations from their old link to their new one
+			link_deltas = Counter(changed["new_processed_link"].tolist())
+			link_deltas.subtract(Counter(changed["processed_link"].tolist()))
+			apply_link_count_deltas(link_deltas, write_connection)
+			write_connection.commit()
+
+			print(f"{len(changed)} links updated in chunk {count + 1}...")
+
+		cursor.close()
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument('-c', '--chunksize', nargs = '?', type = int, default = 100000)
+	args = parser.parse_args()
+	params = {"chunksize":args.chunksize}
+
+	reprocess_citation_links(**params)
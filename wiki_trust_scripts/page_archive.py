@@ -0,0 +1,190 @@
+import os, gzip, mmap, threading, datetime
+
+# segments are closed and a new one started once they pass this size
+MAX_SEGMENT_BYTES = 2 ** 30
+
+def generate_segment_paths(archive_dir, segment_num):
+	"""
+	Creates paths of an archive segment and its offset index
+
+	Parameters
+	----------
+	archive_dir: str, directory of the archive
+	segment_num: int, number of the segment
+
+	Returns
+	-------
+	segment_path: str, path of the gzipped warc-like segment file
+	index_path: str, path of the segment's offset index
+	"""
+	segment_path = os.path.join(archive_dir, f"segment-{segment_num:05d}.warc.gz")
+	index_path = os.path.join(archive_dir, f"segment-{segment_num:05d}.idx")
+	return segment_path, index_path
+
+def list_segments(archive_dir):
+	"""
+	Lists segments in the archive in the order they were written
+
+	Parameters
+	----------
+	archive_dir: str, directory of the archive
+
+	Returns
+	-------
+	segment_nums: int array, numbers of the segments
+	"""
+	segment_nums = sorted(int(filename[8:13]) for filename in os.listdir(archive_dir) if filename.endswith(".idx"))
+	return segment_nums
+
+def encode_record(page_id, url, page_bytes):
+	"""
+	Creates a gzipped warc-style response record. Each record is its own gzip member,
+	so a single record can be decompressed from its offset and length alone
+
+	Parameters
+	----------
+	page_id: str, name of wikipedia page
+	url: str, url the page was fetched from
+	page_bytes: bytes, body of the response
+
+	Returns
+	-------
+	record: bytes, compressed record
+	"""
+	header = (
+		"WARC/1.0\r\n"
+		"WARC-Type: response\r\n"
+		f"WARC-Target-URI: {url}\r\n"
+		f"WARC-Date: {datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')}\r\n"
+		f"WARC-Page-Id: {page_id}\r\n"
+		f"Content-Length: {len(page_bytes)}\r\n"
+		"\r\n"
+	)
+
+	record = gzip.compress(header.encode("utf-8") + page_bytes + b"\r\n\r\n")
+	return record
+
+def decode_record(record):
+	"""
+	Reads headers and body of a gzipped record
+
+	Parameters
+	----------
+	record: bytes, compressed record
+
+	Returns
+	-------
+	headers: dict, warc headers of the record
+	page_bytes: bytes, body of the response
+	"""
+	raw = gzip.decompress(record)
+	header_end = raw.index(b"\r\n\r\n")
+
+	headers = {}
+	for line in raw[:header_end].decode("utf-8").split("\r\n")[1:]:
+		key, value = line.split(": ", 1)
+		headers[key] = value
+
+	body_start = header_end + 4
+	page_bytes = raw[body_start:body_start + int(headers["Content-Length"])]
+	return headers, page_bytes
+
+class ArchiveWriter(object):
+	"""
+	Appends fetched pages to the newest archive segment, starting a new segment once it is full.
+	Index lines are only written after their record, so the index never points at partial data
+	"""
+
+	def __init__(self, archive_dir, max_segment_bytes = MAX_SEGMENT_BYTES):
+		os.makedirs(archive_dir, exist_ok = True)
+		self.archive_dir = archive_dir
+		self.max_segment_bytes = max_segment_bytes
+		self.lock = threading.Lock()
+
+		# always start a fresh segment so earlier runs are never appended to
+		segment_nums = list_segments(archive_dir)
+		self.segment_num = segment_nums[-1] if segment_nums else 0
+		self.open_next_segment()
+
+	def open_next_segment(self):
+		self.segment_num += 1
+		segment_path, index_path = generate_segment_paths(self.archive_dir, self.segment_num)
+		self.segment_file = open(segment_path, "ab")
+		self.index_file = open(index_path, "a", encoding = "utf-8")
+
+	def append(self, page_id, url, page_bytes):
+		"""
+		Adds a fetched page to the archive
+
+		Parameters
+		----------
+		page_id: str, name of wikipedia page
+		url: str, url the page was fetched from
+		page_bytes: bytes, body of the response
+		"""
+		record = encode_record(page_id, url, page_bytes)
+
+		with self.lock:
+			if self.segment_file.tell() > self.max_segment_bytes:
+				self.close()
+				self.open_next_segment()
+
+			offset = self.segment_file.tell()
+			self.segment_file.write(record)
+			self.segment_file.flush()
+
+			self.index_file.write(f"{page_id}\t{offset}\t{len(record)}\n")
+			self.index_file.flush()
+
+	def close(self):
+		self.segment_file.close()
+		self.index_file.close()
+
+def read_index(archive_dir):
+	"""
+	Finds the latest archived record of every page
+
+	Parameters
+	----------
+	archive_dir: str, directory of the archive
+
+	Returns
+	-------
+	segment_entries: dict, segment path to array of (page_id, offset, length) tuples
+	"""
+	locations = {}
+	for segment_num in list_segments(archive_dir):
+		segment_path, index_path = generate_segment_paths(archive_dir, segment_num)
+		with open(index_path, encoding = "utf-8") as index_file:
+			for line in index_file:
+				page_id, offset, length = line.rstrip("\n").split("\t")
+				locations[page_id] = (segment_path, int(offset), int(length))
+
+	segment_entries = {}
+	for page_id, (segment_path, offset, length) in locations.items():
+		segment_entries.setdefault(segment_path, []).append((page_id, offset, length))
+
+	# read each segment front to back
+	for entries in segment_entries.values():
+		entries.sort(key = lambda entry: entry[1])
+
+	return segment_entries
+
+def iterate_segment_pages(segment_path, entries):
+	"""
+	Reads archived pages out of a memory-mapped segment
+
+	Parameters
+	----------
+	segment_path: str, path of the segment file
+	entries: array, (page_id, offset, length) tuples of the records to read
+
+	Returns
+	-------
+	pages: generator, yields tuples of page id and raw page html
+	"""
+	with open(segment_path, "rb") as segment_file:
+		with mmap.mmap(segment_file.fileno(), 0, access = mmap.ACCESS_READ) as segment:
+			for page_id, offset, length in entries:
+				_, page_bytes = decode_record(segment[offset:offset + length])
+				yield page_id, page_bytes.decode("utf-8", errors = "replace")
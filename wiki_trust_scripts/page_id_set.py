@@ -0,0 +1,138 @@
+import argparse, hashlib, os
+import numpy as np
+from db_helpers import iterate_column_values, db_session
+
+def hash_page_id(page_id):
+	"""
+	Hashes page id to a 64 bit integer
+
+	Parameters
+	----------
+	page_id: str, name of wikipedia page
+
+	Returns
+	-------
+	page_hash: int, 64 bit hash of the page id
+	"""
+	page_hash = int.from_bytes(hashlib.blake2b(page_id.encode("utf-8"), digest_size = 8).digest(), "little")
+	return page_hash
+
+class PageIdSet(object):
+	"""
+	Membership set of page ids stored as a sorted array of 64 bit hashes, 8 bytes per page instead of a python string.
+	With millions of pages the chance of two ids sharing a hash is around one in a million, and verify
+	confirms every hit against the pages table for callers that cannot accept that
+	"""
+
+	def __init__(self, hashes, verify = False):
+		self.hashes = hashes
+		self.verify = verify
+
+		# pages added after the array was built, kept apart so the array never needs re-sorting
+		self.added = set()
+
+	def __len__(self):
+		return len(self.hashes) + len(self.added)
+
+	def __contains__(self, page_id):
+		if page_id in self.added:
+			return True
+
+		page_hash = np.uint64(hash_page_id(page_id))
+		index = np.searchsorted(self.hashes, page_hash)
+		found = index < len(self.hashes) and self.hashes[index] == page_hash
+
+		if found and self.verify:
+			with db_session() as connection:
+				cursor = connection.cursor()
+				cursor.execute("SELECT 1 FROM pages WHERE id = %s", (page_id,))
+				found = cursor.fetchone() is not None
+				cursor.close()
+
+		return found
+
+	def add(self, page_id):
+		self.added.add(page_id)
+
+	def update(self, page_ids):
+		self.added.update(page_ids)
+
+	def save(self, path):
+		"""
+		Writes the set to disk as a numpy array, folding in added pages
+
+		Parameters
+		----------
+		path: str, path of the .npy file
+		"""
+		added_hashes = np.array([hash_page_id(page_id) for page_id in self.added], dtype = np.uint64)
+		hashes = np.union1d(self.hashes, added_hashes).astype(np.uint64)
+		np.save(path, hashes)
+
+	@classmethod
+	def load(cls, path, verify = False):
+		"""
+		Memory-maps a set saved to disk
+
+		Parameters
+		----------
+		path: str, path of the .npy file
+		verify: bool, confirm hits against the pages table
+
+		Returns
+		-------
+		page_id_set: PageIdSet, set of page ids
+		"""
+		page_id_set = cls(np.load(path, mmap_mode = "r"), verify)
+		return page_id_set
+
+	@classmethod
+	def from_db(cls, table_name = "pages", column_name = "id", chunk_size = 100000, verify = False):
+		"""
+		Builds set from a table column, streaming the column so only hashes are ever held in memory
+
+		Parameters
+		----------
+		table_name: str, name of table in db
+		column_name: str, name of column in table
+		chunk_size: int, number of values fetched from the server at a time
+		verify: bool, confirm hits against the pages table
+
+		Returns
+		-------
+		page_id_set: PageIdSet, set of page ids
+		"""
+		hash_chunks = [np.fromiter((hash_page_id(page_id) for page_id in chunk), dtype = np.uint64, count = len(chunk))
+			for chunk in iterate_column_values(table_name, column_name, chunk_size)]
+
+		hashes = np.unique(np.concatenate(hash_chunks)) if hash_chunks else np.array([], dtype = np.uint64)
+		page_id_set = cls(hashes, verify)
+		return page_id_set
+
+def get_page_id_set(path = None, verify = False):
+	"""
+	Gets the set of page ids in the db, from disk if it has been saved before
+
+	Parameters
+	----------
+	path: str, path of a saved .npy set, None to always read the pages table
+	verify: bool, confirm hits against the pages table
+
+	Returns
+	-------
+	page_id_set: PageIdSet, set of page ids
+	"""
+	if path and os.path.exists(path):
+		return PageIdSet.load(path, verify)
+
+	page_id_set = PageIdSet.from_db(verify = verify)
+	return page_id_set
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument('-o', '--output_path', nargs = 1, type = str)
+	args = parser.parse_args()
+
+	page_id_set = PageIdSet.from_db()
+	page_id_set.save(args.output_path[0])
+	print(f"Saved {len(page_id_set)} page ids...")
@@ -1,99 +1,249 @@
-import boto3, botocore, os
+import botocore.exceptions, re, argparse
+from collections import deque
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from get_domain_data import generate_filename, initiate_s3_object, initiate_awis_object, get_alexa_data, store_alexa_data
-from db_helpers import get_list_from_custom_query, update_domain_record
-from bs4 import BeautifulSoup
+from db_helpers import get_list_from_custom_query, bulk_update_domain_records
+from alexa_shards import ShardReader, ShardWriter
 
-def retrieve_object(domain, s3_object):
+# first element of each field, the same one BeautifulSoup's find returns. tags are matched in any case
+# since stored files were lowercased by html.parser
+RANK_PATTERN = re.compile(r"<aws:rank(?:\s[^>]*)?(?:/>|>(.*?)</aws:rank\s*>)", re.DOTALL | re.IGNORECASE)
+LINKSINCOUNT_PATTERN = re.compile(r"<aws:linksincount(?:\s[^>]*)?(?:/>|>(.*?)</aws:linksincount\s*>)", re.DOTALL | re.IGNORECASE)
+TAG_PATTERN = re.compile(r"<[^>]*>")
+
+def retrieve_object(domain, s3_object, bucket_name = 'wiki-trust-bucket'):
 	"""
-	Creates xml object that can be parsed from alexa data saved in s3
-	
+	Reads alexa data saved in s3
+
 	Parameters
 	----------
 	domain: str, full domain string (eg. www.wikipedia.org)
 	s3_object: boto client, object that interfaces with Amazon S3
-	
+	bucket_name: str, name of S3 bucket
+
 	Returns
 	-------
-	soup, BeautifulSoup, object that can be parsed with BeautifulSoup library
+	file_raw: str, alexa xml of the domain
 	"""
 	filename = generate_filename(domain)
-	file_object = s3_object.get_object(Bucket='wiki-trust-bucket', Key=filename)
+	file_object = s3_object.get_object(Bucket=bucket_name, Key=filename)
 	file_raw = file_object["Body"].read().decode()
-	soup = BeautifulSoup(file_raw, 'html.parser')
-	return soup
+	return file_raw
 
-def process_alexa_data(soup):
+def extract_field(pattern, alexa_text):
 	"""
-	Gets rank and linksincount of domain
+	Gets the text of the first element matching a field pattern
 
 	Parameters
 	----------
-	soup, BeautifulSoup, object that can be parsed with BeautifulSoup library
+	pattern: compiled regex, pattern of the field element
+	alexa_text: str, alexa xml of a domain
 
 	Returns
 	-------
-	rank: int, domain's alexa rank
-	linksincount: int, number of sites linking into domain
+	value: int, number in the element, None if the element is missing or empty
 	"""
-	rank = soup.find('aws:rank').text
-	linksincount = soup.find('aws:linksincount').text
+	match = pattern.search(alexa_text)
+	if match is None:
+		return None
+
+	value = TAG_PATTERN.sub("", match.group(1) or "").strip().replace(",", "")
+	return int(value) if value.isdigit() else None
 
-	rank = 'NULL' if rank == '' else rank
-	linksincount = 'NULL' if linksincount == '' else linksincount
+def process_alexa_data(alexa_text):
+	"""
+	Gets rank and linksincount of domain, scanning the raw xml rather than building a parse tree
+
+	Parameters
+	----------
+	alexa_text: str, alexa xml of a domain
+
+	Returns
+	-------
+	rank: int, domain's alexa rank, None if missing
+	linksincount: int, number of sites linking into domain, None if missing
+	"""
+	rank = extract_field(RANK_PATTERN, alexa_text)
+	linksincount = extract_field(LINKSINCOUNT_PATTERN, alexa_text)
 
 	return rank, linksincount
 
-def process_domain_data(bucket_name = 'wiki-trust-bucket'):
+def fetch_domain_data(domain, s3_object, awis_object, bucket_name = 'wiki-trust-bucket'):
 	"""
-	Extract data from alexa files and add to domains table in db
+	Gets rank and linksincount of domain from s3, querying awis and saving to s3 if the file does not exist
 
 	Parameters
 	----------
+	domain: str, full domain string (eg. www.wikipedia.org)
+	s3_object: boto client, object that interfaces with Amazon S3
+	awis_object: AWIS client, client that queries Alexa Web Information Services
 	bucket_name: str, name of S3 bucket
+
+	Returns
+	-------
+	rank: int, domain's alexa rank
+	linksincount: int, number of sites linking into domain
 	"""
-	
-	# query links to get domain data for
-	domains_query = """
-	SELECT domain FROM domains WHERE alexa_linksincount IS NULL
+
+	# attempt to get data file from s3
+	try:
+		alexa_text = retrieve_object(domain, s3_object, bucket_name)
+
+	# if file does not exist, query file from awis and save to s3
+	except botocore.exceptions.ClientError as e:
+
+		if e.response['Error']['Code'] != 'NoSuchKey':
+			raise
+
+		# retrieve awis data
+		print(f"Retrieving data file for {domain}...")
+		alexa_data, _ = get_alexa_data(awis_object, domain)
+
+		# store alexa data in s3 bucket and use the response directly
+		store_alexa_data(s3_object, bucket_name, alexa_data, domain)
+		alexa_text = str(alexa_data)
+
+	return process_alexa_data(alexa_text)
+
+def iterate_prefetched(executor, function, items, window):
 	"""
-	domains = get_list_from_custom_query(domains_query, 0)
+	Runs a function over items in an executor, keeping a bounded number of calls ahead of the caller
 
-	# initiate s3 object
-	s3_object = initiate_s3_object(bucket_name)
+	Parameters
+	----------
+	executor: Executor, executor the calls run in
+	function: function, function called with each item
+	items: array, items to call the function with
+	window: int, max number of calls submitted but not yet consumed
 
-	# loop through each domain, retreive data, and update in db
+	Returns
+	-------
+	results: generator, yields tuples of item and result in item order
+	"""
+	pending = deque()
+	for item in items:
+		pending.append((item, executor.submit(function, item)))
+		if len(pending) >= window:
+			item, future = pending.popleft()
+			yield item, future.result()
+
+	while pending:
+		item, future = pending.popleft()
+		yield item, future.result()
+
+def store_domain_data(domain_data, write_batch_size = 1000):
+	"""
+	Adds alexa data to domains table in db in batches. Batches already read are written even if reading fails part way
+
+	Parameters
+	----------
+	domain_data: iterable, (domain, alexa_rank, alexa_linksincount) tuples
+	write_batch_size: int, number of domains updated at a time
+	"""
+	domain_records = []
+	try:
+		for domain, rank, linksincount in domain_data:
+			print(domain, rank, linksincount)
+			domain_records.append((domain, rank, linksincount))
+
+			if len(domain_records) >= write_batch_size:
+				bulk_update_domain_records(domain_records)
+				domain_records = []
+	finally:
+		bulk_update_domain_records(domain_records)
+
+def iterate_sharded_domain_data(domains, shard_dir, s3_object, awis_object, bucket_name = 'wiki-trust-bucket'):
+	"""
+	Extract data from alexa shards, reading each shard once front to back.
+	Domains without a stored document are queried from awis and packed into a new shard
+
+	Parameters
+	----------
+	domains: str array, domains to process
+	shard_dir: str, local directory of the shards, shards missing from it are read from S3
+	s3_object: boto client, object that interfaces with Amazon S3
+	awis_object: AWIS client, client that queries Alexa Web Information Services
+	bucket_name: str, name of S3 bucket
+
+	Returns
+	-------
+	domain_data: generator, yields (domain, alexa_rank, alexa_linksincount) tuples
+	"""
+	shard_reader = ShardReader(shard_dir, s3_object, bucket_name)
+	missing_domains = set(domains)
+
+	for domain, document in shard_reader.iterate_documents(missing_domains):
+		missing_domains.discard(domain)
+		yield (domain,) + process_alexa_data(document.decode())
+
+	shard_reader.close()
+
+	shard_writer = ShardWriter(shard_dir, s3_object, bucket_name)
 	for domain in domains:
-		
-		# attempt to get data file from s3
-		try:
-			soup = retrieve_object(domain, s3_object)
+		if domain not in missing_domains:
+			continue
 
-		# if file does not exist, query file from awis and save to s3
-		except botocore.exceptions.ClientError as e:
+		# retrieve awis data and pack it with the other documents
+		print(f"Retrieving data file for {domain}...")
+		alexa_data, _ = get_alexa_data(awis_object, domain)
+		shard_writer.append(domain, str(alexa_data).encode())
+
+		yield (domain,) + process_alexa_data(str(alexa_data))
 
-			if e.response['Error']['Code'] == 'NoSuchKey':
+	shard_writer.close()
+
+def process_domain_data(bucket_name = 'wiki-trust-bucket', num_workers = 16, cache_dir = None, shard_dir = None, write_batch_size = 1000):
+	"""
+	Extract data from alexa files and add to domains table in db, downloading files from several threads
+	while earlier domains are written to the db
 
-				# retrieve awis data
-				print(f"Retrieving data file for {domain}...")
-				awis_object = initiate_awis_object()
-				alexa_data, _ = get_alexa_data(awis_object, domain)
+	Parameters
+	----------
+	bucket_name: str, name of S3 bucket
+	num_workers: int, number of threads downloading files
+	cache_dir: str, directory of the local cache of alexa data, repeated runs read files from it instead of S3
+	shard_dir: str, local directory of alexa shards, None to read one object per domain
+	write_batch_size: int, number of domains updated in the db at a time
+	"""
 
-				# store alexa data in s3 bucket
-				store_alexa_data(s3_object, bucket_name, alexa_data, domain)
+	# query links to get domain data for
+	domains_query = """
+	SELECT domain FROM domains WHERE alexa_linksincount IS NULL
+	"""
+	domains = get_list_from_custom_query(domains_query, 0)
 
-				soup = retrieve_object(domain, s3_object)
+	# initiate s3 and awis objects once, shared by all threads
+	s3_object = initiate_s3_object(bucket_name, max_pool_connections = num_workers, cache_dir = cache_dir)
+	awis_object = initiate_awis_object(num_workers)
 
-			else:
+	if shard_dir is not None:
+		store_domain_data(iterate_sharded_domain_data(domains, shard_dir, s3_object, awis_object, bucket_name), write_batch_size)
+		return
 
-				print(e)
-				break
+	fetch = partial(fetch_domain_data, s3_object = s3_object, awis_object = awis_object, bucket_name = bucket_name)
 
+	# loop through each domain, retreive data, and update in db
+	with ThreadPoolExecutor(num_workers) as executor:
+		prefetched = iterate_prefetched(executor, fetch, domains, num_workers * 4)
+		try:
+			store_domain_data(((domain, rank, linksincount) for domain, (rank, linksincount) in prefetched), write_batch_size)
 
-		# update data in db
-		rank, linksincount = process_alexa_data(soup)
-		print(domain, rank, linksincount)
-		update_domain_record(domain, rank, linksincount)
+		except botocore.exceptions.ClientError as e:
+			print(e)
 
 if __name__ == "__main__":
-	process_domain_data()
-
+	parser = argparse.ArgumentParser()
+	parser.add_argument('-w', '--num_workers', nargs = '?', type = int, default = 16)
+	parser.add_argument('-d', '--cache_dir', nargs = '?', type = str, default = None)
+	parser.add_argument('-a', '--shard_dir', nargs = '?', type = str, default = None)
+	parser.add_argument('-s', '--write_batch_size', nargs = '?', type = int, default = 1000)
+
+	args = parser.parse_args()
+	params = {}
+	params["num_workers"] = args.num_workers
+	params["cache_dir"] = args.cache_dir
+	params["shard_dir"] = args.shard_dir
+	params["write_batch_size"] = args.write_batch_size
+
+	process_domain_data(**params)
@@ -0,0 +1,278 @@
+import os, re, ipaddress, argparse
+from functools import lru_cache
+from db_helpers import db_session
+
+PUBLIC_SUFFIX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "input_data", "public_suffix_list.dat")
+
+# platforms where alexa ranks each user's subdomain as its own site, so their hosts are left to awis
+AWIS_SUBDOMAIN_SITES = {
+	"blogspot.com", "wordpress.com", "tumblr.com", "livejournal.com", "typepad.com", "blogs.com", "github.io",
+	"weebly.com", "wixsite.com", "substack.com", "medium.com", "over-blog.com", "canalblog.com", "hatenablog.com",
+	"appspot.com", "herokuapp.com", "netlify.com"
+}
+
+HOST_LABEL_PATTERN = re.compile(r"^[a-z0-9](?:[a-z0-9-]*[a-z0-9])?$")
+
+# max number of hosts to remember resolved domains for
+HOST_CACHE_SIZE = 2 ** 18
+
+class PublicSuffixList(object):
+	"""
+	Rules of the public suffix list, used to find the registrable domain of a host. Each rule maps to whether
+	it comes from the private section of the list (suffixes run by companies, eg. github.io) or the icann section
+	"""
+
+	def __init__(self, rules, wildcards, exceptions):
+		self.rules = rules
+		self.wildcards = wildcards
+		self.exceptions = exceptions
+
+	@classmethod
+	def load(cls, path = PUBLIC_SUFFIX_PATH):
+		"""
+		Reads a list in the publicsuffix.org format. Internationalized rules are also added in their
+		punycode form, the form hosts appear in links
+
+		Parameters
+		----------
+		path: str, path of the list file
+
+		Returns
+		-------
+		suffix_list: PublicSuffixList, rules of the list
+		"""
+		rules, wildcards, exceptions = {}, {}, {}
+		private = False
+
+		with open(path, encoding = "utf-8") as list_file:
+			for line in list_file:
+				if line.startswith("// ===BEGIN PRIVATE DOMAINS==="):
+					private = True
+
+				rule = line.strip().split(" ")[0].lower()
+				if not rule or rule.startswith("//"):
+					continue
+
+				if rule.startswith("!"):
+					rule_set, rule = exceptions, rule[1:]
+				elif rule.startswith("*."):
+					rule_set, rule = wildcards, rule[2:]
+				else:
+					rule_set = rules
+
+				rule_set[rule] = private
+				if not rule.isascii():
+					try:
+						rule_set.setdefault(rule.encode("idna").decode("ascii"), private)
+					except UnicodeError:
+						pass
+
+		suffix_list = cls(rules, wildcards, exceptions)
+		return suffix_list
+
+	def match_suffix(self, host):
+		"""
+		Finds the longest public suffix of a host and the section of the rule that matched it
+
+		Parameters
+		----------
+		host: str, lowercase host name
+
+		Returns
+		-------
+		suffix: str, public suffix of the host, None if no rule matches
+		private: bool, the matching rule is in the private section of the list
+		"""
+		labels = host.split(".")
+
+		for i in range(len(labels)):
+			candidate = ".".join(labels[i:])
+			parent = ".".join(labels[i + 1:])
+
+			# exception rules override the wildcard they carve out of
+			if candidate in self.exceptions:
+				return parent, self.exceptions[candidate]
+			if candidate in self.rules:
+				return candidate, self.rules[candidate]
+			if parent in self.wildcards:
+				return candidate, self.wildcards[parent]
+
+		return None, False
+
+	def get_public_suffix(self, host):
+		"""
+		Finds the longest public suffix of a host
+
+		Parameters
+		----------
+		host: str, lowercase host name
+
+		Returns
+		-------
+		suffix: str, public suffix of the host, None if no rule matches
+		"""
+		suffix, _ = self.match_suffix(host)
+		return suffix
+
+	def get_registrable_domain(self, host, icann_only = False):
+		"""
+		Finds the registrable domain of a host, its public suffix plus one label
+
+		Parameters
+		----------
+		host: str, lowercase host name
+		icann_only: bool, treat hosts under private section suffixes as having no registrable domain
+
+		Returns
+		-------
+		domain: str, registrable domain (eg. nytimes.com for www.nytimes.com), None if there is none
+		"""
+		suffix, private = self.match_suffix(host)
+		if suffix is None or suffix == host or (private and icann_only):
+			return None
+
+		domain = ".".join(host[:-len(suffix) - 1].split(".")[-1:] + [suffix])
+		return domain
+
+# suffix list shared by every resolve in a process, read on first use
+SUFFIX_LISTS = {}
+
+def get_suffix_list(path = PUBLIC_SUFFIX_PATH):
+	"""
+	Gets the suffix list of a file, reading it the first time it is used
+
+	Parameters
+	----------
+	path: str, path of the list file
+
+	Returns
+	-------
+	suffix_list: PublicSuffixList, rules of the list
+	"""
+	if path not in SUFFIX_LISTS:
+		SUFFIX_LISTS[path] = PublicSuffixList.load(path)
+
+	return SUFFIX_LISTS[path]
+
+def normalize_host(processed_link):
+	"""
+	Strips credentials, port and trailing dot from a processed link
+
+	Parameters
+	----------
+	processed_link: str, base url of a citation link (eg. www.nytimes.com)
+
+	Returns
+	-------
+	host: str, lowercase host name
+	"""
+	host = processed_link.lower().rsplit("@", 1)[-1]
+	if not host.startswith("["):
+		host = host.split(":", 1)[0]
+	return host.strip(".")
+
+def is_ip_address(host):
+	"""
+	Checks if a host is an ip address rather than a name
+	"""
+	try:
+		ipaddress.ip_address(host.strip("[]"))
+		return True
+	except ValueError:
+		return False
+
+@lru_cache(maxsize = HOST_CACHE_SIZE)
+def resolve_domain(processed_link):
+	"""
+	Maps a processed link to the domain alexa would report for it, without calling awis.
+	Ip addresses, hosts without a known suffix, malformed hosts, hosts under private section suffixes and hosts
+	on platforms whose subdomains alexa ranks separately are ambiguous and left to awis
+
+	Parameters
+	----------
+	processed_link: str, base url of a citation link (eg. www.nytimes.com)
+
+	Returns
+	-------
+	domain: str, registrable domain of the link, None if the link is ambiguous
+	"""
+	host = normalize_host(processed_link)
+	if not host or is_ip_address(host):
+		return None
+
+	if not all(HOST_LABEL_PATTERN.match(label) for label in host.split(".")):
+		return None
+
+	# alexa does not follow the private section (eg. it ranks github.io rather than user.github.io),
+	# so hosts under those suffixes are left to awis
+	domain = get_suffix_list().get_registrable_domain(host, icann_only = True)
+	if domain is None:
+		return None
+
+	# user sites on blogging and hosting platforms
+	if domain in AWIS_SUBDOMAIN_SITES and host != domain:
+		return None
+
+	return domain
+
+def resolve_links(processed_links):
+	"""
+	Splits links into those resolved locally and those that need awis
+
+	Parameters
+	----------
+	processed_links: str array, base urls of citation links
+
+	Returns
+	-------
+	resolved_links: array, tuples of link and domain for links resolved locally
+	ambiguous_links: str array, links that need awis to resolve
+	"""
+	resolved_links, ambiguous_links = [], []
+	for processed_link in processed_links:
+		domain = resolve_domain(processed_link)
+		if domain is None:
+			ambiguous_links.append(processed_link)
+		else:
+			resolved_links.append((processed_link, domain))
+
+	return resolved_links, ambiguous_links
+
+def compare_with_awis(num_mismatches = 20):
+	"""
+	Checks local resolution against the domains awis already reported in link_domain_map
+
+	Parameters
+	----------
+	num_mismatches: int, number of mismatched links to print
+	"""
+	with db_session() as connection:
+		cursor = connection.cursor()
+		cursor.execute("SELECT processed_link, domain FROM link_domain_map")
+		link_domains = cursor.fetchall()
+		cursor.close()
+
+	resolved, matched, mismatches = 0, 0, []
+	for processed_link, awis_domain in link_domains:
+		domain = resolve_domain(processed_link)
+		if domain is None:
+			continue
+
+		resolved += 1
+		if domain == awis_domain:
+			matched += 1
+		elif len(mismatches) < num_mismatches:
+			mismatches.append((processed_link, awis_domain, domain))
+
+	for processed_link, awis_domain, domain in mismatches:
+		print(f"{processed_link}: awis {awis_domain}, local {domain}")
+
+	print(f"{resolved} of {len(link_domains)} links resolved locally, {matched} match awis...")
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument('-n', '--num_mismatches', nargs = '?', type = int, default = 20)
+	args = parser.parse_args()
+	params = {"num_mismatches":args.num_mismatches}
+
+	compare_with_awis(**params)
@@ -1,59 +1,202 @@
-import requests
+import requests, argparse
 from bs4 import BeautifulSoup
-from db_helpers import push_records_to_db, get_unique_set, get_latest_page_id
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs
+from db_helpers import push_records_to_db, get_latest_page_id, db_session
+from page_id_set import get_page_id_set
+from scrape_status import enqueue_pages
+from link_processing import generate_page_id
 
-def scrape_page(all_page_ids, soup):
+ALLPAGES_URL = "https://en.wikipedia.org/w/index.php"
+API_URL = "https://en.wikipedia.org/w/api.php"
+
+def get_continuation(crawler):
 	"""
-	Scrapes pages with list of wikipedia pages and adds it to db
+	Retrieves the saved position of a crawler
 
 	Parameters
 	----------
-	all_page_ids: set, all page ids already in db
-	soup: BeautifulSoup object, soup of page with list of pages
+	crawler: str, name of the crawler
+
+	Returns
+	-------
+	continuation: str, token to resume the crawl from, None if the crawler has not run
 	"""
+	with db_session() as connection:
+		cursor = connection.cursor()
+		cursor.execute("SELECT continuation FROM crawl_state WHERE crawler = %s", (crawler,))
+		row = cursor.fetchone()
+		cursor.close()
 
-	pages_db_data = []
+	continuation = row[0] if row else None
+	return continuation
+
+def save_continuation(crawler, continuation, connection = None):
+	"""
+	Saves the position of a crawler
+
+	Parameters
+	----------
+	crawler: str, name of the crawler
+	continuation: str, token to resume the crawl from
+	connection: mysql.connector object, connection of an existing session
+	"""
+	query = """
+	INSERT INTO crawl_state (crawler, continuation) VALUES (%s, %s)
+	ON DUPLICATE KEY UPDATE continuation = VALUES(continuation)
+	"""
+
+	with db_session(connection) as connection:
+		cursor = connection.cursor()
+		cursor.execute(query, (crawler, continuation))
+		cursor.close()
+
+def fetch_listing(session, source, continuation):
+	"""
+	Downloads one page of the article listing
+
+	Parameters
+	----------
+	session: requests Session, session holding the keep-alive connection
+	source: str, 'html' for the Special:AllPages page, 'api' for the allpages api
+	continuation: str, token of the listing page to fetch, None for the first page
+
+	Returns
+	-------
+	listing: str or dict, html of the listing page or parsed api response
+	"""
+	if source == "api":
+		params = {"action":"query", "list":"allpages", "apnamespace":0, "aplimit":500, "format":"json"}
+		if continuation:
+			params["apcontinue"] = continuation
+		response = session.get(API_URL, params = params)
+		response.raise_for_status()
+		return response.json()
+
+	params = {"title":"Special:AllPages"}
+	if continuation:
+		params["from"] = continuation
+	response = session.get(ALLPAGES_URL, params = params)
+	response.raise_for_status()
+	return response.text
+
+def parse_html_listing(listing):
+	"""
+	Extracts pages and the next continuation token from a Special:AllPages page
+
+	Parameters
+	----------
+	listing: str, html of the listing page
+
+	Returns
+	-------
+	pages_db_data: dict array, page records in the listing
+	continuation: str, token of the next listing page, None on the last page
+	"""
+	soup = BeautifulSoup(listing, "html.parser")
 
-	# loop through each page link and add it to list
+	pages_db_data = []
 	for item in soup.find("div", class_="mw-allpages-body").find_all("li"):
 		page_link = item.find("a")
 		page_id = page_link["href"].replace("/wiki/", "")
+		pages_db_data.append({"id":page_id, "name":page_link["title"], "language":"english"})
 
-		# check if page already in db
-		if page_id not in all_page_ids:
-			page_data = {"id":page_id, "name":page_link["title"], "language":"english"}
-			pages_db_data.append(page_data)
+	# the nav holds previous and next links, only the next link moves the crawl forward
+	continuation = None
+	for nav_link in soup.find("div", class_="mw-allpages-nav").find_all("a"):
+		if nav_link.text.startswith("Next page"):
+			continuation = parse_qs(urlparse(nav_link["href"]).query)["from"][0]
 
-	push_records_to_db("pages", pages_db_data)
+	return pages_db_data, continuation
 
-def scrape_all_article_names():
+def parse_api_listing(listing):
 	"""
-	Scrapes all wikipedia article names
+	Extracts pages and the next continuation token from an allpages api response
+
+	Parameters
+	----------
+	listing: dict, parsed api response
+
+	Returns
+	-------
+	pages_db_data: dict array, page records in the listing
+	continuation: str, token of the next listing page, None on the last page
+	"""
+	pages_db_data = [{"id":generate_page_id(page["title"]), "name":page["title"], "language":"english"}
+		for page in listing["query"]["allpages"]]
+	continuation = listing.get("continue", {}).get("apcontinue")
+
+	return pages_db_data, continuation
+
+def store_listing(crawler, all_page_ids, pages_db_data, continuation):
+	"""
+	Adds new pages of a listing to the db, queues them for scraping and checkpoints the crawler in one transaction
+
+	Parameters
+	----------
+	crawler: str, name of the crawler
+	all_page_ids: PageIdSet, all page ids already in db
+	pages_db_data: dict array, page records in the listing
+	continuation: str, token of the next listing page, None on the last page
+	"""
+
+	# check if page already in db
+	new_pages_db_data = [page_data for page_data in pages_db_data if page_data["id"] not in all_page_ids]
+
+	# add pages and queue them for scraping in one transaction
+	with db_session() as connection:
+		push_records_to_db("pages", new_pages_db_data, connection = connection, ignore = True)
+		enqueue_pages([page_data["id"] for page_data in new_pages_db_data], connection = connection)
+		if continuation:
+			save_continuation(crawler, continuation, connection)
+
+	all_page_ids.update(page_data["id"] for page_data in new_pages_db_data)
+
+def scrape_all_article_names(source = "html", page_id_set_path = None):
+	"""
+	Scrapes all wikipedia article names, fetching the next listing page while the current one is stored
+
+	Parameters
+	----------
+	source: str, 'html' to crawl the Special:AllPages page, 'api' to crawl the allpages api 500 titles at a time
+	page_id_set_path: str, path of a saved page id set to load instead of reading the pages table, updated when the crawl ends
 	"""
 
 	# get page ids that have already been scraped
-	all_page_ids = get_unique_set("pages", "id")
+	all_page_ids = get_page_id_set(page_id_set_path)
+
+	# resume from the checkpoint, falling back to the latest page for crawls started before checkpoints existed
+	crawler = f"allpages_{source}"
+	continuation = get_continuation(crawler)
+	if continuation is None and source == "html":
+		continuation = get_latest_page_id()
 
-	additional_pages = True
-	latest_page_id = get_latest_page_id()
-	url = f"https://en.wikipedia.org/w/index.php?title=Special:AllPages&from={latest_page_id}"
-	print(url)
+	parse_listing = parse_api_listing if source == "api" else parse_html_listing
+	session = requests.Session()
 
-	# keep scraping while there is a 'next' page
-	while additional_pages:
+	with ThreadPoolExecutor(1) as fetch_executor:
+		next_listing = fetch_executor.submit(fetch_listing, session, source, continuation)
 
-		page_html = requests.get(url)
-		soup = BeautifulSoup(page_html.text, "html.parser")
-		scrape_page(all_page_ids, soup)
+		# keep scraping while there is a 'next' page
+		count = 0
+		while next_listing is not None:
+			pages_db_data, continuation = parse_listing(next_listing.result())
+			next_listing = fetch_executor.submit(fetch_listing, session, source, continuation) if continuation else None
 
-		url_suffix = soup.find("div", class_="mw-allpages-nav").find_all("a")[1]["href"]
+			store_listing(crawler, all_page_ids, pages_db_data, continuation)
 
-		# check if next page
-		if url_suffix:
-			url = f"https://en.wikipedia.org{url_suffix}"
-			print(url)
-		else:
-			additional_pages = False
+			count += 1
+			print(f"{count} listing pages complete, next from {continuation}...")
+
+	if page_id_set_path:
+		all_page_ids.save(page_id_set_path)
 
 if __name__ == "__main__":
-	scrape_all_article_names()
\ No newline at end of file
+	parser = argparse.ArgumentParser()
+	parser.add_argument('-s', '--source', nargs = '?', type = str, default = 'html', choices = ['html', 'api'])
+	parser.add_argument('-i', '--page_id_set_path', nargs = '?', type = str, default = None)
+
+	args = parser.parse_args()
+	params = {"source":args.source, "page_id_set_path":args.page_id_set_path}
+
+	scrape_all_article_names(**params)
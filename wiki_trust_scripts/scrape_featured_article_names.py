@@ -1,14 +1,20 @@
-import requests
+import requests, argparse
 from bs4 import BeautifulSoup
-from db_helpers import push_records_to_db, get_unique_set
+from db_helpers import push_records_to_db, db_session
+from page_id_set import get_page_id_set
+from scrape_status import enqueue_pages
 
-def scrape_featured_article_list():
+def scrape_featured_article_list(page_id_set_path = None):
 	"""
 	Scrapes all page names from wikipedias featured pages list
+
+	Parameters
+	----------
+	page_id_set_path: str, path of a saved page id set to load instead of reading the pages table
 	"""
 
 	# get page ids that have already been scraped
-	all_page_ids = get_unique_set("pages", "id")
+	all_page_ids = get_page_id_set(page_id_set_path)
 
 	# get the article section soup of the page
 	url = "https://en.wikipedia.org/wiki/Wikipedia:Featured_articles"
@@ -28,8 +34,16 @@ def scrape_featured_article_list():
 			"language":"english"}
 			pages_db_data.append(page_data)
 
-	push_records_to_db("pages", pages_db_data)
+	# add pages and queue them for scraping in one transaction
+	with db_session() as connection:
+		push_records_to_db("pages", pages_db_data, connection = connection, ignore = True)
+		enqueue_pages([page_data["id"] for page_data in pages_db_data], connection = connection)
 
 if __name__ == "__main__":
-	scrape_featured_article_list()
+	parser = argparse.ArgumentParser()
+	parser.add_argument('-i', '--page_id_set_path', nargs = '?', type = str, default = None)
+	args = parser.parse_args()
+	params = {"page_id_set_path":args.page_id_set_path}
+
+	scrape_featured_article_list(**params)
 	 
\ No newline at end of file
@@ -1,186 +1,564 @@
-import requests, argparse, re
-from bs4 import BeautifulSoup
-from db_helpers import push_records_to_db, get_list_from_custom_query
+import requests, argparse, asyncio
+from functools import partial
+from citation_extractors import get_citation_extractor
+from link_processing import process_link
+from db_helpers import push_records_to_db, db_session
+from link_counts import count_page_citations, apply_citation_changes
+from scrape_status import mark_pages, get_pages_by_status, iterate_page_batches, reset_pages, register_scraper
+from html_cache import get_html_cache
+from page_archive import ArchiveWriter, read_index, iterate_segment_pages
 from multiprocessing import Pool
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-def extract_archive_site(link_raw):
+try:
+	import aiohttp # optional, only needed for the async and fetch modes
+except ImportError:
+	aiohttp = None
+
+def process_citations_html(page_text, extractor = "stream"):
 	"""
-	Extracts base url from those sites that have been archived
+	Takes raw html of a wikipedia page and returns list of citations
 
 	Parameters
 	----------
-	link_raw: str, link directly from wikipedia citation
+	page_text: str, raw html of wiki page from which to scrape citations
+	extractor: str, name of citation extractor backend, one of 'bs4', 'stream' or 'lxml'
 
 	Returns
 	-------
-	link: str, non-archive-site link
+	citation_data: [(str, [str,...]),..], each item in the list has the text of a citation and all the links in that citation
 	"""
-	if "//web.archive.org" in link_raw or "//archive.is" in link_raw or "//www.webcitation.org" in link_raw:
-		link_index = link_raw.find("http", 5)
-	else:
-		link_index = 0
+	extract_citations = get_citation_extractor(extractor)
+	citation_data = extract_citations(page_text)
+	return citation_data
+
+def generate_page_url(page_id):
+	"""
+	Creates url of wikipedia page from its id
+
+	Parameters
+	----------
+	page_id: str, name of wikipedia page to add to base url
 
-	link = link_raw[link_index:]
-	return link
+	Returns
+	-------
+	url: str, url of wikipedia page
+	"""
+	url = f"https://en.wikipedia.org/wiki/{page_id}"
+	return url
 
-def standardize_wiki_url(processed_link):
+def generate_citation_records(page_id, page_text, extractor = "stream"):
 	"""
-	Standardizes the url for wikipedia for a post-processed link
+	Extracts citation records for the db from the raw html of a wikipedia page
 
 	Parameters
 	----------
-	processed_link: str, wiki link that has been processed by the extract_base_url function
+	page_id: str, name of wikipedia page
+	page_text: str, raw html of wikipedia page
+	extractor: str, name of citation extractor backend
 
 	Returns
 	-------
-	standardized_link: str, link that has been standardized
+	citation_db_data: dict array, array of dicts with keys as citations column names
 	"""
-	if processed_link == "wiki" or processed_link == "w":
-		standardized_link = "www.wikipedia.org"
-	else:
-		standardized_link = processed_link
+	citation_data = process_citations_html(page_text, extractor)
+	citation_db_data = format_citation_records(page_id, citation_data)
 
-	return standardized_link
+	return citation_db_data
 
-def extract_base_url(link_raw):
+def format_citation_records(page_id, citation_data):
 	"""
-	Processes links from wikipedia citations to get base urls
+	Creates citation records for the db, one per link in each citation
 
 	Parameters
 	----------
-	link_raw: str, link directly from wikipedia citation
+	page_id: str, name of wikipedia page
+	citation_data: [(str, [str,...]),..], each item in the list has the text of a citation and all the links in that citation
 
 	Returns
 	-------
-	processed_link: str, base url (basically only the subdomain and domain)
+	citation_db_data: dict array, array of dicts with keys as citations column names
 	"""
-	try:
-		processed_link = re.search('^((http[s]?|ftp):\/)?\/?\/?([^\/\s]+)', link_raw).group(3)
-	except AttributeError:
-		processed_link = ""
 
-	return processed_link
+	# loop through each link in each citation and create a db record
+	citation_db_data = []
+	for citation_num, citation in enumerate(citation_data):
+		citation_text, links = citation
+		for link in links:
+			processed_link = process_link(link)
+			link_data = {"page_id":page_id, "citation_num":citation_num, 
+			"citation_text":citation_text, "link":link, "processed_link":processed_link}
+			citation_db_data.append(link_data)
+
+	return citation_db_data
+
+def store_page_citations(page_id, citation_db_data):
+	"""
+	Replaces citation records of a page in the database and marks the page as scraped in the same transaction
+
+	Parameters
+	----------
+	page_id: str, name of wikipedia page
+	citation_db_data: dict array, array of dicts with keys as citations column names
+	"""
+	store_pages_citations([(page_id, citation_db_data)])
 
-def process_link(link_raw):
+def store_pages_citations(pages_citations, connection = None, load_threshold = None):
 	"""
-	Processes citation link from wikipedia through various steps
+	Replaces citation records of many pages in the database, updates link counts by the difference
+	and marks the pages as scraped in the same transaction
 
 	Parameters
 	----------
-	link_raw: str, link directly from wikipedia citation
+	pages_citations: array, tuples of page id and its citation records
+	connection: mysql.connector object, connection of an existing session
+	load_threshold: int, number of citation records from which they are bulk loaded, None to always use inserts
+	"""
+	if not pages_citations:
+		return
+
+	page_ids = [page_id for page_id, _ in pages_citations]
+	citation_db_data = [record for _, citation_records in pages_citations for record in citation_records]
+
+	with db_session(connection) as connection:
+
+		old_citation_counts = count_page_citations(page_ids, connection)
+
+		# clear citations from any earlier scrape so re-scraping a page never duplicates them
+		placeholder = ", ".join(["%s"] * len(page_ids))
+		cursor = connection.cursor()
+		cursor.execute(f"DELETE FROM citations WHERE page_id IN ({placeholder})", page_ids)
+		cursor.close()
+
+		push_records_to_db("citations", citation_db_data, connection = connection, load_threshold = load_threshold)
+		apply_citation_changes(old_citation_counts, citation_db_data, connection)
+		mark_pages(page_ids, "done", connection = connection)
+
+def fetch_page_html(page_id, cache = None):
+	"""
+	Downloads raw html of a wikipedia page, answering from the cache when the server reports it unchanged
+
+	Parameters
+	----------
+	page_id: str, name of wikipedia page to add to base url
+	cache: HtmlCache, cache of page html, None to always download
 
 	Returns
 	-------
-	standardized_link: str
+	page_text: str, raw html of wikipedia page
 	"""
-	non_archive_link = extract_archive_site(link_raw)
-	processed_link = extract_base_url(non_archive_link)
-	standardized_link = standardize_wiki_url(processed_link)
-	return standardized_link
+	url = generate_page_url(page_id)
+	headers = cache.conditional_headers(page_id) if cache else {}
+	page_html = requests.get(url, headers = headers)
 
-def process_citation_item(citation):
+	if page_html.status_code == 304:
+		page_text = cache.load(page_id)
+		if page_text is not None:
+			return page_text
+
+		# the cached html went missing after its validators were read, so download the page in full
+		page_html = requests.get(url)
+
+	page_html.raise_for_status()
+	if cache:
+		cache.store(page_id, page_html.text, page_html.headers)
+
+	return page_html.text
+
+def scrape_page(page_id, extractor = "stream", cache_dir = None):
 	"""
-	Extracts links and text from individual wikipedia citation item
+	Scrapes wikipedia page for citations and adds to database, marking the page as failed if anything goes wrong
 
 	Parameters
 	----------
-	citation: BeautifulSoup object, one of the li items in wikipedia citation section
+	page_id: str, name of wikipedia page to add to base url
+	extractor: str, name of citation extractor backend
+	cache_dir: str, directory of the html cache, None to scrape without one
+	"""
+
+	# get and process wiki page html
+	try:
+		page_text = fetch_page_html(page_id, get_html_cache(cache_dir))
+		citation_db_data = generate_citation_records(page_id, page_text, extractor)
+
+		store_page_citations(page_id, citation_db_data)
+	except Exception as err:
+		print(f"Failed to scrape {page_id}: {err!r}")
+		mark_pages([page_id], "failed")
+
+def reparse_page(page_id, extractor = "stream", cache_dir = None):
+	"""
+	Replaces citations of a page with those parsed from its cached html, without touching the network
+
+	Parameters
+	----------
+	page_id: str, name of wikipedia page
+	extractor: str, name of citation extractor backend
+	cache_dir: str, directory of the html cache
+	"""
+	page_text = get_html_cache(cache_dir).load(page_id)
+	if page_text is None:
+		print(f"Skipping {page_id}, its html is no longer cached")
+		return
+
+	try:
+		citation_db_data = generate_citation_records(page_id, page_text, extractor)
+		store_page_citations(page_id, citation_db_data)
+	except Exception as err:
+		print(f"Failed to reparse {page_id}: {err!r}")
+
+def reparse_cached_pages(cache_dir, processes = 1, extractor = "stream"):
+	"""
+	Re-runs citation parsing over every page in the html cache
+
+	Parameters
+	----------
+	cache_dir: str, directory of the html cache
+	processes: int, number of processes used to parse pages
+	extractor: str, name of citation extractor backend
+	"""
+	page_ids = get_html_cache(cache_dir).iterate_page_ids()
+	print(f"Reparsing {len(page_ids)} cached pages...")
+
+	pool = Pool(processes)
+	pool.map(partial(reparse_page, extractor = extractor, cache_dir = cache_dir), page_ids)
+
+def create_client_session(concurrency, timeout):
+	"""
+	Opens an aiohttp session with a keep-alive connection pool
+
+	Parameters
+	----------
+	concurrency: int, max number of connections in the pool
+	timeout: int, seconds before a single page request is abandoned
 
 	Returns
 	-------
-	citation_text: str, text of citation
-	links: str array, array of links in citation
+	session: aiohttp ClientSession, session holding the pooled connections
+	"""
+	if aiohttp is None:
+		raise ImportError("aiohttp is required for the async and fetch modes")
+
+	connector = aiohttp.TCPConnector(limit = concurrency)
+	client_timeout = aiohttp.ClientTimeout(total = timeout)
+	session = aiohttp.ClientSession(connector = connector, timeout = client_timeout)
+	return session
+
+async def download_page(session, url, headers = None):
 	"""
+	Requests a page over a shared keep-alive session
 
-	links = [link["href"] for link in citation.find_all("a") if link.has_attr("href")]
-	citation_text = citation.text
+	Parameters
+	----------
+	session: aiohttp ClientSession, session holding the pooled connections
+	url: str, url of the page
+	headers: dict, request headers, such as the conditional headers of a cached copy
+
+	Returns
+	-------
+	page_text: str, raw html of the page, None if the server reports it unchanged
+	response_headers: dict, headers of the response
+	"""
+	async with session.get(url, headers = headers) as response:
+		if response.status == 304:
+			return None, response.headers
 
-	return citation_text, links
+		response.raise_for_status()
+		page_text = await response.text()
 
+	return page_text, response.headers
 
-def process_citations_html(page):
+async def fetch_page(session, page_id, cache = None, executor = None):
 	"""
-	Takes raw html of a wikipedia page and returns list of citations
+	Downloads raw html of a wikipedia page over a shared keep-alive session, answering from the cache
+	when the server reports it unchanged
 
 	Parameters
 	----------
-	page: html, wiki page from which to scrape citations
+	session: aiohttp ClientSession, session holding the pooled connections
+	page_id: str, name of wikipedia page to add to base url
+	cache: HtmlCache, cache of page html, None to always download
+	executor: ThreadPoolExecutor, pool that runs blocking cache reads and writes
 
 	Returns
 	-------
-	citation_data: [(str, [str,...]),..], each item in the list has the text of a citation and all the links in that citation
+	page_text: str, raw html of wikipedia page
 	"""
+	loop = asyncio.get_event_loop()
+	url = generate_page_url(page_id)
+	headers = await loop.run_in_executor(executor, cache.conditional_headers, page_id) if cache else {}
 
-	# extract citation items from html of page
-	soup = BeautifulSoup(page.text, "html.parser")
-	citation_section = soup.find("ol", class_="references")
-	citation_section = soup.find("div", class_="references-column-count") if citation_section is None else citation_section
-	citation_section = soup.find("div", class_="references-column-width") if citation_section is None else citation_section
-	
-	if citation_section is None:
-		citations = soup.find_all("cite")
-	else:
-		citations = citation_section.find_all("li")
-	
-	# loop through each citation item, extract relevant info, add to data list
-	citation_data = []
-	for citation in citations:
-
-		citation_text, links = process_citation_item(citation)
-		citation_data.append((citation_text, links))
-		
-	return citation_data
+	page_text, response_headers = await download_page(session, url, headers)
+	if page_text is None:
+		page_text = await loop.run_in_executor(executor, cache.load, page_id)
+		if page_text is not None:
+			return page_text
+
+		# the cached html went missing after its validators were read, so download the page in full
+		page_text, response_headers = await download_page(session, url)
+
+	if cache:
+		await loop.run_in_executor(executor, cache.store, page_id, page_text, response_headers)
 
-def scrape_page(page_id):
+	return page_text
+
+async def scrape_page_worker(session, page_queue, parse_executor, db_executor, extractor = "stream", cache = None):
 	"""
-	Scrapes wikipedia page for citations and adds to database
+	Pulls page ids off the queue until it is exhausted, fetching each page and handing
+	parsing and db insertion to their executors
 
 	Parameters
 	----------
-	page_id: str, name of wikipedia page to add to base url
+	session: aiohttp ClientSession, session holding the pooled connections
+	page_queue: asyncio Queue, page ids to scrape, terminated by None
+	parse_executor: ProcessPoolExecutor, pool that parses page html
+	db_executor: ThreadPoolExecutor, pool that runs db queries
+	extractor: str, name of citation extractor backend
+	cache: HtmlCache, cache of page html, None to scrape without one
 	"""
+	loop = asyncio.get_event_loop()
+
+	while True:
+		page_id = await page_queue.get()
+		if page_id is None:
+			break
+
+		try:
+			page_text = await fetch_page(session, page_id, cache, db_executor)
+			citation_db_data = await loop.run_in_executor(parse_executor, generate_citation_records, page_id, page_text, extractor)
+			await loop.run_in_executor(db_executor, store_page_citations, page_id, citation_db_data)
+		except Exception as err:
+			print(f"Failed to scrape {page_id}: {err!r}")
+			await loop.run_in_executor(db_executor, mark_pages, [page_id], "failed")
+
+async def queue_pages(page_queue, page_batches, num_workers, db_executor):
+	"""
+	Feeds batches of page ids into the bounded queue, followed by one stop signal per worker
 
-	# get and process wiki page html
-	url = f"https://en.wikipedia.org/wiki/{page_id}"
-	page_html = requests.get(url)
-	citation_data = process_citations_html(page_html)
+	Parameters
+	----------
+	page_queue: asyncio Queue, page ids to scrape
+	page_batches: iterator, yields arrays of page ids to scrape
+	num_workers: int, number of workers consuming the queue
+	db_executor: ThreadPoolExecutor, pool that runs db queries, used to claim the next batch
+	"""
+	loop = asyncio.get_event_loop()
 
-	# loop through each link in each citation and add to db
-	citation_db_data = []
-	for citation_num, citation in enumerate(citation_data):
-		citation_text, links = citation
-		for link in links:
-			processed_link = process_link(link)
-			link_data = {"page_id":page_id, "citation_num":citation_num, 
-			"citation_text":citation_text, "link":link, "processed_link":processed_link}
-			citation_db_data.append(link_data)
+	while True:
+		page_ids = await loop.run_in_executor(db_executor, next, page_batches, [])
+		if not page_ids:
+			break
+
+		for page_id in page_ids:
+			await page_queue.put(page_id)
 
-	push_records_to_db("citations", citation_db_data)
+	for _ in range(num_workers):
+		await page_queue.put(None)
 
-def scrape_all_pages(processes = 1):
+async def scrape_pages_async(page_batches, concurrency = 100, processes = 1, extractor = "stream", cache_dir = None, timeout = 60):
 	"""
-	Scrapes all outstanding pages
+	Scrapes pages with a bounded number of concurrent requests on a keep-alive connection pool
+
+	Parameters
+	----------
+	page_batches: iterator, yields arrays of page ids to scrape
+	concurrency: int, max number of requests in flight
+	processes: int, number of processes used to parse page html
+	extractor: str, name of citation extractor backend
+	cache_dir: str, directory of the html cache, None to scrape without one
+	timeout: int, seconds before a single page request is abandoned
+	"""
+	page_queue = asyncio.Queue(maxsize = concurrency * 2)
+
+	with ProcessPoolExecutor(processes) as parse_executor, ThreadPoolExecutor(processes) as db_executor:
+		async with create_client_session(concurrency, timeout) as session:
+			cache = get_html_cache(cache_dir)
+			workers = [scrape_page_worker(session, page_queue, parse_executor, db_executor, extractor, cache) for _ in range(concurrency)]
+			await asyncio.gather(queue_pages(page_queue, page_batches, concurrency, db_executor), *workers)
+
+async def archive_page_worker(session, page_queue, db_executor, writer):
 	"""
+	Pulls page ids off the queue until it is exhausted, appending each fetched page to the archive
 
-	pages_to_scrape = get_list_from_custom_query("SELECT id FROM pages WHERE id NOT IN (SELECT page_id FROM citations)", 0)
-	print(f"Scraping {len(pages_to_scrape)} pages...")
+	Parameters
+	----------
+	session: aiohttp ClientSession, session holding the pooled connections
+	page_queue: asyncio Queue, page ids to fetch, terminated by None
+	db_executor: ThreadPoolExecutor, pool that runs db queries and archive writes
+	writer: ArchiveWriter, writer of the page archive
+	"""
+	loop = asyncio.get_event_loop()
+
+	while True:
+		page_id = await page_queue.get()
+		if page_id is None:
+			break
+
+		try:
+			url = generate_page_url(page_id)
+			async with session.get(url) as response:
+				response.raise_for_status()
+				page_bytes = await response.read()
+
+			await loop.run_in_executor(db_executor, writer.append, page_id, url, page_bytes)
+			await loop.run_in_executor(db_executor, mark_pages, [page_id], "fetched")
+		except Exception as err:
+			print(f"Failed to fetch {page_id}: {err!r}")
+			await loop.run_in_executor(db_executor, mark_pages, [page_id], "failed")
+
+async def fetch_pages_to_archive(page_batches, archive_dir, concurrency = 100, processes = 1, timeout = 60):
+	"""
+	Fetch stage of the two stage scrape, downloads pages into the archive without parsing them
+
+	Parameters
+	----------
+	page_batches: iterator, yields arrays of page ids to fetch
+	archive_dir: str, directory of the page archive
+	concurrency: int, max number of requests in flight
+	processes: int, number of threads used for db queries and archive writes
+	timeout: int, seconds before a single page request is abandoned
+	"""
+	page_queue = asyncio.Queue(maxsize = concurrency * 2)
+	writer = ArchiveWriter(archive_dir)
+
+	# release the segment and index files even when the fetch fails
+	try:
+		with ThreadPoolExecutor(processes) as db_executor:
+			async with create_client_session(concurrency, timeout) as session:
+				workers = [archive_page_worker(session, page_queue, db_executor, writer) for _ in range(concurrency)]
+				await asyncio.gather(queue_pages(page_queue, page_batches, concurrency, db_executor), *workers)
+	finally:
+		writer.close()
+
+def parse_archived_chunk(chunk, extractor = "stream"):
+	"""
+	Parses a chunk of records from one archive segment, setting aside pages that fail to read or parse
+
+	Parameters
+	----------
+	chunk: tuple, segment path and array of (page_id, offset, length) tuples
+	extractor: str, name of citation extractor backend
+
+	Returns
+	-------
+	pages_citations: array, tuples of page id and its citation records
+	failed_page_ids: str array, ids of pages that could not be parsed
+	"""
+	segment_path, entries = chunk
+	pages_citations, failed_page_ids = [], []
+
+	try:
+		for page_id, page_text in iterate_segment_pages(segment_path, entries):
+			try:
+				pages_citations.append((page_id, generate_citation_records(page_id, page_text, extractor)))
+			except Exception as err:
+				print(f"Failed to parse {page_id}: {err!r}")
+				failed_page_ids.append(page_id)
+	except Exception as err:
+		# a damaged record ends the read, the pages after it in the chunk are lost with it
+		print(f"Failed to read {segment_path}: {err!r}")
+		read_page_ids = {page_id for page_id, _ in pages_citations}.union(failed_page_ids)
+		failed_page_ids += [page_id for page_id, _, _ in entries if page_id not in read_page_ids]
+
+	return pages_citations, failed_page_ids
+
+def parse_archived_pages(archive_dir, processes = 1, extractor = "stream", chunk_size = 100):
+	"""
+	Parse stage of the two stage scrape, fans archived pages that are still waiting to be parsed out to a process pool,
+	stores their citations and marks the pages that could not be parsed as failed
+
+	Parameters
+	----------
+	archive_dir: str, directory of the page archive
+	processes: int, number of processes used to parse pages
+	extractor: str, name of citation extractor backend
+	chunk_size: int, number of pages parsed per task
+	"""
+	# pages already parsed, or requeued since they were fetched, keep their status
+	fetched_page_ids = get_pages_by_status("fetched")
+	segment_entries = {segment_path:[entry for entry in entries if entry[0] in fetched_page_ids] 
+		for segment_path, entries in read_index(archive_dir).items()}
+	chunks = [(segment_path, entries[i:i + chunk_size]) for segment_path, entries in segment_entries.items() 
+		for i in range(0, len(entries), chunk_size)]
+	print(f"Parsing {sum(len(entries) for entries in segment_entries.values())} archived pages...")
 
 	pool = Pool(processes)
-	pool.map(scrape_page, pages_to_scrape)
+	for count, (pages_citations, failed_page_ids) in enumerate(pool.imap_unordered(partial(parse_archived_chunk, extractor = extractor), chunks)):
+		with db_session() as connection:
+			store_pages_citations(pages_citations, connection)
+			mark_pages(failed_page_ids, "failed", connection = connection)
 
-if __name__ == "__main__":
-	parser = argparse.ArgumentParser()
-	parser.add_argument('-p', '--processes', nargs = '?', type = int, default = 1)
+		if count % 100 == 0:
+			print(f"{count + 1} out of {len(chunks)} chunks complete...")
 
-	args = parser.parse_args()
-	params = {}
-	params["processes"] = args.processes
+def scrape_all_pages(processes = 1, mode = "pool", concurrency = 100, extractor = "stream", batch_size = 1000, retry_failed = False, 
+	cache_dir = None, archive_dir = None):
+	"""
+	Scrapes all outstanding pages, claiming them from the scrape queue in batches
 
-	scrape_all_pages(**params)
+	Parameters
+	----------
+	processes: int, number of processes used to scrape (pool mode) or parse (async mode) pages
+	mode: str, 'pool' to scrape with a process pool, 'async' to scrape with an asyncio event loop, 
+		'reparse' to reparse every page in the html cache, 'fetch' and 'parse' to run either stage of a scrape through the page archive
+	concurrency: int, max number of requests in flight in async mode
+	extractor: str, name of citation extractor backend
+	batch_size: int, number of pages claimed from the queue at a time
+	retry_failed: bool, requeue pages that failed in previous runs
+	cache_dir: str, directory of the html cache, None to scrape without one
+	archive_dir: str, directory of the page archive used by the fetch and parse modes
+	"""
 
+	if mode in ("fetch", "parse") and archive_dir is None:
+		raise ValueError(f"{mode} mode needs an archive directory")
 
+	if mode == "reparse":
+		reparse_cached_pages(cache_dir, processes, extractor)
+		return
 
+	if mode == "parse":
+		parse_archived_pages(archive_dir, processes, extractor)
+		return
 
+	register_scraper()
+	reset_pages(retry_failed = retry_failed)
+	page_batches = iterate_page_batches(batch_size)
 
+	if mode == "fetch":
+		asyncio.run(fetch_pages_to_archive(page_batches, archive_dir, concurrency, processes))
+	elif mode == "async":
+		asyncio.run(scrape_pages_async(page_batches, concurrency, processes, extractor, cache_dir))
+	else:
+		pool = Pool(processes)
+		for count, page_ids in enumerate(page_batches):
+			pool.map(partial(scrape_page, extractor = extractor, cache_dir = cache_dir), page_ids)
+			print(f"{count + 1} batches of {batch_size} pages complete...")
 
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument('-p', '--processes', nargs = '?', type = int, default = 1)
+	parser.add_argument('-m', '--mode', nargs = '?', type = str, default = 'pool', choices = ['pool', 'async', 'reparse', 'fetch', 'parse'])
+	parser.add_argument('-c', '--concurrency', nargs = '?', type = int, default = 100)
+	parser.add_argument('-e', '--extractor', nargs = '?', type = str, default = 'stream', choices = ['bs4', 'stream', 'lxml'])
+	parser.add_argument('-b', '--batch_size', nargs = '?', type = int, default = 1000)
+	parser.add_argument('-r', '--retry_failed', action = 'store_true')
+	parser.add_argument('-d', '--cache_dir', nargs = '?', type = str, default = None)
+	parser.add_argument('-a', '--archive_dir', nargs = '?', type = str, default = None)
 
+	args = parser.parse_args()
+	if args.mode == "reparse" and args.cache_dir is None:
+		parser.error("--mode reparse needs --cache_dir")
+	if args.mode in ("fetch", "parse") and args.archive_dir is None:
+		parser.error(f"--mode {args.mode} needs --archive_dir")
+
+	params = {}
+	params["processes"] = args.processes
+	params["mode"] = args.mode
+	params["concurrency"] = args.concurrency
+	params["extractor"] = args.extractor
+	params["batch_size"] = args.batch_size
+	params["retry_failed"] = args.retry_failed
+	params["cache_dir"] = args.cache_dir
+	params["archive_dir"] = args.archive_dir
+
+	scrape_all_pages(**params)
\ No newline at end of file
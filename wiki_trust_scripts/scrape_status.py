@@ -0,0 +1,210 @@
+import argparse
+from db_helpers import db_session, execute_db_queries, get_db_connection
+
+# running scrapers each hold one of these named locks, and the pages they claim record the lock and its connection
+SCRAPER_LOCK_PREFIX = "wiki_trust_scraper_"
+MAX_SCRAPERS = 64
+
+# unpooled connection holding this process's scraper lock, the lock goes when the connection does
+SCRAPER_REGISTRATION = {"connection":None, "lock_name":None, "connection_id":None}
+
+def enqueue_pages(page_ids, connection = None):
+	"""
+	Adds pages to the scrape queue as pending, leaving pages already in the queue untouched
+
+	Parameters
+	----------
+	page_ids: str array, ids of pages to scrape
+	connection: mysql.connector object, connection of an existing session
+	"""
+	query = "INSERT IGNORE INTO scrape_status (page_id) VALUES (%s)"
+
+	with db_session(connection) as connection:
+		cursor = connection.cursor()
+		cursor.executemany(query, [(page_id,) for page_id in page_ids])
+		cursor.close()
+
+def mark_pages(page_ids, status, connection = None):
+	"""
+	Sets the scrape status of pages
+
+	Parameters
+	----------
+	page_ids: str array, ids of pages to update
+	status: str, one of 'pending', 'in_progress', 'fetched', 'done' or 'failed'
+	connection: mysql.connector object, connection of an existing session
+	"""
+	if not page_ids:
+		return
+
+	placeholder = ", ".join(["%s"] * len(page_ids))
+	query = f"UPDATE scrape_status SET status = %s WHERE page_id IN ({placeholder})"
+
+	with db_session(connection) as connection:
+		cursor = connection.cursor()
+		cursor.execute(query, [status] + list(page_ids))
+		cursor.close()
+
+def get_pages_by_status(status, connection = None):
+	"""
+	Gets the pages in the scrape queue with a given status
+
+	Parameters
+	----------
+	status: str, one of 'pending', 'in_progress', 'fetched', 'done' or 'failed'
+	connection: mysql.connector object, connection of an existing session
+
+	Returns
+	-------
+	page_ids: set, ids of the pages with the status
+	"""
+	query = "SELECT page_id FROM scrape_status WHERE status = %s"
+
+	with db_session(connection) as connection:
+		cursor = connection.cursor()
+		cursor.execute(query, (status,))
+		page_ids = {item[0] for item in cursor}
+		cursor.close()
+
+	return page_ids
+
+def claim_pages(batch_size = 1000):
+	"""
+	Claims a batch of pending pages for this scraper by moving them to in progress, skipping rows claimed by other scrapers
+
+	Parameters
+	----------
+	batch_size: int, max number of pages to claim
+
+	Returns
+	-------
+	page_ids: str array, ids of claimed pages, empty when there is no work left
+	"""
+	claim_query = """
+	SELECT page_id FROM scrape_status
+	WHERE status = 'pending'
+	ORDER BY page_id
+	LIMIT %s
+	FOR UPDATE SKIP LOCKED
+	"""
+
+	with db_session() as connection:
+		cursor = connection.cursor()
+		cursor.execute(claim_query, (batch_size,))
+		page_ids = [item[0] for item in cursor]
+
+		if page_ids:
+			placeholder = ", ".join(["%s"] * len(page_ids))
+			update_query = f"""
+			UPDATE scrape_status
+			SET status = 'in_progress', attempts = attempts + 1, owner = %s, owner_connection = %s
+			WHERE page_id IN ({placeholder})
+			"""
+			cursor.execute(update_query, [SCRAPER_REGISTRATION["lock_name"], SCRAPER_REGISTRATION["connection_id"]] + page_ids)
+
+		cursor.close()
+
+	return page_ids
+
+def iterate_page_batches(batch_size = 1000):
+	"""
+	Claims batches of pending pages until none are left
+
+	Parameters
+	----------
+	batch_size: int, max number of pages per batch
+
+	Returns
+	-------
+	page_batches: generator, yields arrays of claimed page ids
+	"""
+	while True:
+
+		# keep the scraper lock's idle connection from timing out
+		if SCRAPER_REGISTRATION["connection"] is not None:
+			SCRAPER_REGISTRATION["connection"].ping()
+
+		page_ids = claim_pages(batch_size)
+		if not page_ids:
+			break
+		yield page_ids
+
+def register_scraper(max_scrapers = MAX_SCRAPERS):
+	"""
+	Marks this process as a running scraper by taking a free scraper lock on a connection kept open until
+	the process exits. A scraper that crashes loses its connection, and with it the lock
+
+	Parameters
+	----------
+	max_scrapers: int, number of scraper lock slots
+	"""
+	if SCRAPER_REGISTRATION["connection"] is not None:
+		return
+
+	connection = get_db_connection()
+	cursor = connection.cursor()
+	for slot in range(max_scrapers):
+		lock_name = f"{SCRAPER_LOCK_PREFIX}{slot}"
+		cursor.execute("SELECT GET_LOCK(%s, 0), CONNECTION_ID()", (lock_name,))
+		locked, connection_id = cursor.fetchone()
+		if locked == 1:
+			break
+	else:
+		connection.close()
+		raise RuntimeError(f"All {max_scrapers} scraper slots are taken")
+	cursor.close()
+
+	SCRAPER_REGISTRATION.update(connection = connection, lock_name = lock_name, connection_id = connection_id)
+
+def reset_pages(retry_failed = False, max_attempts = 3):
+	"""
+	Puts pages abandoned in progress, and optionally failed pages, back in the queue. An in progress page is abandoned
+	when the scraper that claimed it no longer holds its lock, which a restarted scraper may since have taken in its place
+
+	Parameters
+	----------
+	retry_failed: bool, also requeue failed pages
+	max_attempts: int, failed pages that have been attempted this many times stay failed
+	"""
+	queries = ["""
+	UPDATE scrape_status
+	SET status = 'pending'
+	WHERE status = 'in_progress'
+		AND (owner IS NULL OR IS_USED_LOCK(owner) IS NULL OR IS_USED_LOCK(owner) <> owner_connection)
+	"""]
+
+	if retry_failed:
+		queries.append(f"""
+		UPDATE scrape_status
+		SET status = 'pending'
+		WHERE status = 'failed' AND attempts < {int(max_attempts)}
+		""")
+
+	execute_db_queries(queries)
+
+def seed_scrape_status():
+	"""
+	Fills the scrape queue from the pages table, marking pages that already have citations as done
+	"""
+	print("Seeding scrape status...")
+
+	done_query = """
+	INSERT IGNORE INTO scrape_status (page_id, status)
+	SELECT DISTINCT page_id, 'done' FROM citations
+	"""
+
+	pending_query = """
+	INSERT IGNORE INTO scrape_status (page_id)
+	SELECT id FROM pages
+	"""
+
+	execute_db_queries([done_query, pending_query])
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument('-r', '--retry_failed', action = 'store_true')
+	parser.add_argument('-m', '--max_attempts', nargs = '?', type = int, default = 3)
+	args = parser.parse_args()
+
+	seed_scrape_status()
+	reset_pages(retry_failed = args.retry_failed, max_attempts = args.max_attempts)
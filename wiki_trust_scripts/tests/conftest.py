@@ -0,0 +1,4 @@
+import os, sys
+
+# the scripts import each other by module name, as when run from their own folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
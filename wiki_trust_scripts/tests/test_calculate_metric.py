@@ -0,0 +1,72 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+pytest.importorskip("mysql.connector")
+from calculate_metric import fit_residuals, get_rank, get_extremes
+
+def fit_lstsq(X, y):
+	design = np.column_stack([X, np.ones(len(X))])
+	coefficients = np.linalg.lstsq(design, y, rcond = None)[0]
+	return design.dot(coefficients) - y
+
+def generate_counts(size = 200, seed = 0):
+	rng = np.random.RandomState(seed)
+	X = rng.randint(0, 1000, size).astype(float)
+	y = np.round(X * rng.uniform(0.5, 2, size) + rng.randint(0, 50, size))
+
+	# zero counts have no log, so some values drop out of the log fits
+	X[::17] = 0
+	y[::23] = 0
+	return X, y
+
+def test_residuals_match_lstsq():
+	X, y = generate_counts()
+	transforms = [(True, True), (False, False), (True, False)]
+	residuals = fit_residuals(X, y, transforms, reversal = False)
+
+	for column, (log_X, log_y) in enumerate(transforms):
+		with np.errstate(divide = "ignore"):
+			X_train = np.log(X) if log_X else X
+			y_train = np.log(y) if log_y else y
+		valid = np.isfinite(X_train) & np.isfinite(y_train)
+
+		np.testing.assert_allclose(residuals[valid, column], fit_lstsq(X_train[valid], y_train[valid]), atol = 1e-8)
+		assert np.isnan(residuals[~valid, column]).all()
+
+def test_grouped_residuals_match_lstsq_per_group():
+	X, y = generate_counts()
+	groups = np.array(["en", "de", "fr", "en"] * 50, dtype = object)
+	residuals = fit_residuals(X, y, groups = groups)[:, 0]
+
+	with np.errstate(divide = "ignore"):
+		X_train, y_train = np.log(X), np.log(y)
+	valid = np.isfinite(X_train) & np.isfinite(y_train)
+
+	for group in ["en", "de", "fr"]:
+		in_group = valid & (groups == group)
+		np.testing.assert_allclose(residuals[in_group], -fit_lstsq(X_train[in_group], y_train[in_group]), atol = 1e-8)
+	assert np.isnan(residuals[~valid]).all()
+
+def test_rank_order_and_missing_values():
+	df = pd.DataFrame({"domain":["a", "b", "c", "d", "e"], "score":[3.0, np.nan, 5.0, 3.0, 1.0]})
+	ranked = get_rank(df, ["score"], [False], rank_types = ("ordinal", "dense", "percentile"))
+
+	assert ranked["score_ordinal_rank"].tolist() == [1, 4, 0, 2, 3]
+	assert ranked["score_dense_rank"].tolist() == [1, 3, 0, 1, 2]
+	assert ranked["score_percentile_rank"].tolist() == [0.5, 1.0, 0.2, 0.5, 0.8]
+	assert ranked["domain"].tolist() == df["domain"].tolist()
+	assert "score_ordinal_rank" not in df
+
+def test_ascending_rank():
+	df = pd.DataFrame({"score":[3.0, np.nan, 5.0, 1.0]})
+	ranked = get_rank(df, ["score"], [True])
+
+	assert ranked["score_ordinal_rank"].tolist() == [1, 3, 2, 0]
+
+def test_extremes_skip_missing_values():
+	df = pd.DataFrame({"domain":list("abcdef"), "score":[3.0, np.nan, 5.0, 4.0, 1.0, 2.0]})
+	top, bottom = get_extremes(df, "score", 2)
+
+	assert top["domain"].tolist() == ["c", "d"]
+	assert bottom["domain"].tolist() == ["f", "e"]
@@ -0,0 +1,48 @@
+import os
+import pytest
+
+# the pages are synthetic, written by hand to follow the markup of current and older wikipedia articles
+# (reference lists, inline template styles, column wrappers, cite-only stubs), they are not saved copies of real articles
+
+pytest.importorskip("bs4")
+from citation_extractors import CITATION_EXTRACTORS, extract_citations_bs4
+
+PAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "synthetic_wiki_pages")
+PAGE_FILENAMES = sorted(filename for filename in os.listdir(PAGES_DIR) if filename.endswith(".html"))
+
+def read_page(filename):
+	with open(os.path.join(PAGES_DIR, filename), encoding = "utf-8") as page_file:
+		return page_file.read()
+
+@pytest.mark.parametrize("extractor", ["stream", "lxml"])
+@pytest.mark.parametrize("filename", PAGE_FILENAMES)
+def test_extractor_matches_bs4(extractor, filename):
+	if extractor not in CITATION_EXTRACTORS:
+		pytest.skip(f"{extractor} extractor is not available")
+
+	page_text = read_page(filename)
+	assert CITATION_EXTRACTORS[extractor](page_text) == extract_citations_bs4(page_text)
+
+# citation items with markup that the extractors have disagreed on
+SNIPPETS = [
+	'<ol class="references"><li>Cite <template><b>hidden</b></template> text <a href="http://a.org/">a</a></li></ol>',
+	'<ol class="references"><li>Cite <style>.x{color:red}</style><i>styled</i> <script>var s = "<b>";</script>text</li></ol>',
+	'<ol class="references"><li>A<template><template>deep</template><i>inner</i></template>B</li><li>C</li></ol>'
+]
+
+@pytest.mark.parametrize("extractor", ["stream", "lxml"])
+@pytest.mark.parametrize("snippet", SNIPPETS)
+def test_extractor_matches_bs4_on_non_text_tags(extractor, snippet):
+	if extractor not in CITATION_EXTRACTORS:
+		pytest.skip(f"{extractor} extractor is not available")
+
+	assert CITATION_EXTRACTORS[extractor](snippet) == extract_citations_bs4(snippet)
+
+def test_template_contents_are_not_text():
+	assert extract_citations_bs4(SNIPPETS[0]) == [("Cite  text a", ["http://a.org/"])]
+
+@pytest.mark.parametrize("filename", PAGE_FILENAMES)
+def test_pages_have_citations(filename):
+	citation_data = extract_citations_bs4(read_page(filename))
+	assert citation_data
+	assert any(links for _, links in citation_data)
@@ -0,0 +1,49 @@
+import pytest
+
+pytest.importorskip("bs4")
+pytest.importorskip("xmltodict")
+pytest.importorskip("requests")
+from awis.myawis import flatten_urlinfo
+
+URLINFO_TEMPLATE = """<?xml version="1.0"?>
+<aws:UrlInfoResponse xmlns:aws="http://alexa.amazonaws.com/doc/2005-10-05/">
+<aws:Response><aws:UrlInfoResult><aws:Alexa>
+<aws:ContentData><aws:DataUrl type="canonical">example.org/</aws:DataUrl><aws:LinksInCount>120</aws:LinksInCount></aws:ContentData>
+<aws:TrafficData>
+<aws:Rank>1500</aws:Rank>
+<aws:RankByCountry>{countries}</aws:RankByCountry>
+<aws:UsageStatistics>{statistics}</aws:UsageStatistics>
+</aws:TrafficData>
+</aws:Alexa></aws:UrlInfoResult></aws:Response>
+</aws:UrlInfoResponse>"""
+
+COUNTRY = '<aws:Country Code="{code}"><aws:Rank>{rank}</aws:Rank></aws:Country>'
+CODELESS_COUNTRY = '<aws:Country><aws:Rank>7</aws:Rank></aws:Country>'
+STATISTIC = '<aws:UsageStatistic><aws:TimeRange><aws:Months>{months}</aws:Months></aws:TimeRange><aws:Rank><aws:Value>{rank}</aws:Value></aws:Rank></aws:UsageStatistic>'
+RANGELESS_STATISTIC = '<aws:UsageStatistic><aws:Rank><aws:Value>9</aws:Value></aws:Rank></aws:UsageStatistic>'
+
+def flatten(countries, statistics):
+	urlinfo = URLINFO_TEMPLATE.format(countries = "".join(countries), statistics = "".join(statistics))
+	return flatten_urlinfo(urlinfo, shorter_keys = False, lowercase_keys = True)
+
+def test_flatten_keys_countries_and_statistics():
+	fields = flatten([COUNTRY.format(code = "US", rank = 900), COUNTRY.format(code = "GB", rank = 300)],
+		[STATISTIC.format(months = 3, rank = 1400), STATISTIC.format(months = 1, rank = 1600)])
+
+	assert fields["trafficdata.rank"] == "1500"
+	assert fields["trafficdata.rankbycountry.country.US.rank"] == "900"
+	assert fields["trafficdata.rankbycountry.country.GB.rank"] == "300"
+	assert fields["trafficdata.usagestatistics.usagestatistic.months.3.rank.value"] == "1400"
+	assert fields["trafficdata.usagestatistics.usagestatistic.months.1.rank.value"] == "1600"
+
+def test_flatten_leaves_out_unkeyed_entries():
+	fields = flatten([CODELESS_COUNTRY, COUNTRY.format(code = "US", rank = 900)],
+		[RANGELESS_STATISTIC, STATISTIC.format(months = 3, rank = 1400)])
+
+	assert [key for key in fields if key.startswith("trafficdata.rankbycountry.")] == ["trafficdata.rankbycountry.country.US.rank"]
+	assert [key for key in fields if key.startswith("trafficdata.usagestatistics.")] == [
+		"trafficdata.usagestatistics.usagestatistic.months.3.rank.value"]
+
+def test_flatten_rejects_documents_without_alexa_data():
+	with pytest.raises(ValueError):
+		flatten_urlinfo("<UrlInfoResponse><Response /></UrlInfoResponse>")
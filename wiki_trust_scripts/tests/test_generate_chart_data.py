@@ -0,0 +1,56 @@
+import random
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("scipy")
+pytest.importorskip("mysql.connector")
+from generate_chart_data import count_domain_pairs, iterate_whole_pages, accumulate_domain_pairs
+
+def count_pairs(rows):
+	page_ids, domains = zip(*rows)
+	return count_domain_pairs(np.array(page_ids, dtype = object), np.array(domains, dtype = object))
+
+def generate_rows(num_pages = 300, num_domains = 40, seed = 0):
+	rng = random.Random(seed)
+	rows = []
+	for page_num in range(num_pages):
+		for _ in range(rng.randint(1, 8)):
+			rows.append((f"page{page_num:04d}", f"domain{rng.randrange(num_domains)}.org"))
+	return rows
+
+def test_last_domain_of_a_page_is_counted():
+	domain_names, pair_counts = count_pairs([("Page", "a.org"), ("Page", "b.org"), ("Page", "c.org")])
+
+	assert list(domain_names) == ["a.org", "b.org", "c.org"]
+	assert pair_counts.toarray().tolist() == [[0, 1, 1], [0, 0, 1], [0, 0, 0]]
+
+def test_pages_count_once_per_pair():
+	rows = [("First", "a.org"), ("First", "b.org"), ("First", "b.org"), ("Second", "b.org"), ("Second", "a.org"), ("Third", "a.org")]
+	domain_names, pair_counts = count_pairs(rows)
+
+	assert list(domain_names) == ["a.org", "b.org"]
+	assert pair_counts.toarray().tolist() == [[0, 2], [0, 0]]
+
+def test_whole_pages_are_kept_together():
+	row_chunks = [
+		[("First", "a.org"), ("First", "b.org")],
+		[("First", "c.org")],
+		[("First", "d.org"), ("Second", "a.org")],
+		[("Second", "b.org"), ("Third", "c.org")],
+	]
+	chunks = list(iterate_whole_pages(row_chunks))
+
+	assert [sorted({page_id for page_id, _ in chunk}) for chunk in chunks] == [["First"], ["Second"], ["Third"]]
+	assert [row for chunk in chunks for row in chunk] == [row for rows in row_chunks for row in rows]
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 17, 100000])
+def test_accumulated_pairs_match_a_single_product(chunk_size):
+	rows = generate_rows()
+	domain_names, pair_counts = count_pairs(rows)
+
+	row_chunks = [rows[i:i + chunk_size] for i in range(0, len(rows), chunk_size)]
+	accumulated_names, accumulated_counts = accumulate_domain_pairs(row_chunks)
+
+	assert list(accumulated_names) == list(domain_names)
+	assert (accumulated_counts.toarray() == pair_counts.toarray()).all()
+	assert (accumulated_counts.row < accumulated_counts.col).all()
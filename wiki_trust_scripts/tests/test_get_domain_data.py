@@ -0,0 +1,43 @@
+import os
+from collections import deque
+import pytest
+
+pytest.importorskip("boto3")
+pytest.importorskip("mysql.connector")
+import get_domain_data
+from alexa_shards import ShardWriter
+
+def read_closed_domains(shard_dir):
+	domains = set()
+	for filename in os.listdir(shard_dir):
+		if filename.endswith(".idx"):
+			with open(os.path.join(shard_dir, filename), encoding = "utf-8") as index_file:
+				domains.update(line.split("\t")[0] for line in index_file)
+	return domains
+
+def test_domains_are_stored_once_their_shard_is_closed(monkeypatch, tmp_path):
+	shard_dir = str(tmp_path)
+	shard_writer = ShardWriter(shard_dir, max_shard_bytes = 300)
+	stored_batches = []
+
+	def store_domain_records(domains_db_data, link_domain_map_db_data, s3_futures):
+		domains = [record["domain"] for record in domains_db_data]
+		assert set(domains) <= read_closed_domains(shard_dir)
+		stored_batches.append(domains)
+
+	monkeypatch.setattr(get_domain_data, "store_domain_records", store_domain_records)
+
+	pending_records = deque()
+	batches = [[f"domain{batch_num}-{i}.org" for i in range(3)] for batch_num in range(6)]
+	for batch_num, domains in enumerate(batches):
+		for domain in domains:
+			shard_writer.append(domain, os.urandom(40))
+
+		get_domain_data.store_sharded_domain_records(pending_records, [{"domain":domain} for domain in domains],
+			[{"processed_link":domain, "domain":domain} for domain in domains], [], shard_writer, final = batch_num == len(batches) - 1)
+
+	assert stored_batches == batches
+	assert not pending_records
+
+	# shards are closed when they pass their size and at the end, not on every batch
+	assert shard_writer.num_closed < len(batches)
@@ -0,0 +1,55 @@
+import gzip, io, os, tarfile
+import pytest
+
+# the dump follows the ndjson layout of wikimedia enterprise html dumps, its article bodies are the synthetic pages
+# also used by the extractor tests, plus a talk page that ingestion must skip
+
+pytest.importorskip("bs4")
+pytest.importorskip("mysql.connector")
+from ingest_wiki_dump import iterate_dump, parse_dump_page
+from scrape_page_references import process_citations_html, format_citation_records
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+DUMP_PATH = os.path.join(FIXTURES_DIR, "synthetic_html_dump.ndjson")
+ARTICLES = {"Stub cite tags":"stub_cite_tags.html", "Reflist column width":"reflist_column_width.html"}
+
+def read_article(title):
+	with open(os.path.join(FIXTURES_DIR, "synthetic_wiki_pages", ARTICLES[title]), encoding = "utf-8") as page_file:
+		return page_file.read()
+
+def write_tar_dump(tmp_path):
+	dump_path = str(tmp_path / "enwiki-NS0-html.json.tar.gz")
+	with open(DUMP_PATH, "rb") as dump_file:
+		dump_bytes = dump_file.read()
+
+	with tarfile.open(dump_path, "w:gz") as dump_tar:
+		member = tarfile.TarInfo("enwiki_namespace_0_0.ndjson")
+		member.size = len(dump_bytes)
+		dump_tar.addfile(member, io.BytesIO(dump_bytes))
+	return dump_path
+
+def write_gzip_dump(tmp_path):
+	dump_path = str(tmp_path / "enwiki-NS0-html.ndjson.gz")
+	with open(DUMP_PATH, "rb") as dump_file, gzip.open(dump_path, "wb") as gzip_file:
+		gzip_file.write(dump_file.read())
+	return dump_path
+
+@pytest.mark.parametrize("write_dump", [lambda tmp_path: DUMP_PATH, write_tar_dump, write_gzip_dump])
+def test_dump_reads_articles_only(tmp_path, write_dump):
+	titles = [title for title, _ in iterate_dump(write_dump(tmp_path))]
+	assert titles == ["Stub cite tags", "Reflist column width"]
+
+@pytest.mark.parametrize("extractor", ["bs4", "stream"])
+def test_dump_citations_match_scraped_html(extractor):
+	for page in iterate_dump(DUMP_PATH):
+		page_data, citation_db_data = parse_dump_page(page, extractor)
+		title, _ = page
+
+		citation_data = process_citations_html(read_article(title), extractor)
+		assert citation_data
+		assert citation_db_data == format_citation_records(page_data["id"], citation_data)
+		assert page_data["id"] == title.replace(" ", "_")
+
+def test_xml_dump_is_refused():
+	with pytest.raises(ValueError):
+		iterate_dump("enwiki-latest-pages-articles.xml.bz2")
@@ -0,0 +1,21 @@
+import pytest
+
+pytest.importorskip("pandas")
+pytest.importorskip("mysql.connector")
+from link_processing import extract_archive_site, process_link
+
+@pytest.mark.parametrize("link_raw, link", [
+	("https://web.archive.org/web/20180101000000/http://www.nytimes.com/a.html", "http://www.nytimes.com/a.html"),
+	("http://archive.li:80/2018.01.01/http://www.bbc.co.uk/news", "http://www.bbc.co.uk/news"),
+	("https://archive.today?run=1&url=https://www.cnn.com/x", "https://www.cnn.com/x"),
+	("https://archive.ph/AbCdE", "https://archive.ph/AbCdE"),
+	("https://archive.library.example.edu/papers/http-guide.pdf", "https://archive.library.example.edu/papers/http-guide.pdf"),
+	("https://web.archive.org.example.com/http://www.nytimes.com/", "https://web.archive.org.example.com/http://www.nytimes.com/"),
+	("https://archive.isoc.org/http/report.html", "https://archive.isoc.org/http/report.html")
+])
+def test_extract_archive_site(link_raw, link):
+	assert extract_archive_site(link_raw) == link
+
+def test_process_link_unwraps_archives_only():
+	assert process_link("https://web.archive.org/web/2018/https://www.theguardian.com/world") == "www.theguardian.com"
+	assert process_link("https://archive.library.example.edu/http://x.org/") == "archive.library.example.edu"
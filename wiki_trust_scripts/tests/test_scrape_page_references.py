@@ -0,0 +1,128 @@
+import asyncio
+import pytest
+
+pytest.importorskip("requests")
+pytest.importorskip("mysql.connector")
+import scrape_page_references
+from html_cache import HtmlCache
+from page_archive import ArchiveWriter, read_index
+
+PAGE_HTML = "<html><body><p>Cached page</p></body></html>"
+FRESH_HTML = "<html><body><p>Fresh page</p></body></html>"
+
+class FakeResponse(object):
+	def __init__(self, status_code, text = "", headers = None):
+		self.status_code = status_code
+		self.text = text
+		self.headers = headers or {}
+
+	def raise_for_status(self):
+		if self.status_code >= 400:
+			raise RuntimeError(self.status_code)
+
+class FakeServer(object):
+	"""
+	Answers 304 to any conditional request and the fresh page otherwise, recording the headers of each request
+	"""
+	def __init__(self):
+		self.requests = []
+
+	def respond(self, headers):
+		headers = headers or {}
+		self.requests.append(headers)
+		if "If-None-Match" in headers:
+			return FakeResponse(304)
+		return FakeResponse(200, FRESH_HTML, {"ETag":'"fresh"'})
+
+class FakeAsyncResponse(object):
+	def __init__(self, response):
+		self.response = response
+		self.status = response.status_code
+		self.headers = response.headers
+
+	async def __aenter__(self):
+		return self
+
+	async def __aexit__(self, *exc_info):
+		return False
+
+	def raise_for_status(self):
+		self.response.raise_for_status()
+
+	async def text(self):
+		return self.response.text
+
+class FakeSession(object):
+	def __init__(self, server):
+		self.server = server
+
+	def get(self, url, headers = None):
+		return FakeAsyncResponse(self.server.respond(headers))
+
+@pytest.fixture
+def stale_cache(tmp_path):
+	"""
+	Cache whose index still has validators for the page after its html object was removed
+	"""
+	cache = HtmlCache(str(tmp_path))
+	cache.store("Example", PAGE_HTML, {"ETag":'"cached"'})
+	cache.delete_object(cache.get_entry("Example")["content_hash"])
+	return cache
+
+def test_fetch_after_cached_html_is_gone(monkeypatch, stale_cache):
+	server = FakeServer()
+	monkeypatch.setattr(scrape_page_references.requests, "get", lambda url, headers = None: server.respond(headers))
+
+	assert scrape_page_references.fetch_page_html("Example", stale_cache) == FRESH_HTML
+	assert [headers.get("If-None-Match") for headers in server.requests] == ['"cached"', None]
+	assert stale_cache.load("Example") == FRESH_HTML
+
+def test_async_fetch_after_cached_html_is_gone(stale_cache):
+	server = FakeServer()
+
+	page_text = asyncio.run(scrape_page_references.fetch_page(FakeSession(server), "Example", stale_cache))
+	assert page_text == FRESH_HTML
+	assert [headers.get("If-None-Match") for headers in server.requests] == ['"cached"', None]
+	assert stale_cache.load("Example") == FRESH_HTML
+
+def test_fetch_answers_304_from_cache(monkeypatch, tmp_path):
+	cache = HtmlCache(str(tmp_path))
+	cache.store("Example", PAGE_HTML, {"ETag":'"cached"'})
+	server = FakeServer()
+	monkeypatch.setattr(scrape_page_references.requests, "get", lambda url, headers = None: server.respond(headers))
+
+	assert scrape_page_references.fetch_page_html("Example", cache) == PAGE_HTML
+	assert len(server.requests) == 1
+
+def test_reparse_skips_uncached_and_failing_pages(monkeypatch, tmp_path, stale_cache):
+	stored = []
+	def store_page_citations(page_id, citation_db_data):
+		if page_id == "Broken":
+			raise RuntimeError("db is down")
+		stored.append(page_id)
+
+	stale_cache.store("Broken", FRESH_HTML, {})
+	stale_cache.store("Working", FRESH_HTML, {})
+	monkeypatch.setattr(scrape_page_references, "store_page_citations", store_page_citations)
+
+	for page_id in ["Example", "Missing", "Broken", "Working"]:
+		scrape_page_references.reparse_page(page_id, cache_dir = str(tmp_path))
+	assert stored == ["Working"]
+
+def test_parse_archived_chunk_sets_aside_failing_pages(monkeypatch, tmp_path):
+	writer = ArchiveWriter(str(tmp_path))
+	for page_id in ["First", "Broken", "Last"]:
+		writer.append(page_id, f"https://en.wikipedia.org/wiki/{page_id}", PAGE_HTML.encode("utf-8"))
+	writer.close()
+
+	def generate_citation_records(page_id, page_text, extractor):
+		if page_id == "Broken":
+			raise ValueError("unparseable page")
+		return [{"page_id":page_id}]
+
+	monkeypatch.setattr(scrape_page_references, "generate_citation_records", generate_citation_records)
+	(chunk,) = read_index(str(tmp_path)).items()
+
+	pages_citations, failed_page_ids = scrape_page_references.parse_archived_chunk(chunk)
+	assert [page_id for page_id, _ in pages_citations] == ["First", "Last"]
+	assert failed_page_ids == ["Broken"]